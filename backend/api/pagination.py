@@ -0,0 +1,47 @@
+from rest_framework.pagination import CursorPagination
+
+
+class IdCursorPagination(CursorPagination):
+    """
+    Keyset pagination over the primary key, stable as rows are added.
+    Oldest first, or newest first with ?ordering=-id.
+    """
+    ordering = 'id'
+    ordering_query_param = 'ordering'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def get_ordering(self, request, queryset, view):
+        if request.query_params.get(self.ordering_query_param) == '-id':
+            return ('-id',)
+        return super().get_ordering(request, queryset, view)
+
+
+def sparse_fieldset_context(request):
+    """
+    Serializer context for ?fields= and ?expand= (comma separated names),
+    consumed by serializers.DynamicFieldsMixin.
+    """
+    context = {}
+    for param in ('fields', 'expand'):
+        if param in request.query_params:
+            context[param] = [
+                name.strip() for name in request.query_params[param].split(',') if name.strip()
+            ]
+    return context
+
+
+def serialize_list(request, queryset, serializer_class):
+    """
+    Serialize a list endpoint a page at a time ({next, previous, results},
+    see IdCursorPagination), applying sparse fieldsets. Pages hold
+    IdCursorPagination.page_size rows, or ?page_size= up to max_page_size,
+    so a response stays bounded however large the table grows.
+    """
+    context = sparse_fieldset_context(request)
+
+    paginator = IdCursorPagination()
+    page = paginator.paginate_queryset(queryset, request)
+    sz = serializer_class(page, many=True, context=context)
+    return paginator.get_paginated_response(sz.data)
@@ -2,8 +2,10 @@ import base64
 from django.urls import reverse
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from rest_framework import serializers
+from django.db.models import OuterRef, Prefetch, Subquery
 
 from stripeInt.models import StripeProd
+from tutoring.images import thumbnail_urls
 from tutoring.models import Attendance, Group, Lesson, LocalInvoice, Parent, Resource, TutoringStudent
 
 class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
@@ -23,10 +25,62 @@ class MyTokenObtainPairSerializer(TokenObtainPairSerializer):
         
         return data
 
+class DynamicFieldsMixin:
+    """
+    Sparse fieldsets driven by the serializer context (see api.pagination):
+    - 'fields': only these fields are serialized on the top-level objects
+    - 'expand': nested serializers named in Meta.expandable_fields are only
+      expanded when listed here, at any depth; the rest become primary keys
+    Without either, every field is serialized and expanded.
+    """
+    def get_fields(self):
+        fields = super().get_fields()
+        
+        only = self.context.get('fields')
+        if only is not None and self._is_top_level():
+            for name in set(fields) - set(only):
+                fields.pop(name)
+        
+        expand = self.context.get('expand')
+        if expand is not None:
+            for name in getattr(self.Meta, 'expandable_fields', ()):
+                if name in fields and name not in expand:
+                    many = isinstance(fields[name], serializers.ListSerializer)
+                    fields[name] = serializers.PrimaryKeyRelatedField(many=many, read_only=True)
+        
+        return fields
+    
+    def _is_top_level(self):
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        return parent is None
+    
+    @classmethod
+    def serialized_expandable_fields(cls, context):
+        """
+        The Meta.expandable_fields a top-level serializer with this context
+        outputs, as (expanded, primary keys only), so eager loading can skip
+        the relations left out of the response
+        """
+        only = context.get('fields')
+        expand = context.get('expand')
+        expanded, keys = [], []
+        for name in cls.Meta.expandable_fields:
+            if only is not None and name not in only:
+                continue
+            (expanded if expand is None or name in expand else keys).append(name)
+        return expanded, keys
+    
+    @staticmethod
+    def nested_context(context):
+        """The context as nested serializers see it: 'fields' only applies at the top"""
+        return {'expand': context['expand']} if 'expand' in context else {}
+
 class StripeProdSerializer(serializers.ModelSerializer):
     class Meta:
         model = StripeProd
-        fields = '__all__'
+        exclude = ['stripeUpdated']
 
 class LocalInvoiceSerializer(serializers.ModelSerializer):
     """
@@ -85,7 +139,9 @@ class LocalInvoiceSerializer(serializers.ModelSerializer):
         return obj.amount_due / 100
     
     def get_customer_name(self, obj):
-        """Get customer name from Parent model"""
+        """Get customer name from Parent model, or the parent_name annotation if present"""
+        if hasattr(obj, 'parent_name'):
+            return obj.parent_name
         try:
             parent = Parent.objects.get(stripeId=obj.customer_stripe_id)
             return parent.name
@@ -104,11 +160,30 @@ class LocalInvoiceSerializer(serializers.ModelSerializer):
             return obj.status_transitions_paid_at.strftime("%B %d, %Y at %I:%M %p")
         return None
 
-class AttendanceSerializer(serializers.ModelSerializer):
+class AttendanceSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     local_invoice = LocalInvoiceSerializer(read_only=True)
     class Meta:
         model = Attendance
         fields = '__all__'
+        read_only_fields = ['version']
+        expandable_fields = ['local_invoice']
+
+    @staticmethod
+    def setup_eager_loading(queryset, context=None):
+        """
+        Load the invoices serialized with the given context and their
+        attendances up front, in a fixed number of queries
+        """
+        expanded, _ = AttendanceSerializer.serialized_expandable_fields(context or {})
+        if 'local_invoice' not in expanded:
+            return queryset
+        
+        invoices = LocalInvoice.objects.annotate(
+            parent_name=Subquery(
+                Parent.objects.filter(stripeId=OuterRef('customer_stripe_id')).values('name')[:1]
+            )
+        ).prefetch_related('attendances')
+        return queryset.prefetch_related(Prefetch('local_invoice', queryset=invoices))
 
 class ResourceSerializer(serializers.ModelSerializer):
     
@@ -116,23 +191,88 @@ class ResourceSerializer(serializers.ModelSerializer):
         model = Resource
         fields = "__all__"
 
-class LessonSerializer(serializers.ModelSerializer):
+class PrefetchedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField resolving primary keys from the dict of objects
+    in context[context_key] when there is one, so validating a list of items
+    doesn't query once per item. Keys missing from it are looked up as usual.
+    """
+    def __init__(self, context_key, **kwargs):
+        self.context_key = context_key
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        objects = self.context.get(self.context_key)
+        if objects is not None and type(data) is int and data in objects:
+            return objects[data]
+        return super().to_internal_value(data)
+
+class LessonSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    group = PrefetchedPrimaryKeyRelatedField('groups', queryset=Group.objects.all())
     attendances = AttendanceSerializer(many=True, read_only=True)
     resources = ResourceSerializer(many=True, read_only=True)
 
     class Meta:
         model = Lesson
         fields = '__all__'
+        expandable_fields = ['attendances', 'resources']
 
-class TutoringStudentSerializer(serializers.ModelSerializer):
+    @staticmethod
+    def setup_eager_loading(queryset, context=None):
+        """
+        Load the resources and attendances serialized with the given context
+        up front, in a fixed number of queries
+        """
+        context = context or {}
+        expanded, keys = LessonSerializer.serialized_expandable_fields(context)
+        lookups = [*expanded, *keys]
+        if 'attendances' in expanded:
+            attendances = AttendanceSerializer.setup_eager_loading(
+                Attendance.objects.all(),
+                LessonSerializer.nested_context(context)
+            )
+            lookups[lookups.index('attendances')] = Prefetch('attendances', queryset=attendances)
+        return queryset.prefetch_related(*lookups)
+
+class TutoringStudentSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = TutoringStudent
         fields = '__all__'
 
-class GroupSerializer(serializers.ModelSerializer):
+class GroupSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     associated_product = StripeProdSerializer()
     lessons = LessonSerializer(many=True, read_only=True)
     tutoringStudents = TutoringStudentSerializer(many=True, read_only=True)
+    image_thumbnails = serializers.SerializerMethodField()
     class Meta:
         model = Group
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+        expandable_fields = ['associated_product', 'lessons', 'tutoringStudents']
+
+    def get_image_thumbnails(self, obj):
+        """URLs of the thumbnail variants of the group image"""
+        return thumbnail_urls(obj.image)
+
+    @staticmethod
+    def setup_eager_loading(queryset, context=None):
+        """
+        Load the nested tree serialized with the given context (by default
+        all of it) up front so serializing any number of groups takes a
+        fixed number of queries
+        """
+        context = context or {}
+        expanded, keys = GroupSerializer.serialized_expandable_fields(context)
+
+        if 'associated_product' in expanded:
+            queryset = queryset.select_related('associated_product')
+        if 'lessons' in expanded:
+            lessons = LessonSerializer.setup_eager_loading(
+                Lesson.objects.all(),
+                GroupSerializer.nested_context(context)
+            )
+            queryset = queryset.prefetch_related(Prefetch('lessons', queryset=lessons))
+        if 'tutoringStudents' in expanded:
+            students = TutoringStudent.objects.prefetch_related('group')
+            queryset = queryset.prefetch_related(Prefetch('tutoringStudents', queryset=students))
+        # the rest are serialized as primary keys
+        return queryset.prefetch_related(*(name for name in keys if name != 'associated_product'))
\ No newline at end of file
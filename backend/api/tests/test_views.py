@@ -1,12 +1,27 @@
 import datetime
 import json
+import os
+import shutil
+import tempfile
+from io import BytesIO
 from pathlib import Path
+from unittest.mock import MagicMock, patch
+from PIL import Image
 from rest_framework.test import APITestCase
+from api.pagination import IdCursorPagination
 from stripeInt.models import StripeProd
-from tutoring.models import Group, Lesson, Parent, Resource, TutoringStudent, Attendance
+from tutoring import invoice_cache
+from tutoring.images import thumbnail_name
+from tutoring.models import Group, Lesson, LocalInvoice, Parent, Resource, TutoringStudent, Attendance, DailyAttendanceRollup, create_lessons
 from rest_framework import status
 from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import default_storage
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 
 def strip_ids(obj):
     """
@@ -55,7 +70,7 @@ class GroupApiTest(APITestCase):
         )
 
     def test_list_all_groups(self):
-        actual = self.client.get('/api/groups/').data
+        actual = self.client.get('/api/groups/').data['results']
         expected = json.loads(
             (Path(__file__).parent / "fixtures/GroupApiTest/test_list_all_groups.json").read_text()
         )
@@ -72,6 +87,223 @@ class GroupApiTest(APITestCase):
 
 
 
+    @patch.object(IdCursorPagination, 'page_size', 2)
+    def test_list_groups_paginated_by_default(self):
+        response = self.client.get('/api/groups/')
+        self.assertEqual([g['tutor'] for g in response.data['results']], ['Alice', 'Bob'])
+        self.assertIsNotNone(response.data['next'])
+
+    @patch.object(IdCursorPagination, 'max_page_size', 2)
+    def test_list_groups_page_size_capped(self):
+        response = self.client.get('/api/groups/', {'page_size': 1000})
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_list_groups_cursor_pagination(self):
+        response = self.client.get('/api/groups/', {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([g['tutor'] for g in response.data['results']], ['Alice', 'Bob'])
+        self.assertIsNone(response.data['previous'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([g['tutor'] for g in response.data['results']], ['Charlie'])
+        self.assertIsNone(response.data['next'])
+
+    def test_list_groups_newest_first(self):
+        response = self.client.get('/api/groups/', {'page_size': 2, 'ordering': '-id'})
+        self.assertEqual([g['tutor'] for g in response.data['results']], ['Charlie', 'Bob'])
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual([g['tutor'] for g in response.data['results']], ['Alice'])
+        self.assertIsNone(response.data['next'])
+
+    def test_list_groups_sparse_fields(self):
+        response = self.client.get('/api/groups/', {'fields': 'id,tutor'})
+        self.assertEqual([set(g) for g in response.data['results']], [{'id', 'tutor'}] * 3)
+
+    def test_list_groups_expand(self):
+        group = Group.objects.get(tutor="Alice")
+        student = TutoringStudent.objects.create(
+            name="Student", parent=Parent.objects.create(stripeId="cus_test123")
+        )
+        group.tutoringStudents.add(student)
+
+        response = self.client.get('/api/groups/', {'fields': 'tutor,associated_product,tutoringStudents', 'expand': 'associated_product'})
+        alice = next(g for g in response.data['results'] if g['tutor'] == "Alice")
+        self.assertEqual(alice['associated_product']['stripeId'], "prod_test123")
+        self.assertEqual(alice['tutoringStudents'], [student.id])
+
+        response = self.client.get('/api/groups/', {'fields': 'tutor,tutoringStudents', 'expand': 'tutoringStudents'})
+        alice = next(g for g in response.data['results'] if g['tutor'] == "Alice")
+        self.assertEqual(alice['tutoringStudents'][0]['name'], "Student")
+
+class GroupImageTests(APITestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        storages = override_settings(
+            STORAGES={
+                # overwrites files with the same name, like the S3 storage in prod
+                "default": {"BACKEND": "django.core.files.storage.FileSystemStorage", "OPTIONS": {"allow_overwrite": True}},
+                "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+            },
+            MEDIA_ROOT=self.media_root,
+            MEDIA_URL="/media/",
+        )
+        storages.enable()
+        self.addCleanup(storages.disable)
+
+    def upload(self, size, color="red"):
+        buffer = BytesIO()
+        Image.new("RGB", size, color).save(buffer, format="PNG")
+        return SimpleUploadedFile("photo.png", buffer.getvalue(), content_type="image/png")
+
+    def test_group_image_stored_with_thumbnails(self):
+        group = Group.objects.create(lesson_length=1, tutor="Alice", image=self.upload((1200, 600)))
+        self.assertRegex(group.image.name, r'^groups/[0-9a-f]{32}\.png$')
+        root = Path(group.image.name).stem
+
+        response = self.client.get(f'/api/groups/{group.id}/')
+        self.assertEqual(response.data['image'], f"/media/{group.image.name}")
+        self.assertEqual(response.data['image_thumbnails'], {
+            'small': f"/media/groups/thumbnails/small/{root}.jpg",
+            'medium': f"/media/groups/thumbnails/medium/{root}.jpg",
+        })
+
+        with default_storage.open(f"groups/thumbnails/small/{root}.jpg") as thumbnail:
+            self.assertEqual(Image.open(thumbnail).size, (160, 80))
+
+    def test_same_filename_keeps_images_apart(self):
+        red = Group.objects.create(lesson_length=1, tutor="Alice", image=self.upload((200, 100), "red"))
+        blue = Group.objects.create(lesson_length=1, tutor="Bob", image=self.upload((100, 200), "blue"))
+
+        self.assertNotEqual(red.image.name, blue.image.name)
+        for group, size, color in [(red, (200, 100), (255, 0, 0)), (blue, (100, 200), (0, 0, 255))]:
+            with default_storage.open(group.image.name) as image:
+                self.assertEqual(Image.open(image).size, size)
+            with default_storage.open(thumbnail_name(group.image.name, 'small')) as thumbnail:
+                thumbnail = Image.open(thumbnail)
+                self.assertEqual(thumbnail.size, (160, 80) if size[0] > size[1] else (80, 160))
+                self.assertTrue(all(abs(a - b) < 10 for a, b in zip(thumbnail.getpixel((40, 40)), color)))
+
+    def test_group_without_image(self):
+        group = Group.objects.create(lesson_length=1, tutor="Alice")
+
+        response = self.client.get(f'/api/groups/{group.id}/')
+        self.assertIsNone(response.data['image'])
+        self.assertIsNone(response.data['image_thumbnails'])
+
+class GroupQueryCountTests(APITestCase):
+    """The group, lesson and attendance endpoints load the nested tree in a fixed number of queries"""
+    # groups, lessons, resources, attendances, invoices,
+    # invoice attendances, students, student groups
+    EXPECTED_QUERIES = 8
+
+    def setUp(self):
+        self.prod = StripeProd.objects.create(
+            stripeId="prod_test123",
+            defaultPriceId="price_test123",
+            name="Tutoring Product",
+            is_active=True
+        )
+        self.parent = Parent.objects.create(name="Parent", stripeId="cus_test123")
+        self.create_groups(2)
+
+    def create_groups(self, count):
+        for i in range(count):
+            group = Group.objects.create(
+                lesson_length=1,
+                associated_product=self.prod,
+                tutor=f"Tutor {i}",
+                course=Group.CourseChoices.JUNIOR_MATHS,
+                day_of_week=Group.Weekday.MONDAY,
+                time_of_day=datetime.time(16, 0)
+            )
+            for j in range(2):
+                student = TutoringStudent.objects.create(name=f"Student {i}.{j}", parent=self.parent)
+                group.tutoringStudents.add(student)
+            for day in range(1, 3):
+                # attendances are created by the post_save signal
+                Lesson.objects.create(group=group, date=datetime.datetime(2025, 1, day, tzinfo=datetime.timezone.utc))
+
+            invoice = LocalInvoice.objects.create(
+                stripeInvoiceId=f"in_{group.id}",
+                status="paid",
+                amount_due=1000,
+                amount_paid=1000,
+                created=datetime.datetime(2025, 1, 3, tzinfo=datetime.timezone.utc),
+                customer_stripe_id=self.parent.stripeId
+            )
+            Attendance.objects.filter(lesson__group=group).update(local_invoice=invoice)
+
+    def test_list_groups_query_count(self):
+        with self.assertNumQueries(self.EXPECTED_QUERIES):
+            response = self.client.get('/api/groups/')
+        self.assertEqual(len(response.data['results']), 2)
+
+        invoice = response.data['results'][0]['lessons'][0]['attendances'][0]['local_invoice']
+        self.assertEqual(invoice['customer_name'], "Parent")
+        self.assertEqual(len(invoice['attendances']), 4)
+
+        self.create_groups(3)
+        with self.assertNumQueries(self.EXPECTED_QUERIES):
+            response = self.client.get('/api/groups/')
+        self.assertEqual(len(response.data['results']), 5)
+
+    def test_group_detail_query_count(self):
+        group = Group.objects.first()
+        with self.assertNumQueries(self.EXPECTED_QUERIES):
+            response = self.client.get(f'/api/groups/{group.id}/')
+        self.assertEqual(len(response.data['lessons']), 2)
+        self.assertEqual(len(response.data['tutoringStudents']), 2)
+
+    def test_list_lessons_query_count(self):
+        # lessons, resources, attendances, invoices, invoice attendances
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/lessons/all/')
+        self.assertEqual(len(response.data['results']), 4)
+        self.assertEqual(response.data['results'][0]['attendances'][0]['local_invoice']['customer_name'], "Parent")
+
+        self.create_groups(3)
+        with self.assertNumQueries(5):
+            response = self.client.get('/api/lessons/all/')
+        self.assertEqual(len(response.data['results']), 10)
+
+    def test_list_attendances_query_count(self):
+        # attendances, invoices, invoice attendances
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/attendances/')
+        self.assertEqual(len(response.data['results']), 8)
+        self.assertEqual(response.data['results'][0]['local_invoice']['customer_name'], "Parent")
+
+        self.create_groups(3)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/attendances/')
+        self.assertEqual(len(response.data['results']), 20)
+
+    def test_sparse_fields_skip_eager_loading(self):
+        # only the relations in the response are loaded
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/groups/', {'fields': 'id,course,associated_product'})
+        self.assertEqual(response.data['results'][0]['associated_product']['name'], "Tutoring Product")
+
+        # groups, lessons, students
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/groups/', {'expand': 'associated_product'})
+        self.assertEqual(len(response.data['results'][0]['lessons']), 2)
+
+        with self.assertNumQueries(1):
+            self.client.get('/api/lessons/all/', {'fields': 'id,date,group'})
+
+        # lessons, attendances
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/lessons/all/', {'fields': 'id,attendances', 'expand': 'attendances'})
+        attendance = response.data['results'][0]['attendances'][0]
+        self.assertEqual(attendance['local_invoice'], LocalInvoice.objects.first().id)
+
+        with self.assertNumQueries(1):
+            self.client.get('/api/attendances/', {'expand': ''})
+
 class BulkAddAttendancesTests(APITestCase):
     def setUp(self):
         # 1. Create Stripe Product (required for Group.associated_product)
@@ -377,4 +609,277 @@ class EditAttendanceTests(APITestCase):
         response = self.client.put(self.url, data, format="json")
         
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
-        self.assertIn("lesson", response.data)
\ No newline at end of file
+        self.assertIn("lesson", response.data)
+
+class CreateLessonsTests(APITestCase):
+    def setUp(self):
+        self.group = Group.objects.create(tutor="Alice", lesson_length=1)
+        self.other_group = Group.objects.create(tutor="Bob", lesson_length=1)
+        parent = Parent.objects.create(name="Mr Smith", stripeId="cus_test123")
+        for i in range(4):
+            student = TutoringStudent.objects.create(name=f"Student {i}", parent=parent)
+            student.group.add(self.group)
+        student.group.add(self.other_group)
+
+    def attendance_inserts(self, queries):
+        return [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "tutoring_attendance"')]
+
+    def test_signal_creates_attendances_in_one_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            lesson = Lesson.objects.create(group=self.group, date=datetime.datetime(2025, 1, 6, tzinfo=datetime.timezone.utc))
+
+        self.assertEqual(lesson.attendances.count(), 4)
+        self.assertEqual(len(self.attendance_inserts(queries)), 1)
+        self.assertEqual(DailyAttendanceRollup.objects.get(group=self.group).total, 4)
+
+    def test_create_lessons_batch(self):
+        lessons = [
+            Lesson(group=group, date=datetime.datetime(2025, 1, day, tzinfo=datetime.timezone.utc))
+            for group in (self.group, self.other_group)
+            for day in (6, 13, 20)
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            lessons = create_lessons(lessons)
+
+        self.assertTrue(all(lesson.id for lesson in lessons))
+        self.assertEqual(Attendance.objects.filter(lesson__group=self.group).count(), 12)
+        self.assertEqual(Attendance.objects.filter(lesson__group=self.other_group).count(), 3)
+        self.assertEqual(len(self.attendance_inserts(queries)), 1)
+        self.assertEqual(DailyAttendanceRollup.objects.filter(group=self.group).count(), 3)
+
+    def test_create_lessons_query_count_independent_of_batch_size(self):
+        lessons = [
+            Lesson(group=group, date=datetime.datetime(2025, 1, 6, tzinfo=datetime.timezone.utc) + datetime.timedelta(weeks=week))
+            for group in (self.group, self.other_group)
+            for week in range(20)
+        ]
+
+        # savepoint, lessons, students, attendances, rollup aggregate, rollup upsert, release
+        with self.assertNumQueries(7):
+            create_lessons(lessons)
+
+        self.assertEqual(Attendance.objects.count(), 20 * 4 + 20 * 1)
+        self.assertEqual(DailyAttendanceRollup.objects.count(), 40)
+
+    def test_post_list_of_lessons(self):
+        response = self.client.post(reverse('addLessons'), [
+            {'group': self.group.id, 'date': '2025-01-06T10:00:00Z', 'notes': 'Week 1'},
+            {'group': self.group.id, 'date': '2025-01-13T10:00:00Z', 'notes': 'Week 2'},
+        ], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([lesson['notes'] for lesson in response.data], ['Week 1', 'Week 2'])
+        self.assertEqual(len(response.data[0]['attendances']), 4)
+
+    def test_post_list_query_count_independent_of_batch_size(self):
+        def post(weeks):
+            start = datetime.datetime(2025, 1, 6, 10, tzinfo=datetime.timezone.utc) + datetime.timedelta(weeks=len(counts) * 50)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(reverse('addLessons'), [
+                    {'group': group.id, 'date': (start + datetime.timedelta(weeks=week)).isoformat()}
+                    for group in (self.group, self.other_group)
+                    for week in range(weeks)
+                ], format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data), 2 * weeks)
+            counts.append(len(queries.captured_queries))
+
+        counts = []
+        post(1)
+        post(20)
+
+        self.assertEqual(counts[0], counts[1])
+        # groups, savepoint, lessons, students, attendances, rollup aggregate and upsert,
+        # release, then the lessons with their attendances and resources for the response
+        self.assertEqual(counts[1], 11)
+
+    def test_post_invalid_list_creates_nothing(self):
+        response = self.client.post(reverse('addLessons'), [
+            {'group': self.group.id, 'date': '2025-01-06T10:00:00Z'},
+            {'group': self.group.id},
+        ], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Lesson.objects.exists())
+
+
+class MarkAttendancesTests(APITestCase):
+    def setUp(self):
+        self.group = Group.objects.create(tutor="Alice", lesson_length=1)
+        parent = Parent.objects.create(name="Mr Smith", stripeId="cus_test123")
+        for i in range(30):
+            student = TutoringStudent.objects.create(name=f"Student {i}", parent=parent)
+            student.group.add(self.group)
+        self.lesson = Lesson.objects.create(group=self.group, date=datetime.datetime(2025, 1, 6, tzinfo=datetime.timezone.utc))
+        self.attendances = list(self.lesson.attendances.order_by('id'))
+        self.url = reverse('markAttendances')
+
+    def test_marks_whole_roll(self):
+        rows = [[attendance.id, True, i % 2 == 0, False] for i, attendance in enumerate(self.attendances)]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, rows, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [{'id': attendance.id, 'version': 1} for attendance in self.attendances])
+        self.assertEqual(Attendance.objects.filter(lesson=self.lesson, present=True).count(), 30)
+        self.assertEqual(Attendance.objects.filter(lesson=self.lesson, homework=True).count(), 15)
+        # one read and one bulk update, besides refreshing the rollup
+        sql = [q['sql'] for q in queries.captured_queries]
+        self.assertEqual(len([q for q in sql if q.startswith('SELECT "tutoring_attendance"."id"')]), 1)
+        self.assertEqual(len([q for q in sql if q.startswith('UPDATE "tutoring_attendance"')]), 1)
+        rollup = DailyAttendanceRollup.objects.get(group=self.group)
+        self.assertEqual((rollup.present, rollup.homework), (30, 15))
+
+    def test_unchanged_rows_keep_version(self):
+        first, second = self.attendances[:2]
+        response = self.client.post(self.url, [[first.id, True, False, False], [second.id, False, False, False]], format='json')
+
+        self.assertEqual(response.data, [{'id': first.id, 'version': 1}, {'id': second.id, 'version': 0}])
+
+    def test_version_conflict(self):
+        attendance = self.attendances[0]
+        self.client.post(self.url, [[attendance.id, True, False, False, 0]], format='json')
+
+        response = self.client.post(self.url, [[attendance.id, False, False, False, 0]], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data, {'conflicts': [{'id': attendance.id, 'version': 1}]})
+        self.assertTrue(Attendance.objects.get(id=attendance.id).present)
+
+    def test_unknown_attendance_rejected(self):
+        response = self.client.post(self.url, [[self.attendances[0].id, True, False, False], [999999, True, False, False]], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Attendance.objects.filter(present=True).exists())
+
+    def test_malformed_rows_rejected(self):
+        response = self.client.post(self.url, [[self.attendances[0].id, 'yes', False, False], [self.attendances[1].id, True]], format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(response.data['errors']), 2)
+
+    def test_edit_bumps_version(self):
+        attendance = self.attendances[0]
+        attendance.present = True
+        attendance.save()
+
+        self.assertEqual(Attendance.objects.get(id=attendance.id).version, 1)
+
+
+class GetFullInvoiceTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        env = patch.dict(os.environ, {'STRIPE_SECRET_KEY': 'sk_test_fake'})
+        env.start()
+        self.addCleanup(env.stop)
+        self.invoice = LocalInvoice.objects.create(
+            stripeInvoiceId="in_cached",
+            status="open",
+            amount_due=5000,
+            created=datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc),
+            customer_stripe_id="cus_test123"
+        )
+        self.url = reverse('getFullInvoice', args=["in_cached"])
+
+    def stripe_invoice(self, status):
+        stripe_invoice = MagicMock()
+        stripe_invoice.to_dict.return_value = {'id': "in_cached", 'status': status, 'amount_due': 5000}
+        return stripe_invoice
+
+    @patch("stripe.InvoiceService.retrieve")
+    def test_repeat_requests_skip_stripe(self, mock_retrieve):
+        mock_retrieve.return_value = self.stripe_invoice('open')
+
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(second.data['status'], 'open')
+        mock_retrieve.assert_called_once_with("in_cached")
+
+    @patch("stripe.InvoiceService.retrieve")
+    def test_invoice_change_invalidates(self, mock_retrieve):
+        mock_retrieve.return_value = self.stripe_invoice('open')
+        self.client.get(self.url)
+
+        mock_retrieve.return_value = self.stripe_invoice('paid')
+        self.invoice.status = 'paid'
+        self.invoice.save()
+
+        self.assertEqual(self.client.get(self.url).data['status'], 'paid')
+        self.assertEqual(mock_retrieve.call_count, 2)
+
+    def post_paid_event(self):
+        with patch("stripe.Webhook.construct_event") as mock_construct_event:
+            mock_construct_event.return_value = {
+                'id': 'evt_paid',
+                'type': 'invoice.paid',
+                'created': 1735776000,
+                'data': {
+                    'object': {
+                        'id': "in_cached",
+                        'status': 'paid',
+                        'amount_due': 5000,
+                        'amount_paid': 5000,
+                        'currency': 'usd',
+                        'created': 1735689600,
+                        'status_transitions': {'paid_at': 1735776000},
+                        'customer': 'cus_test123'
+                    }
+                }
+            }
+            self.client.post("/stripe/webhooks/", data=b"{}", content_type="application/json", HTTP_STRIPE_SIGNATURE="fake_signature")
+
+    @patch("stripe.InvoiceService.retrieve")
+    def test_invoice_webhook_invalidates(self, mock_retrieve):
+        mock_retrieve.return_value = self.stripe_invoice('open')
+        self.client.get(self.url)
+
+        self.post_paid_event()
+
+        mock_retrieve.return_value = self.stripe_invoice('paid')
+        self.assertEqual(self.client.get(self.url).data['status'], 'paid')
+        self.assertEqual(mock_retrieve.call_count, 2)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'django_cache'}})
+    @patch("stripe.InvoiceService.retrieve")
+    def test_worker_invalidation_reaches_web(self, mock_retrieve):
+        call_command('createcachetable', verbosity=0)
+        mock_retrieve.return_value = self.stripe_invoice('open')
+        self.client.get(self.url)
+
+        # the webhook is applied on a qcluster worker, whose cache shares nothing with the web process but the database
+        with patch('tutoring.invoice_cache.cache', caches.create_connection('default')):
+            self.post_paid_event()
+
+        mock_retrieve.return_value = self.stripe_invoice('paid')
+        self.assertEqual(self.client.get(self.url).data['status'], 'paid')
+
+    @patch("stripe.InvoiceService.retrieve")
+    def test_final_invoices_cached_without_expiry(self, mock_retrieve):
+        mock_retrieve.return_value = self.stripe_invoice('paid')
+
+        with patch.object(invoice_cache.cache, 'set', wraps=invoice_cache.cache.set) as mock_set:
+            self.client.get(self.url)
+
+        mock_set.assert_called_once()
+        self.assertIsNone(mock_set.call_args.kwargs['timeout'])
+
+    @patch("stripe.InvoiceService.retrieve")
+    def test_open_invoices_expire(self, mock_retrieve):
+        mock_retrieve.return_value = self.stripe_invoice('open')
+
+        with patch.object(invoice_cache.cache, 'set', wraps=invoice_cache.cache.set) as mock_set:
+            self.client.get(self.url)
+
+        self.assertEqual(mock_set.call_args.kwargs['timeout'], invoice_cache.CACHE_TIMEOUT)
+
+    @patch("stripe.InvoiceService.retrieve")
+    def test_unknown_invoice_not_found(self, mock_retrieve):
+        response = self.client.get(reverse('getFullInvoice', args=["in_missing"]))
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        mock_retrieve.assert_not_called()
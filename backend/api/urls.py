@@ -9,6 +9,7 @@ from .views import (
     editAttendance, 
     getUpdateDeleteGroupView,
     bulkAddAttendances, 
+    markAttendances,
     addLessons, 
     getEditDeleteLessons, 
     addResource,
@@ -31,6 +32,7 @@ urlpatterns = [
     path('groups/<int:id>/', getUpdateDeleteGroupView.as_view(), name='getUpdateDeleteGroupView'),
     path('attendances/', getAllAttendances.as_view(), name='getAllAttendances'),
     path('attendances/bulk/', bulkAddAttendances.as_view(), name='bulkAddAttendances'),
+    path('attendances/mark/', markAttendances.as_view(), name='markAttendances'),
     path('attendances/<int:id>/', editAttendance.as_view(), name='editAttendance'),
     path('lessons/', addLessons.as_view(), name='addLessons'),
     path('lessons/<int:pk>/', getEditDeleteLessons.as_view(), name='getEditDeleteLessons'),
@@ -41,5 +43,6 @@ urlpatterns = [
     path('lessons/all/', getAllLessons.as_view(), name='getAllLessons'),
     path('lessons/detail/<int:id>/', getLessonById.as_view(), name='getLessonById'),
     path('dashboard/', DashboardView.as_view(), name='dashboard'),
+    path('dashboard/<slug:section>/', DashboardView.as_view(), name='dashboardSection'),
     path('', include(router.urls)),
 ]
\ No newline at end of file
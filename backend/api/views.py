@@ -1,4 +1,6 @@
+import functools
 import os
+import threading
 import boto3
 from django.http import StreamingHttpResponse
 import requests
@@ -9,18 +11,27 @@ from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework.views import APIView
 from rest_framework import status
 
-from tutoring.models import Attendance, Group, Lesson, LocalInvoice, Resource, TutoringStudent
+from tutoring.models import Attendance, Group, Lesson, LocalInvoice, Resource, TutoringStudent, create_lessons
 from .serializers import AttendanceSerializer, LessonSerializer, MyTokenObtainPairSerializer, GroupSerializer, ResourceSerializer, TutoringStudentSerializer
+from .pagination import serialize_list, sparse_fieldset_context
 from django.db import IntegrityError
 from rest_framework.exceptions import ValidationError
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from django.db.models import Count, Q, Avg, Sum, Case, When, FloatField, F
+from django.db.models import Count, Q, Avg, Sum, Max, Case, When, FloatField, F, Window
 from django.db.models.functions import TruncWeek, TruncMonth
 from datetime import datetime, timedelta, timezone
-from tutoring.models import TutoringStudent, Attendance, Lesson, LocalInvoice, Group
-from collections import defaultdict
+from tutoring.models import TutoringStudent, Attendance, Lesson, LocalInvoice, Group, DailyAttendanceRollup, DailyRevenueRollup
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from tutoring import dashboard_cache, invoice_cache
+from tutoring.rollups import day_range, touch, utc_day
 
 
 
@@ -29,13 +40,12 @@ class MyTokenObtainPairView(TokenObtainPairView):
 
 class ListOrCreateGroupView(APIView):
     def get(self, request):
-        groups = Group.objects.all()
-        sz = GroupSerializer(groups, many=True)
-        return Response(sz.data)
+        groups = GroupSerializer.setup_eager_loading(Group.objects.all(), sparse_fieldset_context(request))
+        return serialize_list(request, groups, GroupSerializer)
 
 class getUpdateDeleteGroupView(APIView):
     def get(self, request, id):
-        group = Group.objects.get(id=id)
+        group = GroupSerializer.setup_eager_loading(Group.objects.all()).get(id=id)
         sz = GroupSerializer(group)
         return Response(sz.data)
     
@@ -47,6 +57,86 @@ class bulkAddAttendances(APIView):
             return Response(sz.data)
         return Response(sz.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class markAttendances(APIView):
+    """
+    Bulk update of attendances, e.g. marking a whole lesson's roll. Takes
+    compact [attendance_id, present, homework, paid] rows, optionally with
+    the attendance's version as a fifth item to reject conflicting edits, and
+    returns just the ids and new versions. Attendances are created with their
+    lesson, so unknown ids are rejected rather than inserted.
+    """
+    FLAGS = ['present', 'homework', 'paid']
+
+    def post(self, request):
+        rows, errors = self._parse_rows(request.data)
+        if errors:
+            return Response({"errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            attendances = Attendance.objects.select_for_update(of=('self',)).select_related('lesson').only(
+                'id', 'version', *self.FLAGS, 'lesson__date', 'lesson__group_id'
+            ).in_bulk(list(rows))
+
+            missing = [attendance_id for attendance_id in rows if attendance_id not in attendances]
+            if missing:
+                return Response(
+                    {"errors": [f"Attendance {attendance_id} not found" for attendance_id in missing]},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            conflicts = [
+                {"id": attendance_id, "version": attendances[attendance_id].version}
+                for attendance_id, (flags, version) in rows.items()
+                if version is not None and version != attendances[attendance_id].version
+            ]
+            if conflicts:
+                return Response({"conflicts": conflicts}, status=status.HTTP_409_CONFLICT)
+
+            changed = []
+            for attendance_id, (flags, version) in rows.items():
+                attendance = attendances[attendance_id]
+                if all(getattr(attendance, field) == value for field, value in zip(self.FLAGS, flags)):
+                    continue
+                for field, value in zip(self.FLAGS, flags):
+                    setattr(attendance, field, value)
+                attendance.version += 1
+                changed.append(attendance)
+
+            if changed:
+                Attendance.objects.bulk_update(changed, [*self.FLAGS, 'version'])
+                touch('Attendance', attendance_keys=(
+                    (utc_day(attendance.lesson.date), attendance.lesson.group_id) for attendance in changed
+                ))
+
+        return Response([
+            {"id": attendance_id, "version": attendances[attendance_id].version} for attendance_id in rows
+        ])
+
+    def _parse_rows(self, data):
+        """{attendance_id: ((present, homework, paid), version or None)} and a list of errors"""
+        if not isinstance(data, list):
+            return {}, ["Expected a list of [attendance_id, present, homework, paid] rows"]
+
+        rows, errors = {}, []
+        for index, row in enumerate(data):
+            if not isinstance(row, list) or len(row) not in (4, 5):
+                errors.append(f"Row {index}: expected [attendance_id, present, homework, paid] with an optional version")
+                continue
+
+            attendance_id, *flags = row[:4]
+            version = row[4] if len(row) == 5 else None
+            if type(attendance_id) is not int:
+                errors.append(f"Row {index}: attendance_id must be an integer")
+            elif not all(isinstance(flag, bool) for flag in flags):
+                errors.append(f"Row {index}: present, homework and paid must be booleans")
+            elif version is not None and type(version) is not int:
+                errors.append(f"Row {index}: version must be an integer")
+            elif attendance_id in rows:
+                errors.append(f"Row {index}: attendance {attendance_id} is listed twice")
+            else:
+                rows[attendance_id] = (flags, version)
+        return rows, errors
+
 class editAttendance(APIView):
     def put(self, request, id):
         try:
@@ -66,17 +156,29 @@ class editAttendance(APIView):
 
 class getAllAttendances(APIView):
     def get(self, request):
-        attendances = Attendance.objects.all()
-        sz = AttendanceSerializer(attendances, many=True)
-        return Response(sz.data)
+        attendances = AttendanceSerializer.setup_eager_loading(Attendance.objects.all(), sparse_fieldset_context(request))
+        return serialize_list(request, attendances, AttendanceSerializer)
     
 class addLessons(APIView):
     def post(self, request):
-        sz = LessonSerializer(data=request.data)
-        if sz.is_valid():
+        # A list of lessons is created in one batch, attendances included
+        many = isinstance(request.data, list)
+        context = {}
+        if many:
+            # one query for every lesson's group, rather than one per lesson
+            group_ids = {item.get('group') for item in request.data if isinstance(item, dict)}
+            context['groups'] = Group.objects.in_bulk([pk for pk in group_ids if isinstance(pk, int)])
+        sz = LessonSerializer(data=request.data, many=many, context=context)
+        if not sz.is_valid():
+            return Response(sz.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        if not many:
             sz.save()
             return Response(sz.data)
-        return Response(sz.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        lessons = create_lessons([Lesson(**data) for data in sz.validated_data])
+        lessons = Lesson.objects.filter(id__in=[lesson.id for lesson in lessons]).prefetch_related('attendances', 'resources')
+        return Response(LessonSerializer(lessons.order_by("id"), many=True).data)
 
 class getEditDeleteLessons(APIView):
 
@@ -112,10 +214,11 @@ class addResource(APIView):
 class getFullInvoice(APIView):
     def get(self, request, stripe_invoice_id):
         try:
-            local_invoice = LocalInvoice.objects.get(stripeInvoiceId=stripe_invoice_id)
-            stripe_invoice = local_invoice.get_stripe_invoice()
-            
-            invoice_dict = stripe_invoice.to_dict()
+            # Cached until an invoice webhook changes it, so repeat views skip Stripe
+            invoice_dict = invoice_cache.get_invoice(
+                stripe_invoice_id,
+                lambda: LocalInvoice.objects.get(stripeInvoiceId=stripe_invoice_id).get_stripe_invoice().to_dict()
+            )
             
             return Response(invoice_dict, status=status.HTTP_200_OK)
             
@@ -133,8 +236,7 @@ class getFullInvoice(APIView):
 class getAllStudents(APIView):
     def get(self, request):
         students = TutoringStudent.objects.all()
-        sz = TutoringStudentSerializer(students, many=True)
-        return Response(sz.data)
+        return serialize_list(request, students, TutoringStudentSerializer)
 
 class getStudentById(APIView):
     def get(self, request, id):
@@ -150,9 +252,8 @@ class getStudentById(APIView):
 
 class getAllLessons(APIView):
     def get(self, request):
-        lessons = Lesson.objects.all()
-        sz = LessonSerializer(lessons, many=True)
-        return Response(sz.data)
+        lessons = LessonSerializer.setup_eager_loading(Lesson.objects.all(), sparse_fieldset_context(request))
+        return serialize_list(request, lessons, LessonSerializer)
 
 class getLessonById(APIView):
     def get(self, request, id):
@@ -167,7 +268,18 @@ class getLessonById(APIView):
             )
 
 class DashboardView(APIView):
-    def get(self, request):
+    # URL/query slug -> response key for each section
+    SECTIONS = {
+        'metrics': 'metricsData',
+        'attendance': 'attendanceData',
+        'revenue': 'revenueData',
+        'group-performance': 'groupPerformance',
+        'engagement': 'engagementDistribution',
+        'at-risk': 'atRiskStudents',
+        'top-performers': 'topPerformers',
+    }
+    
+    def get(self, request, section=None):
         # Get date range from query params or default to last 90 days
         end_date_str = request.query_params.get('end_date')
         start_date_str = request.query_params.get('start_date')
@@ -185,28 +297,111 @@ class DashboardView(APIView):
             end_date = datetime.now(timezone.utc)
             start_date = end_date - timedelta(days=90)
         
-        # Calculate metrics
-        metrics_data = self._get_metrics_data(start_date, end_date)
-        attendance_data = self._get_attendance_trends(start_date, end_date)
-        revenue_data = self._get_revenue_data()
-        group_performance = self._get_group_performance(start_date, end_date)
-        engagement_distribution = self._get_engagement_distribution(start_date, end_date)
-        at_risk_students = self._get_at_risk_students(start_date, end_date)
-        top_performers = self._get_top_performers(start_date, end_date)
+        # Sections come from the URL (/dashboard/<section>/), ?sections=a,b or default to all
+        if section is not None:
+            if section not in self.SECTIONS:
+                return Response(
+                    {"error": f"Unknown dashboard section: {section}"},
+                    status=status.HTTP_404_NOT_FOUND
+                )
+            requested = [section]
+        elif request.query_params.get('sections'):
+            requested = [s.strip() for s in request.query_params['sections'].split(',') if s.strip()]
+            unknown = [s for s in requested if s not in self.SECTIONS]
+            if unknown:
+                return Response(
+                    {"error": f"Unknown dashboard sections: {', '.join(unknown)}"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        else:
+            requested = list(self.SECTIONS)
+        sections = [self.SECTIONS[slug] for slug in requested]
+        
+        versions = dashboard_cache.get_versions(sections)
+        etag = dashboard_cache.get_etag(versions, start_date, end_date)
+        last_modified = dashboard_cache.get_last_modified(versions)
+        
+        # Let the client revalidate with If-None-Match / If-Modified-Since
+        not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+        
+        keys = {
+            section: dashboard_cache.section_key(section, versions[section], start_date, end_date)
+            for section in sections
+        }
+        cached = cache.get_many(keys.values())
+        missing = [section for section in sections if keys[section] not in cached]
+        computed = self._compute_sections(missing, start_date, end_date)
+        cache.set_many(
+            {keys[section]: value for section, value in computed.items()},
+            timeout=dashboard_cache.CACHE_TIMEOUT
+        )
         
-        return Response({
+        data = {
             'dateRange': {
                 'start': start_date.date().isoformat(),
                 'end': end_date.date().isoformat()
-            },
-            'metricsData': metrics_data,
-            'attendanceData': attendance_data,
-            'revenueData': revenue_data,
-            'groupPerformance': group_performance,
-            'engagementDistribution': engagement_distribution,
-            'atRiskStudents': at_risk_students,
-            'topPerformers': top_performers
-        })
+            }
+        }
+        for section in sections:
+            data[section] = computed[section] if section in computed else cached[keys[section]]
+        
+        response = Response(data)
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+    
+    def _compute_sections(self, sections, start_date, end_date):
+        """
+        Compute the given sections, concurrently when
+        settings.DASHBOARD_SECTION_WORKERS is above 1.
+        """
+        builders = self._section_builders(start_date, end_date)
+        workers = min(getattr(settings, 'DASHBOARD_SECTION_WORKERS', 1), len(sections))
+        
+        if workers <= 1:
+            return {section: builders[section]() for section in sections}
+        
+        def run(section):
+            try:
+                return builders[section]()
+            finally:
+                # Worker threads open their own DB connections
+                connections.close_all()
+        
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(zip(sections, executor.map(run, sections)))
+    
+    def _section_builders(self, start_date, end_date):
+        """Map each section name to a function computing it"""
+        # Shared by the per-student sections, computed at most once
+        cached_student_stats = functools.cache(lambda: self._get_student_stats(start_date, end_date))
+        student_stats_lock = threading.Lock()
+        
+        def student_stats():
+            with student_stats_lock:
+                return cached_student_stats()
+        
+        return {
+            'metricsData': lambda: self._get_metrics_data(start_date, end_date),
+            'attendanceData': lambda: self._get_attendance_trends(start_date, end_date),
+            'revenueData': self._get_revenue_data,
+            'groupPerformance': lambda: self._get_group_performance(start_date, end_date),
+            'engagementDistribution': lambda: self._get_engagement_distribution(student_stats()),
+            'atRiskStudents': lambda: self._get_at_risk_students(student_stats()),
+            'topPerformers': lambda: self._get_top_performers(student_stats(), start_date, end_date),
+        }
+    
+    @staticmethod
+    def _in_days(field, start_date, end_date):
+        """
+        Q for `field` falling on any UTC day from start_date's to end_date's,
+        both whole days included, as in the sections read from the rollups
+        """
+        range_start, range_end = day_range(start_date.date(), end_date.date())
+        return Q(**{f'{field}__gte': range_start, f'{field}__lt': range_end})
     
     def _get_metrics_data(self, start_date, end_date):
         """Calculate key metrics with comparison to previous period"""
@@ -214,90 +409,65 @@ class DashboardView(APIView):
         prev_start = start_date - timedelta(days=period_length)
         prev_end = start_date
         
-        # Total active students (current)
-        current_students = TutoringStudent.objects.filter(
-            active=True,
-            start_date__lte=end_date
-        ).filter(
-            Q(end_date__isnull=True) | Q(end_date__gte=start_date)
-        ).count()
+        # Students enrolled at any point in each period
+        students = self._compare_periods(
+            TutoringStudent.objects.filter(active=True),
+            {
+                'current': Q(start_date__lte=end_date) & (Q(end_date__isnull=True) | Q(end_date__gte=start_date)),
+                'previous': Q(start_date__lte=prev_end) & (Q(end_date__isnull=True) | Q(end_date__gte=prev_start)),
+            },
+            Count,
+            students='id'
+        )
+        current_students = students['current']['students']
+        prev_students = students['previous']['students']
+        
+        # Attendance, revenue and invoice figures come from the daily rollups
+        start_day = start_date.date()
+        end_day = end_date.date()
+        day_periods = {
+            'current': Q(day__gte=start_day, day__lte=end_day),
+            'previous': Q(day__gte=prev_start.date(), day__lt=start_day),
+        }
         
-        # Previous period students
-        prev_students = TutoringStudent.objects.filter(
-            active=True,
-            start_date__lte=prev_end
-        ).filter(
-            Q(end_date__isnull=True) | Q(end_date__gte=prev_start)
-        ).count()
-        
-        # Attendance rate (current period)
-        current_attendance = Attendance.objects.filter(
-            lesson__date__gte=start_date,
-            lesson__date__lte=end_date
-        ).aggregate(
-            total=Count('id'),
-            present=Count('id', filter=Q(present=True))
+        # Attendance rate
+        attendance = self._compare_periods(
+            DailyAttendanceRollup.objects.filter(day__gte=prev_start.date(), day__lte=end_day),
+            day_periods,
+            Sum,
+            total='total',
+            present='present'
         )
+        current_attendance = attendance['current']
+        prev_attendance = attendance['previous']
         
         current_rate = (
             (current_attendance['present'] / current_attendance['total'] * 100)
             if current_attendance['total'] > 0 else 0
         )
-        
-        # Previous period attendance
-        prev_attendance = Attendance.objects.filter(
-            lesson__date__gte=prev_start,
-            lesson__date__lt=prev_end
-        ).aggregate(
-            total=Count('id'),
-            present=Count('id', filter=Q(present=True))
-        )
-        
         prev_rate = (
             (prev_attendance['present'] / prev_attendance['total'] * 100)
             if prev_attendance['total'] > 0 else 0
         )
         
-        # Revenue (current period)
-        current_revenue = LocalInvoice.objects.filter(
-            status='paid',
-            status_transitions_paid_at__gte=start_date,
-            status_transitions_paid_at__lte=end_date
-        ).aggregate(
-            total=Sum('amount_paid')
-        )['total'] or 0
-        
-        # Previous period revenue
-        prev_revenue = LocalInvoice.objects.filter(
-            status='paid',
-            status_transitions_paid_at__gte=prev_start,
-            status_transitions_paid_at__lt=prev_end
-        ).aggregate(
-            total=Sum('amount_paid')
-        )['total'] or 0
-        
-        # Payment rate (% of invoices paid on time)
-        current_invoices = LocalInvoice.objects.filter(
-            created__gte=start_date,
-            created__lte=end_date
-        ).aggregate(
-            total=Count('id'),
-            paid=Count('id', filter=Q(status='paid'))
+        # Revenue and payment rate (% of invoices paid on time)
+        invoices = self._compare_periods(
+            DailyRevenueRollup.objects.filter(day__gte=prev_start.date(), day__lte=end_day),
+            day_periods,
+            Sum,
+            revenue='revenue',
+            total='invoices',
+            paid='paid_invoices'
         )
+        current_invoices = invoices['current']
+        prev_invoices = invoices['previous']
+        current_revenue = current_invoices['revenue']
+        prev_revenue = prev_invoices['revenue']
         
         current_payment_rate = (
             (current_invoices['paid'] / current_invoices['total'] * 100)
             if current_invoices['total'] > 0 else 0
         )
-        
-        prev_invoices = LocalInvoice.objects.filter(
-            created__gte=prev_start,
-            created__lt=prev_end
-        ).aggregate(
-            total=Count('id'),
-            paid=Count('id', filter=Q(status='paid'))
-        )
-        
         prev_payment_rate = (
             (prev_invoices['paid'] / prev_invoices['total'] * 100)
             if prev_invoices['total'] > 0 else 0
@@ -330,17 +500,37 @@ class DashboardView(APIView):
             }
         }
     
+    def _compare_periods(self, queryset, periods, aggregate, **fields):
+        """
+        Aggregate each field once per period in a single conditional-aggregation
+        query, so every period is read from the same snapshot.
+        
+        `periods` maps a period name to a Q filter, `aggregate` is the aggregate
+        class (Sum, Count, ...) and `fields` maps result names to fields.
+        Returns {period: {name: value}}, with empty aggregates as 0.
+        """
+        values = queryset.aggregate(**{
+            f'{period}__{name}': aggregate(field, filter=condition)
+            for period, condition in periods.items()
+            for name, field in fields.items()
+        })
+        
+        return {
+            period: {name: values[f'{period}__{name}'] or 0 for name in fields}
+            for period in periods
+        }
+    
     def _get_attendance_trends(self, start_date, end_date):
         """Get weekly attendance rates"""
-        # Get all attendances in the date range grouped by week
-        attendances = Attendance.objects.filter(
-            lesson__date__gte=start_date,
-            lesson__date__lte=end_date
+        # Sum the daily rollups in the date range by week
+        attendances = DailyAttendanceRollup.objects.filter(
+            day__gte=start_date.date(),
+            day__lte=end_date.date()
         ).annotate(
-            week_start=TruncWeek('lesson__date')
+            week_start=TruncWeek('day')
         ).values('week_start').annotate(
-            total=Count('id'),
-            present=Count('id', filter=Q(present=True))
+            total=Sum('total'),
+            present=Sum('present')
         ).order_by('week_start')
         
         # Format for frontend
@@ -358,13 +548,13 @@ class DashboardView(APIView):
         """Get last 6 months of revenue"""
         six_months_ago = datetime.now(timezone.utc) - timedelta(days=180)
         
-        revenue_by_month = LocalInvoice.objects.filter(
-            status='paid',
-            status_transitions_paid_at__gte=six_months_ago
+        revenue_by_month = DailyRevenueRollup.objects.filter(
+            day__gte=six_months_ago.date(),
+            revenue__gt=0
         ).annotate(
-            month=TruncMonth('status_transitions_paid_at')
+            month=TruncMonth('day')
         ).values('month').annotate(
-            revenue=Sum('amount_paid')
+            revenue=Sum('revenue')
         ).order_by('month')
         
         result = []
@@ -377,44 +567,37 @@ class DashboardView(APIView):
         return result
     
     def _get_group_performance(self, start_date, end_date):
-        """Calculate performance metrics for each group"""
-        groups = Group.objects.all()
-        result = []
+        """Calculate performance metrics for each group in a single query"""
+        in_range = self._in_days('lessons__date', start_date, end_date)
+        
+        groups = Group.objects.values('id', 'course').annotate(
+            total=Count('lessons__attendances', filter=in_range),
+            present=Count('lessons__attendances', filter=in_range & Q(lessons__attendances__present=True)),
+            homework=Count('lessons__attendances', filter=in_range & Q(lessons__attendances__homework=True)),
+            # Invoices covering the group's attendances in the date range
+            total_invoices=Count(
+                'lessons__attendances__local_invoice',
+                filter=in_range,
+                distinct=True
+            ),
+            paid_invoices=Count(
+                'lessons__attendances__local_invoice',
+                filter=in_range & Q(lessons__attendances__local_invoice__status='paid'),
+                distinct=True
+            ),
+        ).filter(total__gt=0).order_by('id')
         
+        result = []
         for group in groups:
-            # Get all attendances for this group in the date range
-            attendances = Attendance.objects.filter(
-                lesson__group=group,
-                lesson__date__gte=start_date,
-                lesson__date__lte=end_date
-            )
-            
-            total_attendances = attendances.count()
-            if total_attendances == 0:
-                continue
+            total_attendances = group['total']
+            total_invoices = group['total_invoices']
             
-            present_count = attendances.filter(present=True).count()
-            homework_count = attendances.filter(homework=True).count()
-            
-            # Get students in this group
-            students = group.tutoringStudents.filter(active=True)
-            
-            # Calculate payment rate for students in this group
-            invoices = LocalInvoice.objects.filter(
-                attendances__lesson__group=group,
-                attendances__lesson__date__gte=start_date,
-                attendances__lesson__date__lte=end_date
-            ).distinct()
-            
-            total_invoices = invoices.count()
-            paid_invoices = invoices.filter(status='paid').count()
-            
-            attendance_rate = round((present_count / total_attendances * 100), 1) if total_attendances > 0 else 0
-            homework_rate = round((homework_count / total_attendances * 100), 1) if total_attendances > 0 else 0
-            payment_rate = round((paid_invoices / total_invoices * 100), 1) if total_invoices > 0 else 0
+            attendance_rate = round((group['present'] / total_attendances * 100), 1)
+            homework_rate = round((group['homework'] / total_attendances * 100), 1)
+            payment_rate = round((group['paid_invoices'] / total_invoices * 100), 1) if total_invoices > 0 else 0
             
             result.append({
-                'name': str(group.course) if group.course else f"Group {group.id}",
+                'name': str(group['course']) if group['course'] else f"Group {group['id']}",
                 'attendance': attendance_rate,
                 'payment': payment_rate,
                 'homework': homework_rate
@@ -422,10 +605,39 @@ class DashboardView(APIView):
         
         return result
     
-    def _get_engagement_distribution(self, start_date, end_date):
+    def _get_student_stats(self, start_date, end_date):
+        """
+        Per-student attendance and invoice aggregates for the date range,
+        computed in a single grouped query. Students with no attendances in
+        the range are excluded.
+        """
+        in_range = self._in_days('lessons_attended__lesson__date', start_date, end_date)
+        invoice_in_range = self._in_days('lessons_attended__local_invoice__created', start_date, end_date)
+        
+        return list(
+            TutoringStudent.objects.filter(active=True).values('id', 'name').annotate(
+                total=Count('lessons_attended', filter=in_range),
+                present=Count('lessons_attended', filter=in_range & Q(lessons_attended__present=True)),
+                homework=Count('lessons_attended', filter=in_range & Q(lessons_attended__homework=True)),
+                last_absence=Max(
+                    'lessons_attended__lesson__date',
+                    filter=in_range & Q(lessons_attended__present=False)
+                ),
+                total_invoices=Count(
+                    'lessons_attended__local_invoice',
+                    filter=invoice_in_range,
+                    distinct=True
+                ),
+                paid_invoices=Count(
+                    'lessons_attended__local_invoice',
+                    filter=invoice_in_range & Q(lessons_attended__local_invoice__status='paid'),
+                    distinct=True
+                ),
+            ).filter(total__gt=0).order_by('id')
+        )
+    
+    def _get_engagement_distribution(self, student_stats):
         """Calculate student engagement distribution"""
-        students = TutoringStudent.objects.filter(active=True)
-        
         distribution = {
             'high': 0,      # >90%
             'medium': 0,    # 70-90%
@@ -433,19 +645,8 @@ class DashboardView(APIView):
             'at_risk': 0    # <50%
         }
         
-        for student in students:
-            attendances = Attendance.objects.filter(
-                tutoringStudent=student,
-                lesson__date__gte=start_date,
-                lesson__date__lte=end_date
-            )
-            
-            total = attendances.count()
-            if total == 0:
-                continue
-            
-            present = attendances.filter(present=True).count()
-            rate = (present / total * 100)
+        for stats in student_stats:
+            rate = (stats['present'] / stats['total'] * 100)
             
             if rate > 90:
                 distribution['high'] += 1
@@ -463,44 +664,24 @@ class DashboardView(APIView):
             {'name': 'At Risk (<50%)', 'value': distribution['at_risk'], 'color': '#dc3545'},
         ]
     
-    def _get_at_risk_students(self, start_date, end_date):
+    def _get_at_risk_students(self, student_stats):
         """Identify students at risk based on attendance and payment"""
-        students = TutoringStudent.objects.filter(active=True)
         at_risk = []
+        now = datetime.now(timezone.utc)
         
-        for student in students:
-            attendances = Attendance.objects.filter(
-                tutoringStudent=student,
-                lesson__date__gte=start_date,
-                lesson__date__lte=end_date
-            )
-            
-            total = attendances.count()
-            if total == 0:
-                continue
-            
-            present = attendances.filter(present=True).count()
-            attendance_rate = (present / total * 100)
-            
-            # Get payment rate for this student
-            invoices = LocalInvoice.objects.filter(
-                attendances__tutoringStudent=student,
-                created__gte=start_date,
-                created__lte=end_date
-            ).distinct()
+        for stats in student_stats:
+            attendance_rate = (stats['present'] / stats['total'] * 100)
             
-            total_invoices = invoices.count()
-            paid_invoices = invoices.filter(status='paid').count()
+            total_invoices = stats['total_invoices']
+            paid_invoices = stats['paid_invoices']
             payment_rate = (paid_invoices / total_invoices * 100) if total_invoices > 0 else 100
             
-            # Get last absence
-            last_absence = attendances.filter(present=False).order_by('-lesson__date').first()
-            
             # Mark as at-risk if attendance < 75% or payment < 80%
             if attendance_rate < 75 or payment_rate < 80:
                 days_since_absence = 'N/A'
+                last_absence = stats['last_absence']
                 if last_absence:
-                    days = (datetime.now(timezone.utc) - last_absence.lesson.date).days
+                    days = (now - last_absence).days
                     if days == 0:
                         days_since_absence = 'today'
                     elif days == 1:
@@ -514,8 +695,8 @@ class DashboardView(APIView):
                         days_since_absence = f'{weeks} weeks ago'
                 
                 at_risk.append({
-                    'id': student.id,
-                    'name': student.name,
+                    'id': stats['id'],
+                    'name': stats['name'],
                     'attendance': round(attendance_rate, 1),
                     'payment': round(payment_rate, 1),
                     'lastAbsence': days_since_absence
@@ -526,47 +707,52 @@ class DashboardView(APIView):
         
         return at_risk[:10]  # Return top 10 at-risk students
     
-    def _get_top_performers(self, start_date, end_date):
+    def _get_streaks(self, student_ids, start_date, end_date):
+        """
+        Current streak (consecutive most recent lessons with both attendance
+        and homework) for each student, computed with a window function.
+        Returns a mapping of student id to streak length.
+        """
+        # Date of each student's most recent lesson that broke the streak
+        last_break = Window(
+            Max(Case(When(~Q(present=True, homework=True), then='lesson__date'))),
+            partition_by=[F('tutoringStudent')]
+        )
+        
+        streak_rows = Attendance.objects.filter(
+            self._in_days('lesson__date', start_date, end_date),
+            tutoringStudent_id__in=student_ids
+        ).annotate(
+            last_break=last_break
+        ).filter(
+            Q(last_break__isnull=True) | Q(lesson__date__gt=F('last_break'))
+        ).values_list('tutoringStudent_id', flat=True)
+        
+        return Counter(streak_rows)
+    
+    def _get_top_performers(self, student_stats, start_date, end_date):
         """Identify top performing students based on engagement"""
-        students = TutoringStudent.objects.filter(active=True)
         performers = []
         
-        for student in students:
-            attendances = Attendance.objects.filter(
-                tutoringStudent=student,
-                lesson__date__gte=start_date,
-                lesson__date__lte=end_date
-            ).order_by('lesson__date')
-            
-            total = attendances.count()
-            if total == 0:
-                continue
-            
-            present = attendances.filter(present=True).count()
-            homework = attendances.filter(homework=True).count()
-            
+        for stats in student_stats:
             # Calculate engagement score (weighted average)
-            attendance_rate = (present / total * 100)
-            homework_rate = (homework / total * 100)
+            attendance_rate = (stats['present'] / stats['total'] * 100)
+            homework_rate = (stats['homework'] / stats['total'] * 100)
             engagement_score = (attendance_rate * 0.6 + homework_rate * 0.4)
             
-            # Calculate current streak
-            streak = 0
-            for attendance in attendances.reverse():
-                if attendance.present and attendance.homework:
-                    streak += 1
-                else:
-                    break
-            
             if engagement_score >= 85:  # Only include high performers
                 performers.append({
-                    'id': student.id,
-                    'name': student.name,
+                    'id': stats['id'],
+                    'name': stats['name'],
                     'engagement': round(engagement_score, 1),
-                    'streak': streak
                 })
         
         # Sort by engagement score (highest first)
         performers.sort(key=lambda x: x['engagement'], reverse=True)
+        performers = performers[:10]  # Return top 10 performers
+        
+        streaks = self._get_streaks([p['id'] for p in performers], start_date, end_date)
+        for performer in performers:
+            performer['streak'] = streaks.get(performer['id'], 0)
         
-        return performers[:10]  # Return top 10 performers
\ No newline at end of file
+        return performers
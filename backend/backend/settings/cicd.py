@@ -27,6 +27,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'stripeInt',
     'tutoring',
+    'django_q',
     'rest_framework',
     "corsheaders",
     'storages',
@@ -77,6 +78,15 @@ DATABASES = {
 
 
 
+# Caches (dashboard sections are cached here)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'simplex-manager',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -137,6 +147,15 @@ LOGGING = {
     },
 }
 
+# Tasks (e.g. webhook processing) run inline instead of on a cluster
+Q_CLUSTER = {
+    'name': 'cicd',
+    'timeout': 90,
+    'retry': 120,
+    'orm': 'default',
+    'sync': True,
+}
+
 TIME_ZONE = 'Australia/Sydney'
 
 REST_FRAMEWORK = {
@@ -80,6 +80,15 @@ DATABASES = {
 
 
 
+# Caches (dashboard sections are cached here)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'simplex-manager',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
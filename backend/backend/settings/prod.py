@@ -90,6 +90,36 @@ DATABASES = {
 
 
 
+# Caches (dashboard sections and Stripe invoices are cached here). Kept in the
+# database so the web and qcluster dynos share it: the versions the signal
+# receivers bump on a worker must reach the web process. The table is
+# created by the tutoring migrations (createcachetable). Culling only loses
+# entries, which are refetched, so MAX_ENTRIES just bounds the table.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+        },
+    }
+}
+
+
+# Dashboard sections computed concurrently per request (each worker uses its own DB connection)
+DASHBOARD_SECTION_WORKERS = 3
+
+# Parents invoiced concurrently by generateInvoices (each worker uses its own DB connection)
+INVOICE_WORKERS = 4
+
+# Shared Stripe HTTP client (see stripeInt.client): keep-alive connections
+# kept open, at least one per invoice worker, request timeout in seconds
+# and retries of failed requests
+STRIPE_POOL_SIZE = 10
+STRIPE_TIMEOUT = 30
+STRIPE_MAX_NETWORK_RETRIES = 2
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -1,6 +1,27 @@
 from django.contrib import admin
-from .models import StripeProd
+from .models import InvoiceRun, InvoiceRunItem, StripeProd, WebhookEvent
+
+
+class InvoiceRunItemInline(admin.TabularInline):
+    model = InvoiceRunItem
+    extra = 0
+    readonly_fields = ["parent", "status", "stripeInvoiceId", "total", "error", "updated"]
+
+
+@admin.register(InvoiceRun)
+class InvoiceRunAdmin(admin.ModelAdmin):
+    list_display = ["id", "frequency", "status", "created", "finished"]
+    list_filter = ["frequency", "status"]
+    exclude = ["plan"]
+    inlines = [InvoiceRunItemInline]
+
+
+@admin.register(WebhookEvent)
+class WebhookEventAdmin(admin.ModelAdmin):
+    list_display = ["id", "type", "stripeEventId", "status", "attempts", "duration", "received", "processed"]
+    list_filter = ["type", "status"]
+    search_fields = ["stripeEventId"]
 
 
 # Register your models here.
-admin.site.register(StripeProd)
\ No newline at end of file
+admin.site.register(StripeProd)
@@ -0,0 +1,111 @@
+"""
+The StripeClient every Stripe API call in the project goes through.
+
+All clients share one HTTP client: a requests session with a keep-alive
+connection pool, so concurrent invoicing reuses TCP/TLS connections instead
+of negotiating one per call. Timeouts, retries and the pool size come from
+settings (STRIPE_TIMEOUT, STRIPE_MAX_NETWORK_RETRIES, STRIPE_POOL_SIZE).
+Every HTTP request is timed, see stripeLatencyStats.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict, deque
+from urllib.parse import urlsplit
+
+import requests
+import stripe
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .webhook_stats import percentile
+
+logger = logging.getLogger(__name__)
+
+# Recent request latencies (ms) kept per endpoint, in this process
+LATENCY_SAMPLES = 500
+
+_latencies = defaultdict(lambda: deque(maxlen=LATENCY_SAMPLES))
+_request_counts = defaultdict(int)
+_latencies_lock = threading.Lock()
+
+_http_client = None
+# api key -> StripeClient
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class InstrumentedRequestsClient(stripe.RequestsClient):
+    """RequestsClient recording the latency of every request, retries included"""
+    def request(self, method, url, headers, post_data=None):
+        endpoint = f"{method.upper()} {endpointPath(url)}"
+        started = time.perf_counter()
+        try:
+            return super().request(method, url, headers, post_data)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            with _latencies_lock:
+                _latencies[endpoint].append(elapsed)
+                _request_counts[endpoint] += 1
+            logger.debug(f"Stripe {endpoint} took {elapsed:.0f}ms")
+
+
+def endpointPath(url):
+    """The path of a Stripe API URL with object ids replaced, e.g. /v1/invoices/{id}/finalize"""
+    # ids are a prefix and a mixed case/digit suffix, unlike resource names (invoice_items)
+    return re.sub(r'/[a-z]+_(?=[a-z]*[A-Z0-9])[A-Za-z0-9]+', '/{id}', urlsplit(url).path)
+
+
+def getHttpClient():
+    global _http_client
+    with _clients_lock:
+        if _http_client is None:
+            pool_size = getattr(settings, 'STRIPE_POOL_SIZE', 10)
+            session = requests.Session()
+            session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+            _http_client = InstrumentedRequestsClient(
+                timeout=getattr(settings, 'STRIPE_TIMEOUT', 30),
+                session=session
+            )
+        return _http_client
+
+
+def getStripeClient():
+    """
+    The shared StripeClient for the STRIPE_SECRET_KEY environment variable.
+    Raises stripe.error.AuthenticationError if it isn't set.
+    """
+    api_key = os.getenv('STRIPE_SECRET_KEY')
+    if not api_key:
+        raise stripe.error.AuthenticationError("Stripe API key not found in environment variables")
+
+    http_client = getHttpClient()
+    with _clients_lock:
+        if api_key not in _clients:
+            _clients[api_key] = stripe.StripeClient(
+                api_key,
+                http_client=http_client,
+                max_network_retries=getattr(settings, 'STRIPE_MAX_NETWORK_RETRIES', 2)
+            )
+        return _clients[api_key]
+
+
+def stripeLatencyStats():
+    """
+    Request count and p50/p95 latency (ms, over the latest LATENCY_SAMPLES)
+    per Stripe endpoint called by this process
+    """
+    with _latencies_lock:
+        samples = {endpoint: sorted(latencies) for endpoint, latencies in _latencies.items()}
+        counts = dict(_request_counts)
+
+    return {
+        endpoint: {
+            'count': counts[endpoint],
+            'p50_ms': round(percentile(latencies, 0.5), 1),
+            'p95_ms': round(percentile(latencies, 0.95), 1),
+        }
+        for endpoint, latencies in samples.items()
+    }
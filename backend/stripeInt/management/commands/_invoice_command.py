@@ -0,0 +1,98 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from stripeInt.models import InvoiceRun
+from stripeInt.services import applyInvoicePlan, describeInvoiceRun, generateInvoices, planInvoices, resumeInvoiceRun
+
+PLAN_CSV_FIELDS = ['parent', 'name', 'customer', 'product', 'description', 'quantity', 'unit_amount', 'currency', 'amount']
+
+
+class InvoiceCommand(BaseCommand):
+    """
+    Shared by the generate_*_invoices commands. Without options, invoices
+    straight away; --plan only computes the billing plan, --apply invoices
+    from a previously saved plan and --resume finishes an interrupted run.
+    """
+    frequency = None
+    amount_of_weeks = None
+    label = None
+
+    def add_arguments(self, parser):
+        mode = parser.add_mutually_exclusive_group()
+        mode.add_argument('--plan', action='store_true',
+                          help='Compute the billing plan without creating any invoices')
+        mode.add_argument('--apply', metavar='PLAN_JSON',
+                          help='Create the invoices described by a plan saved with --plan')
+        mode.add_argument('--resume', metavar='RUN_ID', nargs='?', const='latest',
+                          help='Resume an interrupted or partly failed run (default: the latest unfinished one)')
+        parser.add_argument('--format', choices=['json', 'csv'], default='json',
+                            help='Output format of --plan (only JSON plans can be applied)')
+        parser.add_argument('--output', metavar='PATH',
+                            help='Write the --plan output to a file instead of stdout')
+
+    def handle(self, *args, **options):
+        if options['plan']:
+            return self.write_plan(options['format'], options['output'])
+
+        if options['apply']:
+            with open(options['apply']) as plan_file:
+                plan = json.load(plan_file)
+            if plan.get('frequency') != self.frequency:
+                raise CommandError(f"Plan is for {plan.get('frequency')} invoices, not {self.frequency}")
+            summary = applyInvoicePlan(plan)
+        elif options['resume']:
+            summary = resumeInvoiceRun(self.get_run(options['resume']))
+        else:
+            summary = generateInvoices(frequency=self.frequency, amount_of_weeks=self.amount_of_weeks)
+
+        if summary is None:
+            raise CommandError('Stripe API key not configured, no invoices generated')
+
+        for failure in summary['failed']:
+            self.stderr.write(f"Failed to invoice {failure['name']} (ID: {failure['parent']}): {failure['error']}")
+        self.stdout.write(self.style.SUCCESS(f'✅ {self.label} invoices generated: {describeInvoiceRun(summary)}'))
+
+    def get_run(self, run_id):
+        runs = InvoiceRun.objects.filter(frequency=self.frequency)
+        if run_id == 'latest':
+            run = runs.exclude(status=InvoiceRun.Status.COMPLETED).order_by('-created').first()
+            if run is None:
+                raise CommandError(f"No unfinished {self.frequency} invoice run to resume")
+            return run
+
+        try:
+            return runs.get(id=run_id)
+        except (InvoiceRun.DoesNotExist, ValueError):
+            raise CommandError(f"No {self.frequency} invoice run with ID {run_id}")
+
+    def write_plan(self, format, output):
+        plan = planInvoices(frequency=self.frequency, amount_of_weeks=self.amount_of_weeks)
+
+        stream = open(output, 'w', newline='') if output else self.stdout
+        try:
+            if format == 'csv':
+                # one row per line item
+                writer = csv.DictWriter(stream, fieldnames=PLAN_CSV_FIELDS, lineterminator='\n')
+                writer.writeheader()
+                for entry in plan['parents']:
+                    for item in entry['items']:
+                        writer.writerow({
+                            'parent': entry['parent'],
+                            'name': entry['name'],
+                            'customer': entry['customer'],
+                            **item,
+                        })
+            else:
+                stream.write(json.dumps(plan, indent=2))
+        finally:
+            if output:
+                stream.close()
+
+        invoiced = sum(1 for entry in plan['parents'] if entry['attendances'])
+        if output:
+            self.stdout.write(self.style.SUCCESS(
+                f"✅ {self.label} invoice plan written to {output}: "
+                f"{invoiced} of {len(plan['parents'])} parents to invoice, totaling ${plan['total'] / 100}"
+            ))
@@ -1,9 +1,7 @@
-from django.core.management.base import BaseCommand
-from stripeInt.services import generateFortnightlyInvoices
+from stripeInt.management.commands._invoice_command import InvoiceCommand
 
-class Command(BaseCommand):
+class Command(InvoiceCommand):
     help = 'Generate fortnightly invoices'
-
-    def handle(self, *args, **options):
-        generateFortnightlyInvoices()
-        self.stdout.write(self.style.SUCCESS('✅ Fortnightly invoices generated successfully'))
+    frequency = 'fortnightly'
+    amount_of_weeks = 2
+    label = 'Fortnightly'
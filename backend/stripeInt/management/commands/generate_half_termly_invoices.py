@@ -1,9 +1,7 @@
-from django.core.management.base import BaseCommand
-from stripeInt.services import generateHalfTermlyInvoices
+from stripeInt.management.commands._invoice_command import InvoiceCommand
 
-class Command(BaseCommand):
+class Command(InvoiceCommand):
     help = 'Generate half-termly invoices'
-
-    def handle(self, *args, **options):
-        generateHalfTermlyInvoices()
-        self.stdout.write(self.style.SUCCESS('✅ Half-termly invoices generated successfully'))
+    frequency = 'half-termly'
+    amount_of_weeks = 5
+    label = 'Half-termly'
@@ -1,9 +1,7 @@
-from django.core.management.base import BaseCommand
-from stripeInt.services import generateTermlyInvoices
+from stripeInt.management.commands._invoice_command import InvoiceCommand
 
-class Command(BaseCommand):
+class Command(InvoiceCommand):
     help = 'Generate termly invoices'
-
-    def handle(self, *args, **options):
-        generateTermlyInvoices()
-        self.stdout.write(self.style.SUCCESS('✅ Termly invoices generated successfully'))
+    frequency = 'termly'
+    amount_of_weeks = 10
+    label = 'Termly'
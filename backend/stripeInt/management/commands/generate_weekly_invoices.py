@@ -1,9 +1,7 @@
-from django.core.management.base import BaseCommand
-from stripeInt.services import generateWeeklyInvoices
+from stripeInt.management.commands._invoice_command import InvoiceCommand
 
-class Command(BaseCommand):
+class Command(InvoiceCommand):
     help = 'Generate weekly invoices'
-
-    def handle(self, *args, **options):
-        generateWeeklyInvoices()
-        self.stdout.write(self.style.SUCCESS('✅ Weekly invoices generated successfully'))
+    frequency = 'weekly'
+    amount_of_weeks = 1
+    label = 'Weekly'
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from tutoring.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily attendance and revenue rollups used by the dashboard'
+
+    def handle(self, *args, **options):
+        rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS('✅ Dashboard rollups rebuilt successfully'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from stripeInt.tasks import retryWebhookEvents
+
+
+class Command(BaseCommand):
+    help = 'Process stored Stripe webhook events that are still pending or failed'
+
+    def handle(self, *args, **options):
+        processed = retryWebhookEvents()
+        self.stdout.write(self.style.SUCCESS(f'✅ {processed} webhook events processed'))
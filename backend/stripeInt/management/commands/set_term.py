@@ -1,7 +1,9 @@
 from datetime import datetime, timedelta
 from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
 
-from tutoring.models import Group, Lesson
+from tutoring.models import Group, Lesson, create_lessons
 
 
 class Command(BaseCommand):
@@ -18,9 +20,9 @@ class Command(BaseCommand):
             # Convert string to datetime.date
             first_monday = datetime.strptime(start_date, '%Y-%m-%d').date()
             
-            scheduleTermLessons(first_monday)
+            lessons = scheduleTermLessons(first_monday)
             
-            self.stdout.write(self.style.SUCCESS(f"Lessons scheduled starting {first_monday}"))
+            self.stdout.write(self.style.SUCCESS(f"{len(lessons)} lessons scheduled starting {first_monday}"))
             
         except Exception as e:
             raise CommandError(f'Command failed: {e}')
@@ -28,21 +30,36 @@ class Command(BaseCommand):
 def scheduleTermLessons(first_monday: datetime.date, term_weeks: int = 10):
     """
     Creates lessons for every group for the term, starting from the given first Monday.
+    Lessons that already exist are skipped, so it's safe to rerun. Everything
+    is written in one transaction, with one insert for the lessons and one
+    for their attendances (see tutoring.models.create_lessons).
 
     :param first_monday: datetime.date of the first Monday of the term
     :param term_weeks: Number of weeks in the term (default 10)
+    :return: the lessons created
     """
-    groups = Group.objects.all()
-    
-    for group in groups:
-        # Calculate the first lesson date for the group
-        days_until_group_day = (group.day_of_week - first_monday.weekday()) % 7
-        first_lesson_date = datetime.combine(first_monday + timedelta(days=days_until_group_day), group.time_of_day)
-        
-        for week in range(term_weeks):
-            lesson_date = first_lesson_date + timedelta(weeks=week)
-            
-            Lesson.objects.create(
-                group=group,
-                date=lesson_date
-            )
\ No newline at end of file
+    with transaction.atomic():
+        # locks the groups, so concurrent runs can't both create a lesson
+        groups = list(Group.objects.select_for_update().exclude(day_of_week=None).exclude(time_of_day=None))
+
+        lessons = []
+        for group in groups:
+            # Calculate the first lesson date for the group
+            days_until_group_day = (group.day_of_week - first_monday.weekday()) % 7
+            first_lesson_date = timezone.make_aware(
+                datetime.combine(first_monday + timedelta(days=days_until_group_day), group.time_of_day)
+            )
+
+            for week in range(term_weeks):
+                lessons.append(Lesson(group=group, date=first_lesson_date + timedelta(weeks=week)))
+
+        if not lessons:
+            return []
+
+        existing = set(Lesson.objects.filter(
+            group__in=groups,
+            date__gte=min(lesson.date for lesson in lessons),
+            date__lte=max(lesson.date for lesson in lessons)
+        ).values_list('group_id', 'date'))
+
+        return create_lessons([lesson for lesson in lessons if (lesson.group_id, lesson.date) not in existing])
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stripeInt', '0005_alter_stripeprod_defaultpriceid_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stripeprod',
+            name='currency',
+            field=models.CharField(blank=True, max_length=3, null=True),
+        ),
+        migrations.AddField(
+            model_name='stripeprod',
+            name='unit_amount',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+    ]
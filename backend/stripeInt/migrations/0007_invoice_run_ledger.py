@@ -0,0 +1,42 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stripeInt', '0006_stripeprod_price'),
+        ('tutoring', '0014_group_image_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('frequency', models.CharField(max_length=20)),
+                ('plan', models.JSONField()),
+                ('status', models.CharField(choices=[('running', 'Running'), ('incomplete', 'Incomplete'), ('completed', 'Completed')], default='running', max_length=20)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='InvoiceRunItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('invoiced', 'Invoiced'), ('skipped', 'Skipped'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('stripeInvoiceId', models.CharField(blank=True, max_length=255, null=True)),
+                ('total', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('parent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='invoice_run_items', to='tutoring.parent')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='stripeInt.invoicerun')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('run', 'parent'), name='unique_invoice_run_parent')],
+            },
+        ),
+    ]
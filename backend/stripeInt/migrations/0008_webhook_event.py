@@ -0,0 +1,31 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stripeInt', '0007_invoice_run_ledger'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stripeEventId', models.CharField(blank=True, max_length=255, null=True, unique=True)),
+                ('type', models.CharField(max_length=100)),
+                ('data', models.JSONField()),
+                ('created', models.DateTimeField(blank=True, null=True)),
+                ('received', models.DateTimeField(auto_now_add=True)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processed', 'Processed'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('processed', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'received'], name='stripeInt_w_status_245c6c_idx')],
+            },
+        ),
+    ]
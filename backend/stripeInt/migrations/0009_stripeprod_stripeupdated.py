@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stripeInt', '0008_webhook_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stripeprod',
+            name='stripeUpdated',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
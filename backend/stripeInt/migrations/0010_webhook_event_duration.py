@@ -0,0 +1,22 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stripeInt', '0009_stripeprod_stripeupdated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookevent',
+            name='duration',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='webhookevent',
+            index=models.Index(fields=['received', 'type'], name='stripeInt_w_receive_801252_idx'),
+        ),
+    ]
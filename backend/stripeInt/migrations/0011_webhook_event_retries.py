@@ -0,0 +1,41 @@
+# Generated by Django 5.2.6 on 2026-10-18 02:31
+
+from django.db import migrations, models
+
+SCHEDULE_NAME = 'process-webhook-events'
+
+
+def create_schedule(apps, schema_editor):
+    Schedule = apps.get_model('django_q', 'Schedule')
+    # drains failed events once they're due, and anything left pending
+    Schedule.objects.get_or_create(
+        name=SCHEDULE_NAME,
+        defaults={
+            'func': 'stripeInt.tasks.processWebhookEvents',
+            'schedule_type': 'I',
+            'minutes': 1,
+            'repeats': -1,
+        }
+    )
+
+
+def delete_schedule(apps, schema_editor):
+    Schedule = apps.get_model('django_q', 'Schedule')
+    Schedule.objects.filter(name=SCHEDULE_NAME).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_q', '0014_schedule_cluster'),
+        ('stripeInt', '0010_webhook_event_duration'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookevent',
+            name='next_attempt',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(create_schedule, delete_schedule),
+    ]
@@ -5,6 +5,92 @@ class StripeProd(models.Model):
   defaultPriceId=models.CharField(max_length=50, blank=False, null=True)
   name=models.CharField(max_length=100, blank=False, null=False)
   is_active=models.BooleanField(default=True)
+  # local copy of the default price, kept current by the price webhooks
+  unit_amount=models.IntegerField(null=True, blank=True)  # in cents
+  currency=models.CharField(max_length=3, null=True, blank=True)
+  # created time of the last webhook event applied, older events are dropped
+  stripeUpdated=models.DateTimeField(null=True, blank=True)
 
   def __str__(self):
-    return self.name
\ No newline at end of file
+    return self.name
+
+class InvoiceRun(models.Model):
+  """
+  Ledger of one invoice generation run and the plan it applies
+  (see stripeInt.services.applyInvoicePlan), so a crashed run can be resumed.
+  """
+  class Status(models.TextChoices):
+    RUNNING = "running", "Running"
+    INCOMPLETE = "incomplete", "Incomplete"
+    COMPLETED = "completed", "Completed"
+
+  frequency=models.CharField(max_length=20)
+  plan=models.JSONField()
+  status=models.CharField(max_length=20, choices=Status.choices, default=Status.RUNNING)
+  created=models.DateTimeField(auto_now_add=True)
+  finished=models.DateTimeField(null=True, blank=True)
+
+  def __str__(self):
+    return f"{self.frequency} invoice run {self.id} ({self.status})"
+
+
+class InvoiceRunItem(models.Model):
+  """Progress of invoicing one parent within an InvoiceRun"""
+  class Status(models.TextChoices):
+    PENDING = "pending", "Pending"
+    INVOICED = "invoiced", "Invoiced"
+    SKIPPED = "skipped", "Skipped"
+    FAILED = "failed", "Failed"
+
+  run=models.ForeignKey(InvoiceRun, on_delete=models.CASCADE, related_name='items')
+  parent=models.ForeignKey('tutoring.Parent', on_delete=models.CASCADE, related_name='invoice_run_items')
+  status=models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+  # set as soon as the Stripe invoice exists, so a resumed run carries on with it
+  stripeInvoiceId=models.CharField(max_length=255, null=True, blank=True)
+  total=models.IntegerField(default=0)  # in cents
+  error=models.TextField(null=True, blank=True)
+  updated=models.DateTimeField(auto_now=True)
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['run', 'parent'], name='unique_invoice_run_parent'),
+    ]
+
+  def idempotency_key(self, step):
+    """Stripe idempotency key for one step of invoicing this run's parent"""
+    return f"invoice-run-{self.run_id}-parent-{self.parent_id}-{step}"
+
+
+class WebhookEvent(models.Model):
+  """
+  A Stripe webhook event, stored when it's received and processed later by
+  a django-q worker (see stripeInt.tasks), so the webhook is acknowledged
+  straight away.
+  """
+  class Status(models.TextChoices):
+    PENDING = "pending", "Pending"
+    PROCESSED = "processed", "Processed"
+    FAILED = "failed", "Failed"
+
+  stripeEventId=models.CharField(max_length=255, unique=True, null=True, blank=True)
+  type=models.CharField(max_length=100)
+  data=models.JSONField()  # the event's data.object
+  created=models.DateTimeField(null=True, blank=True)  # when Stripe created the event
+  received=models.DateTimeField(auto_now_add=True)
+  status=models.CharField(max_length=20, choices=Status.choices, default=Status.PENDING)
+  attempts=models.IntegerField(default=0)
+  error=models.TextField(null=True, blank=True)
+  processed=models.DateTimeField(null=True, blank=True)
+  # handler time of the last attempt in ms, for the webhook stats endpoint
+  duration=models.FloatField(null=True, blank=True)
+  # when a failed event is retried automatically, None once it's given up on
+  next_attempt=models.DateTimeField(null=True, blank=True)
+
+  class Meta:
+    indexes = [
+      models.Index(fields=['status', 'received']),
+      models.Index(fields=['received', 'type']),
+    ]
+
+  def __str__(self):
+    return f"{self.type} {self.stripeEventId or self.id} ({self.status})"
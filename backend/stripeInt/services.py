@@ -1,37 +1,88 @@
 from tutoring.models import Parent, LocalInvoice, Attendance, Lesson
+from tutoring.rollups import touch, utc_day
+from .client import getStripeClient, stripeLatencyStats
+from .models import InvoiceRun, InvoiceRunItem, StripeProd
 import stripe
-import os
+import random
+import threading
+import time
 from dotenv import load_dotenv
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from django.conf import settings
+from django.db import connections, transaction
 from django.db.models import Q
 load_dotenv()
 
 logger = logging.getLogger(__name__)
 
+# Outcomes of invoicing a single parent
+INVOICED = InvoiceRunItem.Status.INVOICED
+SKIPPED = InvoiceRunItem.Status.SKIPPED
+FAILED = InvoiceRunItem.Status.FAILED
+# Parents a resumed run doesn't invoice again
+DONE = {INVOICED, SKIPPED}
+
+# Retries of a Stripe call rejected for rate limiting, and the initial delay in seconds
+RATE_LIMIT_RETRIES = 5
+RATE_LIMIT_BACKOFF = 0.5
+
+# Seconds a price fetched from Stripe is reused for, when it isn't stored on its StripeProd
+PRICE_CACHE_TTL = 5 * 60
+
+# price id -> (expiry, unit_amount, currency)
+_price_cache = {}
+_price_cache_lock = threading.Lock()
+
 def generateWeeklyInvoices():
-    generateInvoices(frequency="weekly", amount_of_weeks=1)
+    return generateInvoices(frequency="weekly", amount_of_weeks=1)
 
 def generateFortnightlyInvoices():
-    generateInvoices(frequency="fortnightly", amount_of_weeks=2)
+    return generateInvoices(frequency="fortnightly", amount_of_weeks=2)
 
 def generateHalfTermlyInvoices():
-    generateInvoices(frequency="half-termly", amount_of_weeks=5)
+    return generateInvoices(frequency="half-termly", amount_of_weeks=5)
 
 def generateTermlyInvoices():
-    generateInvoices(frequency="termly", amount_of_weeks=10)
+    return generateInvoices(frequency="termly", amount_of_weeks=10)
 
 def generateInvoices(*, frequency, amount_of_weeks):
+    """
+    Invoice every active parent with the given payment frequency for their
+    unpaid attendances in the next amount_of_weeks: plan the run locally,
+    then apply the plan (see planInvoices and applyInvoicePlan).
+    
+    Returns a summary report of the run, or None if Stripe isn't configured.
+    """
     logger.info(f"Starting {frequency} invoice generation")
     
-    # Set up Stripe API key
-    stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
-    if not stripe.api_key:
-        logger.error("Stripe API key not found in environment variables")
+    if not configureStripe():
         return
     
+    plan = planInvoices(frequency=frequency, amount_of_weeks=amount_of_weeks)
+    return applyInvoicePlan(plan)
+
+def configureStripe():
+    """Check the shared Stripe client can be set up, returning whether an API key is configured"""
+    try:
+        getStripeClient()
+    except stripe.error.AuthenticationError as e:
+        logger.error(str(e))
+        return False
+    
     logger.debug("Stripe API key loaded successfully")
+    return True
+
+def planInvoices(*, frequency, amount_of_weeks):
+    """
+    Compute the billing plan for a run without creating anything in Stripe:
+    every active parent with the given payment frequency, the attendances
+    they're billed for and their priced line items. Prices come from
+    getPrice, so Stripe is only contacted for products without a stored price.
     
+    The plan is JSON serializable and can be applied later with applyInvoicePlan.
+    """
     # Calculate billing period
     period_start = datetime.now(timezone.utc)
     period_end = period_start + timedelta(weeks=amount_of_weeks)
@@ -39,158 +90,530 @@ def generateInvoices(*, frequency, amount_of_weeks):
     logger.info(f"Billing period: {period_start.date()} to {period_end.date()}")
     
     # Get all parents with matching payment frequency
-    parents = Parent.objects.filter(payment_frequency=frequency, is_active=True)
-    logger.info(f"Found {parents.count()} active parents with {frequency} payment frequency")
+    parents = list(Parent.objects.filter(payment_frequency=frequency, is_active=True))
+    logger.info(f"Found {len(parents)} active parents with {frequency} payment frequency")
+    
+    billing = planBilling(parents, period_start=period_start, period_end=period_end)
     
-    # Process each parent
+    entries = []
     for parent in parents:
-        logger.debug(f"Processing parent: {parent.name} (ID: {parent.id})")
-        
-        # Get all children for this parent
-        children = parent.children.filter(active=True)
+        items = []
+        error = None
+        try:
+            for item in billing[parent.id]['items']:
+                product = item['product']
+                unit_amount, currency = getPrice(product)
+                items.append({
+                    'product': product.stripeId,
+                    'description': f"{product.name} - {', '.join(sorted(item['student_names']))}",
+                    'quantity': item['quantity'],
+                    'unit_amount': unit_amount,
+                    'currency': currency,
+                    'amount': unit_amount * item['quantity'],
+                })
+        except stripe.error.StripeError as e:
+            # Only this parent's invoice is affected by a price that can't be looked up
+            logger.error(f"Failed to price invoice items for parent {parent.name}: {str(e)}")
+            error = str(e)
         
-        if not children.exists():
-            logger.warning(f"Parent {parent.name} has no active children, skipping")
-            continue
+        entries.append({
+            'parent': parent.id,
+            'name': parent.name,
+            'customer': parent.stripeId,
+            'attendances': [attendance.id for attendance in billing[parent.id]['attendances']],
+            'items': items,
+            'total': sum(item['amount'] for item in items),
+            'error': error,
+        })
+    
+    return {
+        'frequency': frequency,
+        'amount_of_weeks': amount_of_weeks,
+        'billing_period': calculate_billing_period(amount_of_weeks),
+        'period_start': period_start.isoformat(),
+        'period_end': period_end.isoformat(),
+        'parents': entries,
+        'total': sum(entry['total'] for entry in entries),
+    }
+
+def applyInvoicePlan(plan):
+    """
+    Create the Stripe invoices described by a plan from planInvoices,
+    recording the run and each parent's progress in an InvoiceRun ledger
+    so it can be resumed with resumeInvoiceRun if it's interrupted.
+    
+    Returns a summary report of the run, or None if Stripe isn't configured.
+    """
+    if not configureStripe():
+        return
+    
+    parent_ids = Parent.objects.filter(
+        id__in=[entry['parent'] for entry in plan['parents']]
+    ).values_list('id', flat=True)
+    
+    with transaction.atomic():
+        run = InvoiceRun.objects.create(frequency=plan['frequency'], plan=plan)
+        InvoiceRunItem.objects.bulk_create([
+            InvoiceRunItem(run=run, parent_id=parent_id) for parent_id in parent_ids
+        ])
+    
+    return runInvoices(run)
+
+def resumeInvoiceRun(run):
+    """
+    Carry on with an interrupted or partly failed InvoiceRun. Parents already
+    invoiced or skipped are left alone; the rest are retried with the same
+    Stripe idempotency keys, so nothing is billed twice.
+    
+    Returns a summary report of the whole run, or None if Stripe isn't configured.
+    """
+    if not configureStripe():
+        return
+    
+    logger.info(f"Resuming {run}")
+    return runInvoices(run)
+
+def runInvoices(run):
+    """
+    Invoice every parent of an InvoiceRun that isn't done yet. Parents are
+    processed concurrently by up to settings.INVOICE_WORKERS threads. A parent
+    whose planned attendances have since been paid, invoiced or deleted is
+    reported as failed rather than billed from a stale plan.
+    """
+    plan = run.plan
+    frequency = plan['frequency']
+    entries = plan['parents']
+    logger.info(f"Applying {frequency} invoice plan for {len(entries)} parents (run {run.id})")
+    started = time.monotonic()
+    
+    items = {item.parent_id: item for item in run.items.all()}
+    parents = Parent.objects.in_bulk(list(items))
+    attendances = Attendance.objects.filter(
+        id__in=[
+            attendance_id
+            for entry in entries if entry['parent'] in items and items[entry['parent']].status not in DONE
+            for attendance_id in entry['attendances']
+        ],
+        paid=False,
+        local_invoice__isnull=True
+    ).in_bulk()
+    
+    def invoice(entry):
+        item = items.get(entry['parent'])
+        if item is not None and item.status in DONE:
+            logger.debug(f"Parent {entry['name']} already {item.status} in run {run.id}, skipping")
+            return {'parent': entry['parent'], 'name': entry['name'], 'status': item.status,
+                    'invoice': item.stripeInvoiceId, 'total': item.total, 'error': None}
+        return invoiceParent(entry, item, parents, attendances, plan)
+    
+    workers = min(getattr(settings, 'INVOICE_WORKERS', 1), len(entries))
+    if workers <= 1:
+        results = [invoice(entry) for entry in entries]
+    else:
+        def run_in_worker(entry):
+            try:
+                return invoice(entry)
+            finally:
+                # Worker threads open their own DB connections
+                connections.close_all()
         
-        # Collect all attendances for all children in this billing period
-        all_attendances = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(run_in_worker, entries))
+    
+    summary = {
+        'run': run.id,
+        'frequency': frequency,
+        'parents': len(entries),
+        'invoiced': sum(1 for result in results if result['status'] == INVOICED),
+        'skipped': sum(1 for result in results if result['status'] == SKIPPED),
+        'failed': [result for result in results if result['status'] == FAILED],
+        'total': sum(result['total'] for result in results),
+        'duration': time.monotonic() - started,
+    }
+    
+    run.status = InvoiceRun.Status.INCOMPLETE if summary['failed'] else InvoiceRun.Status.COMPLETED
+    run.finished = datetime.now(timezone.utc)
+    run.save(update_fields=['status', 'finished'])
+    
+    logger.info(f"Completed {frequency} invoice generation (run {run.id}) in {summary['duration']:.1f}s: "
+               f"{summary['invoiced']} invoiced, {summary['skipped']} skipped, "
+               f"{len(summary['failed'])} failed, totaling ${summary['total'] / 100}")
+    logger.info(f"Stripe latency so far: {stripeLatencyStats()}")
+    return summary
+
+def planBilling(parents, *, period_start, period_end):
+    """
+    Fetch the unpaid attendances of every active child of the given parents
+    in the billing period that aren't on an invoice yet with a single query,
+    and total them per product. Attendances invoiced by an earlier run are
+    left out, so rerunning an invoice command doesn't bill them again.
+    
+    Returns {parent id: {'attendances': [...], 'items': [...]}}, where each
+    item is a dict of product, quantity (hours) and student_names.
+    """
+    billing = {parent.id: {'attendances': [], 'items': {}} for parent in parents}
+    
+    attendances = Attendance.objects.filter(
+        tutoringStudent__parent__in=parents,
+        tutoringStudent__active=True,
+        lesson__date__gte=period_start,
+        lesson__date__lt=period_end,
+        paid=False,  # Only invoice unpaid attendances
+        local_invoice__isnull=True
+    ).select_related(
+        'tutoringStudent', 'lesson__group__associated_product'
+    ).order_by('lesson__date', 'id')
+    
+    for attendance in attendances:
+        parent_billing = billing[attendance.tutoringStudent.parent_id]
+        parent_billing['attendances'].append(attendance)
         
-        for child in children:
-            logger.debug(f"Processing child: {child.name} (ID: {child.id})")
-            
-            # Get attendances for this child in the billing period
-            attendances = Attendance.objects.filter(
-                tutoringStudent=child,
-                lesson__date__gte=period_start,
-                lesson__date__lt=period_end,
-                paid=False  # Only invoice unpaid attendances
-            ).select_related('lesson', 'lesson__group', 'lesson__group__associated_product')
-            
-            logger.debug(f"Found {attendances.count()} unpaid attendances for {child.name}")
-            all_attendances.extend(attendances)
+        # Get the product from the group
+        group = attendance.lesson.group
+        product = group.associated_product
         
-        # Skip if no attendances to invoice
-        if not all_attendances:
-            logger.warning(f"No unpaid attendances found for parent {parent.name}, skipping")
+        if not product:
+            logger.warning(f"Attendance {attendance.id} has no associated product, skipping")
             continue
         
-        try:
+        # Count quantity per product (product is priced per hour of lesson length)
+        item = parent_billing['items'].setdefault(product.id, {
+            'product': product,
+            'quantity': 0,
+            'student_names': set()
+        })
+        item['quantity'] += group.lesson_length
+        item['student_names'].add(attendance.tutoringStudent.name)
+    
+    for parent_billing in billing.values():
+        parent_billing['items'] = list(parent_billing['items'].values())
+    
+    logger.debug(f"Found {sum(len(b['attendances']) for b in billing.values())} unpaid attendances "
+                f"for {len(parents)} parents")
+    return billing
+
+def invoiceParent(entry, item, parents, attendances, plan):
+    """
+    Create, fill and finalize one parent's Stripe invoice from their plan
+    entry and link their attendances to it, recording progress on their
+    InvoiceRunItem. parents and attendances map ids to the rows loaded for
+    the whole plan. Never raises; returns a result dict with a status of
+    INVOICED, SKIPPED or FAILED and the invoice total in cents.
+    """
+    result = {'parent': entry['parent'], 'name': entry['name'], 'status': SKIPPED, 'invoice': None, 'total': 0, 'error': None}
+    logger.debug(f"Processing parent: {entry['name']} (ID: {entry['parent']})")
+    
+    def record(**fields):
+        if item is not None:
+            InvoiceRunItem.objects.filter(id=item.id).update(**fields)
+    
+    def fail(error):
+        result['status'] = FAILED
+        result['error'] = error
+        record(status=FAILED, error=error)
+        return result
+    
+    # Skip if no attendances to invoice
+    if not entry['attendances']:
+        logger.warning(f"No unpaid attendances found for parent {entry['name']}, skipping")
+        record(status=SKIPPED)
+        return result
+    
+    if entry.get('error'):
+        return fail(entry['error'])
+    
+    parent = parents.get(entry['parent'])
+    all_attendances = [attendances[attendance_id] for attendance_id in entry['attendances'] if attendance_id in attendances]
+    if parent is None or item is None or len(all_attendances) != len(entry['attendances']):
+        logger.error(f"Not invoicing parent {entry['name']}: plan is out of date")
+        return fail("Plan is out of date: the parent or some of their attendances have since been paid, invoiced or deleted")
+    
+    amount_of_weeks = plan['amount_of_weeks']
+    
+    try:
+        client = getStripeClient()
+        # taken before any of the requests the stored invoice comes from
+        version = fetchedVersion()
+        if item.stripeInvoiceId:
+            # A previous attempt got as far as creating the invoice
+            invoice = with_rate_limit_backoff(client.invoices.retrieve, item.stripeInvoiceId)
+            logger.info(f"Resuming Stripe invoice {invoice.id} for parent {parent.name}")
+        else:
             # Create Stripe invoice
-            invoice = stripe.Invoice.create(
-                customer=parent.stripeId,
-                auto_advance=True,
-                collection_method="send_invoice",
-                days_until_due=amount_of_weeks * 7,
-                custom_fields=[
-                    {
-                        "name": "Billing Period",
-                        "value": calculate_billing_period(amount_of_weeks)
-                    },
-                    {
-                        "name": "Payment Frequency",
-                        "value": frequency
-                    }
-                ]
+            invoice = with_rate_limit_backoff(
+                client.invoices.create,
+                params={
+                    "customer": parent.stripeId,
+                    "auto_advance": True,
+                    "collection_method": "send_invoice",
+                    "days_until_due": amount_of_weeks * 7,
+                    "custom_fields": [
+                        {
+                            "name": "Billing Period",
+                            "value": plan['billing_period']
+                        },
+                        {
+                            "name": "Payment Frequency",
+                            "value": plan['frequency']
+                        }
+                    ],
+                },
+                options={"idempotency_key": item.idempotency_key('invoice')}
             )
-            
+            record(stripeInvoiceId=invoice.id)
             logger.info(f"Created Stripe invoice {invoice.id} for parent {parent.name}")
-            
-            # NOTE: We don't create LocalInvoice here anymore!
-            # The webhook (invoice.created) will handle creating the LocalInvoice
-            # We just need to wait a moment for the webhook to process
-            logger.debug(f"Waiting for webhook to create LocalInvoice for Stripe invoice {invoice.id}")
-            
-            # Group attendances by product for invoice items
-            product_quantities = {}
-            attendance_list = []
-            
-            for attendance in all_attendances:
-                attendance_list.append(attendance)
-                
-                # Get the product from the group
-                product = attendance.lesson.group.associated_product
-                
-                if not product:
-                    logger.warning(f"Attendance {attendance.id} has no associated product, skipping")
-                    continue
-                
-                # Get lesson length for this group (product is priced per hour)
-                lesson_length = attendance.lesson.group.lesson_length
-                
-                # Count quantity per product (accounting for lesson length)
-                if product.id not in product_quantities:
-                    product_quantities[product.id] = {
-                        'product': product,
-                        'quantity': 0,
-                        'student_names': set()
-                    }
-                
-                product_quantities[product.id]['quantity'] += lesson_length
-                product_quantities[product.id]['student_names'].add(attendance.tutoringStudent.name)
-            
+        result['invoice'] = invoice.id
+        
+        if invoice.status == 'draft':
             # Create invoice items in Stripe
-            for product_data in product_quantities.values():
-                product = product_data['product']
-                quantity = product_data['quantity']
-                student_names = ', '.join(sorted(product_data['student_names']))
-                
-                logger.debug(f"Creating invoice item for: {product.name} (quantity: {quantity})")
-                
-                # Retrieve price from Stripe
-                price_obj = stripe.Price.retrieve(product.defaultPriceId)
+            for index, line in enumerate(entry['items']):
+                logger.debug(f"Creating invoice item for: {line['description']} (quantity: {line['quantity']})")
                 
-                # Create invoice item
-                stripe.InvoiceItem.create(
-                    customer=parent.stripeId,
-                    unit_amount_decimal=price_obj.unit_amount,
-                    currency=price_obj.currency,
-                    description=f"{product.name} - {student_names}",
-                    quantity=quantity,
-                    invoice=invoice.id
+                with_rate_limit_backoff(
+                    client.invoice_items.create,
+                    params={
+                        "customer": parent.stripeId,
+                        "unit_amount_decimal": line['unit_amount'],
+                        "currency": line['currency'],
+                        "description": line['description'],
+                        "quantity": line['quantity'],
+                        "invoice": invoice.id,
+                    },
+                    options={"idempotency_key": item.idempotency_key(f'item-{index}')}
                 )
             
             # Finalize the invoice (this will trigger invoice.finalized webhook)
-            finalized_invoice = stripe.Invoice.finalize_invoice(invoice.id)
-            
-            logger.info(f"Successfully created and finalized invoice {invoice.id} for parent {parent.name} "
-                       f"with {len(all_attendances)} attendances totaling ${finalized_invoice.total / 100}")
-            
-            # Now link attendances to the LocalInvoice
-            # We need to wait for the webhook to create the LocalInvoice first
-            # In production, you might want to use a retry mechanism or celery task
-            # For now, we'll try to get it with a simple retry
-            local_invoice = None
-            for attempt in range(3):
-                try:
-                    local_invoice = LocalInvoice.objects.get(stripeInvoiceId=invoice.id)
-                    logger.debug(f"Found LocalInvoice {local_invoice.id} for Stripe invoice {invoice.id}")
-                    break
-                except LocalInvoice.DoesNotExist:
-                    if attempt < 2:
-                        logger.debug(f"LocalInvoice not found yet (attempt {attempt + 1}/3), waiting...")
-                        import time
-                        time.sleep(1)  # Wait 1 second before retry
-                    else:
-                        logger.warning(f"LocalInvoice not found after 3 attempts for Stripe invoice {invoice.id}")
-            
-            # Link attendances to local invoice if found
-            if local_invoice:
-                for attendance in attendance_list:
-                    attendance.local_invoice = local_invoice
-                Attendance.objects.bulk_update(attendance_list, ['local_invoice'])
-                logger.debug(f"Linked {len(attendance_list)} attendances to LocalInvoice {local_invoice.id}")
-            else:
-                logger.error(f"Could not link attendances - LocalInvoice not created for {invoice.id}")
-            
-        except stripe.error.StripeError as e:
-            logger.error(f"Failed to create invoice for parent {parent.name}: {str(e)}")
-            continue
-        except Exception as e:
-            logger.error(f"Unexpected error creating invoice for parent {parent.name}: {str(e)}")
-            continue
+            finalized_invoice = with_rate_limit_backoff(
+                client.invoices.finalize_invoice, invoice.id,
+                options={"idempotency_key": item.idempotency_key('finalize')}
+            )
+        else:
+            # Finalized by a previous attempt that stopped before linking attendances
+            finalized_invoice = invoice
+        
+        logger.info(f"Successfully created and finalized invoice {invoice.id} for parent {parent.name} "
+                   f"with {len(all_attendances)} attendances totaling ${finalized_invoice.total / 100}")
+        
+        # Store the invoice locally, link the attendances to it and mark the
+        # parent done in one transaction, rather than waiting for the
+        # invoice.created webhook
+        with transaction.atomic():
+            local_invoice = upsertLocalInvoice(finalized_invoice, version)
+            for attendance in all_attendances:
+                attendance.local_invoice = local_invoice
+            Attendance.objects.bulk_update(all_attendances, ['local_invoice'])
+            record(status=INVOICED, total=finalized_invoice.total, error=None)
+            touch('Attendance')
+        logger.debug(f"Linked {len(all_attendances)} attendances to LocalInvoice {local_invoice.id}")
+        
+        result['status'] = INVOICED
+        result['total'] = finalized_invoice.total
+        
+    except stripe.error.StripeError as e:
+        logger.error(f"Failed to create invoice for parent {parent.name}: {str(e)}")
+        fail(str(e))
+    except Exception as e:
+        logger.error(f"Unexpected error creating invoice for parent {parent.name}: {str(e)}")
+        fail(str(e))
     
-    logger.info(f"Completed {frequency} invoice generation")
+    return result
+
+# The LocalInvoice fields copied from Stripe invoice objects, see localInvoiceFields
+SYNCED_FIELDS = (
+    'status',
+    'amount_due',
+    'amount_paid',
+    'currency',
+    'created',
+    'status_transitions_paid_at',
+    'customer_stripe_id',
+)
+
+def localInvoiceFields(data):
+    """LocalInvoice fields (SYNCED_FIELDS) from a Stripe invoice object"""
+    paid_at = data['status_transitions'].get('paid_at')
+    return {
+        'status': data['status'],
+        'amount_due': data['amount_due'],
+        'amount_paid': data['amount_paid'],
+        'currency': data['currency'],
+        'created': datetime.fromtimestamp(data['created'], tz=timezone.utc),
+        'status_transitions_paid_at': (
+            datetime.fromtimestamp(paid_at, tz=timezone.utc) if paid_at else None
+        ),
+        'customer_stripe_id': data.get('customer'),
+    }
+
+def upsertLocalInvoice(data, version):
+    """
+    Create or update the LocalInvoice for a Stripe invoice object fetched
+    from the API, version being the fetchedVersion() from before the fetch.
+    Shared by invoice generation and the invoice webhooks, so whichever runs
+    first creates it and the other updates it, but like webhook events it
+    doesn't overwrite an invoice updated from a newer event.
+    Returns the LocalInvoice.
+    """
+    syncLocalInvoice(data, version)
+    return LocalInvoice.objects.get(stripeInvoiceId=data['id'])
+
+def fetchedVersion():
+    """
+    Version (see notNewerThan) for Stripe objects about to be fetched from
+    the API: the current time to the second, as event times only have second
+    precision. Events created before it are older than what the fetch
+    returns and are dropped; events from then on still apply over it.
+    """
+    return datetime.now(timezone.utc).replace(microsecond=0)
+
+def notNewerThan(queryset, version):
+    """
+    Rows of queryset (a model with stripeUpdated) not yet updated from a
+    webhook event newer than version, the created time of the event being
+    applied. Events from the same second still apply, as Stripe timestamps
+    only have second precision. A version of None matches every row.
+    """
+    if version is None:
+        return queryset
+    return queryset.filter(Q(stripeUpdated__isnull=True) | Q(stripeUpdated__lte=version))
+
+def applyStripeUpdate(queryset, version, **fields):
+    """
+    Update the rows of queryset with a single conditional UPDATE, skipping
+    rows already updated from a newer webhook event (see notNewerThan).
+    version is stored as the rows' new stripeUpdated. Returns the number of
+    rows updated.
+    """
+    if version is not None:
+        fields['stripeUpdated'] = version
+    return notNewerThan(queryset, version).update(**fields)
+
+def syncLocalInvoice(data, version):
+    """
+    Apply a Stripe invoice object from a webhook event to its LocalInvoice,
+    creating it if needed. Stale events are dropped without reading the row.
+    Returns whether anything changed.
+    """
+    fields = localInvoiceFields(data)
+    # update() skips auto_now
+    synced = datetime.now(timezone.utc)
+    if applyStripeUpdate(LocalInvoice.objects.filter(stripeInvoiceId=data['id']), version, last_synced=synced, **fields):
+        # Stripe never moves paid_at once set, so these are the only days affected
+        touch(
+            'LocalInvoice',
+            revenue_days=[utc_day(fields['created']), utc_day(fields['status_transitions_paid_at'])],
+            stripe_invoice_ids=[data['id']]
+        )
+        return True
+
+    local_invoice, created = LocalInvoice.objects.get_or_create(
+        stripeInvoiceId=data['id'],
+        defaults={**fields, 'stripeUpdated': version}
+    )
+    return created
+
+def syncLocalInvoices(invoices):
+    """
+    syncLocalInvoice for many (invoice object, version) pairs with distinct
+    invoice ids, in one query for the stored versions and one upsert.
+    The stored rows are locked while they're written, so a concurrent update
+    can't land between the version check and the write.
+    Returns the number of invoices written.
+    """
+    with transaction.atomic():
+        stored = {
+            stripeInvoiceId: (stripeUpdated, created, paid_at)
+            for stripeInvoiceId, stripeUpdated, created, paid_at in LocalInvoice.objects.select_for_update().filter(
+                stripeInvoiceId__in=[data['id'] for data, version in invoices]
+            ).values_list('stripeInvoiceId', 'stripeUpdated', 'created', 'status_transitions_paid_at')
+        }
+
+        local_invoices = []
+        days = set()
+        for data, version in invoices:
+            stripeUpdated, *old_days = stored.get(data['id'], (None, None, None))
+            if version is not None and stripeUpdated is not None and stripeUpdated > version:
+                logger.info(f"Invoice {data['id']} has a newer update, ignoring")
+                continue
+
+            fields = localInvoiceFields(data)
+            local_invoices.append(LocalInvoice(
+                stripeInvoiceId=data['id'],
+                stripeUpdated=stripeUpdated if version is None else version,
+                **fields
+            ))
+            days.update(utc_day(day) for day in old_days)
+            days.update([utc_day(fields['created']), utc_day(fields['status_transitions_paid_at'])])
+
+        if not local_invoices:
+            return 0
+
+        LocalInvoice.objects.bulk_create(
+            local_invoices,
+            update_conflicts=True,
+            unique_fields=['stripeInvoiceId'],
+            update_fields=[*SYNCED_FIELDS, 'stripeUpdated', 'last_synced']
+        )
+        touch(
+            'LocalInvoice',
+            revenue_days=days,
+            stripe_invoice_ids=[invoice.stripeInvoiceId for invoice in local_invoices]
+        )
+    return len(local_invoices)
+
+def getPrice(product):
+    """
+    (unit_amount, currency) of a product's default price. Read from the
+    StripeProd itself, which the price webhooks keep current, falling back to
+    an in-process TTL cache of Stripe lookups for products without one.
+    """
+    if product.unit_amount is not None and product.currency:
+        return product.unit_amount, product.currency
+    
+    price_id = product.defaultPriceId
+    with _price_cache_lock:
+        cached = _price_cache.get(price_id)
+    if cached and cached[0] > time.monotonic():
+        return cached[1], cached[2]
+    
+    logger.debug(f"Retrieving price {price_id} for {product.name} from Stripe")
+    price_obj = with_rate_limit_backoff(getStripeClient().prices.retrieve, price_id)
+    with _price_cache_lock:
+        _price_cache[price_id] = (time.monotonic() + PRICE_CACHE_TTL, price_obj.unit_amount, price_obj.currency)
+    
+    # Store it locally so later runs don't need the lookup
+    StripeProd.objects.filter(id=product.id, defaultPriceId=price_id).update(
+        unit_amount=price_obj.unit_amount,
+        currency=price_obj.currency
+    )
+    return price_obj.unit_amount, price_obj.currency
+
+def forgetPrice(price_id):
+    """Drop a price from the in-process cache, e.g. when Stripe reports it changed"""
+    with _price_cache_lock:
+        _price_cache.pop(price_id, None)
+
+def describeInvoiceRun(summary):
+    """One-line description of a generateInvoices summary, for command output"""
+    return (f"run {summary['run']}: {summary['invoiced']} invoiced, {summary['skipped']} skipped, "
+            f"{len(summary['failed'])} failed of {summary['parents']} parents, "
+            f"totaling ${summary['total'] / 100} in {summary['duration']:.1f}s")
+
+def with_rate_limit_backoff(func, *args, **kwargs):
+    """
+    Call a Stripe API function, retrying with exponential backoff and jitter
+    when Stripe responds 429 (concurrent workers share one rate limit).
+    """
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        try:
+            return func(*args, **kwargs)
+        except stripe.error.RateLimitError:
+            if attempt == RATE_LIMIT_RETRIES:
+                raise
+            delay = RATE_LIMIT_BACKOFF * 2 ** attempt
+            delay += random.uniform(0, delay)
+            logger.warning(f"Stripe rate limit hit, retrying in {delay:.2f}s "
+                          f"(attempt {attempt + 1}/{RATE_LIMIT_RETRIES})")
+            time.sleep(delay)
 
 def calculate_billing_period(amount_of_weeks):
     """
@@ -0,0 +1,195 @@
+"""
+django-q tasks processing the Stripe webhook events stored by
+stripeInt.views.webhooks_view.
+"""
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+import stripe
+from django.db import transaction
+from django.db.models import F, Q
+
+from .models import WebhookEvent
+from .client import getStripeClient
+from .services import fetchedVersion, syncLocalInvoices, upsertLocalInvoice
+from .views import getWebhookHandler
+
+logger = logging.getLogger(__name__)
+
+# Pending events locked and processed together by processWebhookEvents
+WEBHOOK_BATCH_SIZE = 100
+
+# Failed events are retried automatically up to this many attempts in all,
+# after WEBHOOK_RETRY_DELAY seconds, doubling each time. Past that only
+# retryWebhookEvents (the retry_webhook_events command) picks them up.
+WEBHOOK_MAX_ATTEMPTS = 5
+WEBHOOK_RETRY_DELAY = 60
+
+# Invoice events that only sync the invoice's LocalInvoice, so a batch only
+# needs to apply the latest one per invoice
+COALESCED_EVENT_TYPES = {
+    'invoice.created',
+    'invoice.updated',
+    'invoice.finalized',
+    'invoice.paid',
+    'invoice.payment_succeeded',
+}
+
+
+def processWebhookEvents(batch_size=WEBHOOK_BATCH_SIZE):
+    """
+    Drain the pending webhook events, and the failed ones due a retry, in
+    batches, oldest first. Enqueued by the webhook view and run every minute
+    by the process-webhook-events schedule. A batch's rows stay locked while
+    it's processed, so concurrent workers take different events, and a
+    worker finding nothing left returns straight away.
+    Returns the number of events processed successfully.
+    """
+    processed = 0
+    # events failing again in this run are due later, not picked up again
+    now = datetime.now(timezone.utc)
+    while True:
+        with transaction.atomic():
+            batch = list(
+                WebhookEvent.objects.select_for_update(skip_locked=True)
+                .filter(
+                    Q(status=WebhookEvent.Status.PENDING)
+                    | Q(status=WebhookEvent.Status.FAILED, next_attempt__lte=now)
+                )
+                .order_by('received', 'id')[:batch_size]
+            )
+            if not batch:
+                return processed
+            processed += processWebhookBatch(batch)
+
+
+def processWebhookBatch(batch):
+    """
+    Process a batch of webhook events. Invoice sync events are coalesced to
+    the latest state of each invoice and written with one bulk upsert,
+    so DB writes scale with distinct invoices rather than events. Other
+    events run their handler one by one. Returns the number processed.
+    """
+    latest = {}
+    coalesced, others = [], []
+    for webhook_event in batch:
+        object_id = webhook_event.data.get('id')
+        if webhook_event.type not in COALESCED_EVENT_TYPES or not object_id:
+            others.append(webhook_event)
+            continue
+
+        coalesced.append(webhook_event)
+        # the batch is in order received, so ties go to the later delivery
+        current = latest.get(object_id)
+        if current is None or eventTime(webhook_event) >= eventTime(current):
+            latest[object_id] = webhook_event
+
+    processed = 0
+    if coalesced:
+        try:
+            with transaction.atomic():
+                started = time.perf_counter()
+                written = syncLocalInvoices([(e.data, e.created) for e in latest.values()])
+                WebhookEvent.objects.filter(id__in=[e.id for e in coalesced]).update(
+                    status=WebhookEvent.Status.PROCESSED,
+                    attempts=F('attempts') + 1,
+                    error=None,
+                    next_attempt=None,
+                    processed=datetime.now(timezone.utc),
+                    # each event's share of the upsert
+                    duration=(time.perf_counter() - started) * 1000 / len(coalesced)
+                )
+            logger.info(f"Coalesced {len(coalesced)} invoice events into {written} invoice updates")
+            processed += len(coalesced)
+        except Exception as e:
+            # fall back to one at a time, so failures are recorded per event
+            logger.error(f"Failed to apply {len(coalesced)} coalesced invoice events: {e}")
+            others = sorted(others + coalesced, key=lambda e: (e.received, e.id))
+
+    for webhook_event in others:
+        if applyWebhookEvent(webhook_event):
+            processed += 1
+    return processed
+
+
+def eventTime(webhook_event):
+    return webhook_event.created or webhook_event.received
+
+
+def processWebhookEvent(webhook_event_id):
+    """Process a single stored webhook event, see applyWebhookEvent"""
+    webhook_event = WebhookEvent.objects.get(id=webhook_event_id)
+    if webhook_event.status == WebhookEvent.Status.PROCESSED:
+        logger.info(f"Webhook event {webhook_event.id} already processed, skipping")
+        return True
+    return applyWebhookEvent(webhook_event)
+
+
+def applyWebhookEvent(webhook_event):
+    """
+    Run the handler for a stored webhook event, recording the outcome on it.
+    Failures are kept on the event for retryWebhookEvents rather than raised.
+    Returns whether the event is processed.
+    """
+    webhook_event.attempts += 1
+    webhookHandler = getWebhookHandler(webhook_event.type)
+    logger.info(f"Processing webhook event {webhook_event.id} with handler: {webhookHandler.__class__.__name__}")
+
+    started = time.perf_counter()
+    try:
+        # roll back a handler's partial writes if it fails
+        with transaction.atomic():
+            webhookHandler.handle(webhook_event.data, webhook_event.created)
+    except Exception as e:
+        logger.error(f"Failed to process webhook event {webhook_event.id} ({webhook_event.type}): {e}")
+        webhook_event.status = WebhookEvent.Status.FAILED
+        webhook_event.error = str(e)
+        webhook_event.next_attempt = nextAttempt(webhook_event.attempts)
+        webhook_event.duration = (time.perf_counter() - started) * 1000
+        webhook_event.save(update_fields=['status', 'attempts', 'error', 'next_attempt', 'duration'])
+        return False
+
+    webhook_event.status = WebhookEvent.Status.PROCESSED
+    webhook_event.error = None
+    webhook_event.next_attempt = None
+    webhook_event.processed = datetime.now(timezone.utc)
+    webhook_event.duration = (time.perf_counter() - started) * 1000
+    webhook_event.save(update_fields=['status', 'attempts', 'error', 'next_attempt', 'processed', 'duration'])
+    logger.info(f"Successfully processed webhook: {webhook_event.type}")
+    return True
+
+
+def nextAttempt(attempts):
+    """When an event that has failed attempts times is retried, None to give up"""
+    if attempts >= WEBHOOK_MAX_ATTEMPTS:
+        return None
+    return datetime.now(timezone.utc) + timedelta(seconds=WEBHOOK_RETRY_DELAY * 2 ** (attempts - 1))
+
+
+def syncStripeInvoice(stripe_invoice_id):
+    """
+    Fetch an invoice from Stripe and store it as its LocalInvoice, see
+    upsertLocalInvoice. Enqueued by the webhook handlers rather than called
+    from them, so no webhook rows are locked during the request.
+    """
+    version = fetchedVersion()
+    try:
+        stripe_invoice = getStripeClient().invoices.retrieve(stripe_invoice_id)
+    except stripe.error.StripeError as e:
+        logger.error(f"Failed to fetch invoice {stripe_invoice_id}: {e}")
+        return False
+    upsertLocalInvoice(stripe_invoice, version)
+    logger.info(f"Invoice {stripe_invoice_id} synced from Stripe")
+    return True
+
+
+def retryWebhookEvents():
+    """
+    Process every stored event that is still pending or failed, oldest first,
+    e.g. after the cluster was down. Returns the number processed successfully.
+    """
+    webhook_event_ids = WebhookEvent.objects.exclude(
+        status=WebhookEvent.Status.PROCESSED
+    ).order_by('received').values_list('id', flat=True)
+    return sum(1 for webhook_event_id in webhook_event_ids if processWebhookEvent(webhook_event_id))
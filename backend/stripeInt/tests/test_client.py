@@ -0,0 +1,63 @@
+import os
+from unittest.mock import patch
+
+import requests
+import stripe
+from django.test import SimpleTestCase
+
+from stripeInt import client
+from stripeInt.client import endpointPath, getStripeClient, stripeLatencyStats
+
+
+class StripeClientTest(SimpleTestCase):
+    def setUp(self):
+        env = patch.dict(os.environ, {'STRIPE_SECRET_KEY': 'sk_test_fake'})
+        env.start()
+        self.addCleanup(env.stop)
+
+        for name, value in [('_http_client', None), ('_clients', {})]:
+            patcher = patch.object(client, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        client._latencies.clear()
+        client._request_counts.clear()
+
+    def test_endpoint_path(self):
+        self.assertEqual(
+            endpointPath("https://api.stripe.com/v1/invoices/in_1PqRsT2eZvKYlo2C/finalize"),
+            "/v1/invoices/{id}/finalize"
+        )
+        self.assertEqual(endpointPath("https://api.stripe.com/v1/invoiceitems"), "/v1/invoiceitems")
+        self.assertEqual(endpointPath("https://api.stripe.com/v1/prices/price_123?expand[]=product"), "/v1/prices/{id}")
+
+    def test_client_and_connection_pool_are_shared(self):
+        first = getStripeClient()
+        self.assertIs(getStripeClient(), first)
+
+        with patch.dict(os.environ, {'STRIPE_SECRET_KEY': 'sk_test_other'}):
+            other = getStripeClient()
+        self.assertIsNot(other, first)
+        self.assertIs(other._requestor._client, first._requestor._client)
+
+    def test_missing_api_key(self):
+        with patch.dict(os.environ, {'STRIPE_SECRET_KEY': ''}):
+            with self.assertRaises(stripe.error.AuthenticationError):
+                getStripeClient()
+
+    @patch.object(requests.Session, 'request')
+    def test_request_latency_recorded_per_endpoint(self, session_request):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"id": "in_test", "object": "invoice", "status": "open"}'
+        session_request.return_value = response
+
+        stripe_client = getStripeClient()
+        stripe_client.invoices.retrieve("in_1PqRsT2eZvKYlo2C")
+        stripe_client.invoices.retrieve("in_2AbCdE3fGhIjKl4M")
+
+        stats = stripeLatencyStats()
+        self.assertEqual(list(stats), ["GET /v1/invoices/{id}"])
+        self.assertEqual(stats["GET /v1/invoices/{id}"]['count'], 2)
+        self.assertIsNotNone(stats["GET /v1/invoices/{id}"]['p95_ms'])
+        # both went through the one pooled session
+        self.assertEqual(session_request.call_count, 2)
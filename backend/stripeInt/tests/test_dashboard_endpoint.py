@@ -1,15 +1,20 @@
-from django.test import TestCase
+from unittest.mock import patch
+from django.core.management import call_command
+from django.test import TestCase, override_settings
 from django.urls import reverse
 from rest_framework.test import APIClient
 from rest_framework import status
 from datetime import datetime, timedelta, timezone
 from tutoring.models import (
-    TutoringStudent, Parent, Group, Lesson, Attendance, LocalInvoice
+    TutoringStudent, Parent, Group, Lesson, Attendance, LocalInvoice,
+    DailyAttendanceRollup, DailyRevenueRollup
 )
+from tutoring.rollups import rebuild_rollups
 from stripeInt.models import StripeProd
 from decimal import Decimal
 from django.db.models.signals import post_save
 from django.dispatch import receiver
+from django.core.cache import cache, caches
 
 
 class DashboardViewTests(TestCase):
@@ -33,6 +38,7 @@ class DashboardViewTests(TestCase):
     
     def setUp(self):
         """Set up test fixtures"""
+        cache.clear()
         self.client = APIClient()
         self.url = reverse('dashboard')
         
@@ -271,6 +277,32 @@ class DashboardViewTests(TestCase):
         # 2 paid out of 3 total invoices = 66.7%
         self.assertAlmostEqual(metrics['paymentRate']['value'], 66.7, places=1)
     
+    def test_metrics_compare_periods_in_one_query_per_table(self):
+        """Test that both periods come from one query per table"""
+        self._create_attendances()
+        
+        # $150 paid in the previous 90 day period, matching the current period
+        LocalInvoice.objects.create(
+            stripeInvoiceId="inv_prev",
+            status='paid',
+            amount_due=15000,
+            amount_paid=15000,
+            created=self.today - timedelta(days=100),
+            status_transitions_paid_at=self.today - timedelta(days=100),
+        )
+        
+        from api.views import DashboardView
+        
+        with self.assertNumQueries(3):
+            metrics = DashboardView()._get_metrics_data(
+                self.today - timedelta(days=90), self.today
+            )
+        
+        self.assertEqual(metrics['termRevenue']['value'], 150.0)
+        self.assertEqual(metrics['termRevenue']['change'], 0)
+        # 2 of 3 invoices paid now, 1 of 1 previously
+        self.assertEqual(metrics['paymentRate']['change'], -33.3)
+    
     def test_attendance_trends_structure(self):
         """Test attendance trends data structure"""
         self._create_attendances()
@@ -350,6 +382,24 @@ class DashboardViewTests(TestCase):
         # Student 1: 4/4, Student 2: 2/4, Student 3: 1/4 = 7 total
         self.assertAlmostEqual(test_group['homework'], 58.3, places=1)
     
+    def test_group_performance_single_query(self):
+        """Test that group performance is one query regardless of group count"""
+        self._create_attendances()
+        for day in Group.Weekday.values[1:]:
+            Group.objects.create(lesson_length=60, tutor="Extra Tutor", day_of_week=day)
+        
+        from api.views import DashboardView
+        
+        with self.assertNumQueries(1):
+            group_performance = DashboardView()._get_group_performance(
+                self.start_date - timedelta(days=1), self.end_date
+            )
+        
+        # Groups without attendances in the range are left out
+        self.assertEqual(len(group_performance), 1)
+        # Invoices 1 and 2 cover the group's attendances, both paid
+        self.assertEqual(group_performance[0]['payment'], 100.0)
+    
     def test_engagement_distribution_structure(self):
         """Test engagement distribution structure"""
         self._create_attendances()
@@ -454,6 +504,141 @@ class DashboardViewTests(TestCase):
         self.assertEqual(student1_data['engagement'], 100.0)
         self.assertEqual(student1_data['streak'], 4)  # All 4 lessons attended with homework
     
+    def test_student_stats_single_query(self):
+        """Test that per-student stats are computed in one grouped query"""
+        self._create_attendances()
+        
+        from api.views import DashboardView
+        
+        with self.assertNumQueries(1):
+            stats = DashboardView()._get_student_stats(
+                self.start_date - timedelta(days=1), self.end_date
+            )
+        
+        stats_by_id = {s['id']: s for s in stats}
+        self.assertEqual(len(stats_by_id), 3)
+        
+        # Student 2: 3/4 present, 2/4 homework, absent for the last lesson
+        student2 = stats_by_id[self.student2.id]
+        self.assertEqual(student2['total'], 4)
+        self.assertEqual(student2['present'], 3)
+        self.assertEqual(student2['homework'], 2)
+        self.assertEqual(student2['last_absence'], self.lessons[3].date)
+        
+        # Student 1 never missed a lesson and paid invoice 1
+        student1 = stats_by_id[self.student1.id]
+        self.assertIsNone(student1['last_absence'])
+        self.assertEqual(student1['total_invoices'], 1)
+        self.assertEqual(student1['paid_invoices'], 1)
+    
+    def test_streaks_single_query(self):
+        """Test that streaks for all students come from one windowed query"""
+        self._create_attendances()
+        
+        # Student 2 attends the final lesson with homework after an absence
+        Attendance.objects.filter(
+            tutoringStudent=self.student2, lesson=self.lessons[3]
+        ).update(present=True, homework=True)
+        
+        from api.views import DashboardView
+        
+        student_ids = [self.student1.id, self.student2.id, self.student3.id]
+        with self.assertNumQueries(1):
+            streaks = DashboardView()._get_streaks(
+                student_ids, self.start_date - timedelta(days=1), self.end_date
+            )
+        
+        self.assertEqual(streaks[self.student1.id], 4)
+        self.assertEqual(streaks[self.student2.id], 1)
+        self.assertEqual(streaks.get(self.student3.id, 0), 0)
+    
+    def test_repeat_request_served_from_cache(self):
+        """Test that an unchanged dashboard is served from the cache"""
+        self._create_attendances()
+        
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first['ETag'], second['ETag'])
+    
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'django_cache'}})
+    def test_invalidation_reaches_other_processes(self):
+        """Test that a change made on a worker process invalidates the web process's cached dashboard"""
+        call_command('createcachetable', verbosity=0)
+        self._create_attendances()
+        
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['metricsData']['avgAttendance']['value'], 75.0)
+        
+        # the worker's cache shares nothing with the web process but the database
+        with patch('tutoring.dashboard_cache.cache', caches.create_connection('default')):
+            attendance = Attendance.objects.get(tutoringStudent=self.student3, lesson=self.lessons[3])
+            attendance.present = True
+            attendance.save()
+        
+        updated = self.client.get(self.url)
+        self.assertEqual(updated.data['metricsData']['avgAttendance']['value'], 83.3)
+    
+    def test_if_none_match_returns_not_modified(self):
+        """Test that revalidating with a current ETag returns 304"""
+        self._create_attendances()
+        
+        response = self.client.get(self.url)
+        self.assertIn('Last-Modified', response)
+        
+        revalidated = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(revalidated.status_code, status.HTTP_304_NOT_MODIFIED)
+    
+    def test_attendance_change_invalidates_cache(self):
+        """Test that saving an attendance invalidates the cached dashboard"""
+        self._create_attendances()
+        
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['metricsData']['avgAttendance']['value'], 75.0)
+        
+        attendance = Attendance.objects.get(tutoringStudent=self.student3, lesson=self.lessons[3])
+        attendance.present = True
+        attendance.save()
+        
+        updated = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(updated.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(updated['ETag'], response['ETag'])
+        # 10 of 12 attendances now present
+        self.assertEqual(updated.data['metricsData']['avgAttendance']['value'], 83.3)
+    
+    def test_sections_parameter(self):
+        """Test that ?sections= limits the response to those sections"""
+        self._create_attendances()
+        
+        response = self.client.get(self.url, {'sections': 'metrics,top-performers'})
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            set(response.data),
+            {'dateRange', 'metricsData', 'topPerformers'}
+        )
+    
+    def test_unknown_sections_parameter(self):
+        """Test that unknown sections are rejected"""
+        response = self.client.get(self.url, {'sections': 'metrics,bogus'})
+        
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('bogus', response.data['error'])
+    
+    def test_section_endpoint(self):
+        """Test the per-section sub-endpoint"""
+        self._create_attendances()
+        
+        response = self.client.get(reverse('dashboardSection', kwargs={'section': 'revenue'}))
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data), {'dateRange', 'revenueData'})
+        
+        missing = self.client.get(reverse('dashboardSection', kwargs={'section': 'bogus'}))
+        self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+    
     def test_empty_data_handling(self):
         """Test dashboard with no attendance data"""
         # Don't create any attendances
@@ -503,6 +688,24 @@ class DashboardViewTests(TestCase):
         # Should have fewer weeks than the full 4-week range
         self.assertLessEqual(len(attendance_data), 2)
 
+    def test_end_date_includes_whole_day(self):
+        """Lessons during end_date count in every section, as they do in the rollups"""
+        lesson = Lesson.objects.create(group=self.group, date=datetime(2024, 3, 4, 16, tzinfo=timezone.utc))
+        Attendance.objects.create(lesson=lesson, tutoringStudent=self.student1, present=True, homework=True)
+
+        response = self.client.get(
+            self.url,
+            {'start_date': '2024-03-04', 'end_date': '2024-03-04'}
+        )
+
+        self.assertEqual(response.data['attendanceData'], [{'week': 'Week 1', 'rate': 100.0}])
+        self.assertEqual(len(response.data['groupPerformance']), 1)
+        self.assertEqual(sum(bucket['value'] for bucket in response.data['engagementDistribution']), 1)
+        self.assertEqual(
+            [(performer['name'], performer['streak']) for performer in response.data['topPerformers']],
+            [('Alice Smith', 1)]
+        )
+
 
 class DashboardIntegrationTests(TestCase):
     """Integration tests with more complex scenarios"""
@@ -523,6 +726,7 @@ class DashboardIntegrationTests(TestCase):
     
     def setUp(self):
         """Set up more complex test scenario"""
+        cache.clear()
         self.client = APIClient()
         self.url = reverse('dashboard')
         
@@ -587,4 +791,88 @@ class DashboardIntegrationTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         
         metrics = response.data['metricsData']
-        self.assertEqual(metrics['totalStudents']['value'], 15)
\ No newline at end of file
+        self.assertEqual(metrics['totalStudents']['value'], 15)
+
+class DashboardRollupTests(TestCase):
+    """Tests for the daily rollups backing the dashboard"""
+    
+    def setUp(self):
+        self.parent = Parent.objects.create(name="Rollup Parent", stripeId="cus_rollup")
+        self.group = Group.objects.create(
+            lesson_length=1,
+            tutor="Jane Doe",
+            course=Group.CourseChoices.YEAR11_ADV,
+            day_of_week=Group.Weekday.TUESDAY,
+            time_of_day="16:00:00"
+        )
+        self.student = TutoringStudent.objects.create(
+            name="Dana Lee", parent=self.parent, active=True
+        )
+        self.student.group.add(self.group)
+        self.lesson_date = datetime(2025, 3, 4, 5, 0, tzinfo=timezone.utc)
+        # Attendance is auto-created by the Lesson post_save signal
+        self.lesson = Lesson.objects.create(group=self.group, date=self.lesson_date)
+    
+    def test_attendance_changes_refresh_rollup(self):
+        rollup = DailyAttendanceRollup.objects.get(group=self.group)
+        self.assertEqual(rollup.day, self.lesson_date.date())
+        self.assertEqual((rollup.total, rollup.present, rollup.homework), (1, 0, 0))
+        
+        attendance = Attendance.objects.get(lesson=self.lesson)
+        attendance.present = True
+        attendance.homework = True
+        attendance.save()
+        
+        rollup.refresh_from_db()
+        self.assertEqual((rollup.total, rollup.present, rollup.homework), (1, 1, 1))
+        
+        attendance.delete()
+        self.assertFalse(DailyAttendanceRollup.objects.exists())
+    
+    def test_rescheduled_lesson_moves_rollup(self):
+        lesson = Lesson.objects.get(pk=self.lesson.pk)
+        lesson.date = self.lesson_date + timedelta(days=7)
+        lesson.save()
+        
+        days = list(DailyAttendanceRollup.objects.values_list('day', flat=True))
+        self.assertEqual(days, [(self.lesson_date + timedelta(days=7)).date()])
+    
+    def test_invoice_changes_refresh_revenue_rollup(self):
+        created = datetime(2025, 3, 1, 12, 0, tzinfo=timezone.utc)
+        invoice = LocalInvoice.objects.create(
+            stripeInvoiceId="inv_rollup",
+            status='open',
+            amount_due=5000,
+            created=created,
+        )
+        rollup = DailyRevenueRollup.objects.get(day=created.date())
+        self.assertEqual((rollup.revenue, rollup.invoices, rollup.paid_invoices), (0, 1, 0))
+        
+        paid_at = created + timedelta(days=2)
+        invoice.status = 'paid'
+        invoice.amount_paid = 5000
+        invoice.status_transitions_paid_at = paid_at
+        invoice.save()
+        
+        rollup.refresh_from_db()
+        self.assertEqual((rollup.revenue, rollup.invoices, rollup.paid_invoices), (0, 1, 1))
+        self.assertEqual(DailyRevenueRollup.objects.get(day=paid_at.date()).revenue, 5000)
+    
+    def test_rebuild_matches_incremental_rollups(self):
+        LocalInvoice.objects.create(
+            stripeInvoiceId="inv_rebuild",
+            status='paid',
+            amount_due=2500,
+            amount_paid=2500,
+            created=self.lesson_date,
+            status_transitions_paid_at=self.lesson_date,
+        )
+        fields = ('day', 'group_id', 'total', 'present', 'homework')
+        revenue_fields = ('day', 'revenue', 'invoices', 'paid_invoices')
+        incremental = list(DailyAttendanceRollup.objects.values_list(*fields))
+        incremental_revenue = list(DailyRevenueRollup.objects.values_list(*revenue_fields))
+        
+        rebuild_rollups()
+        
+        self.assertEqual(list(DailyAttendanceRollup.objects.values_list(*fields)), incremental)
+        self.assertEqual(list(DailyRevenueRollup.objects.values_list(*revenue_fields)), incremental_revenue)
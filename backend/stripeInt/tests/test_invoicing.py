@@ -0,0 +1,463 @@
+from datetime import datetime, time as dt_time, timedelta, timezone
+import csv
+import json
+import os
+import tempfile
+import time
+from io import StringIO
+from types import SimpleNamespace
+from unittest import skipIf
+from unittest.mock import patch
+
+import stripe
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from stripeInt.models import InvoiceRun, InvoiceRunItem, StripeProd
+from stripeInt import services
+from stripeInt.services import FAILED, generateInvoices, getPrice, planBilling
+from tutoring.models import Attendance, Group, Lesson, LocalInvoice, Parent, TutoringStudent
+
+
+class FakeStripe:
+    """
+    Stands in for the StripeClient services called by generateInvoices,
+    including replaying the response of a request repeated with the same
+    idempotency key.
+    """
+    def __init__(self):
+        self.invoices = {}
+        self.items = []
+        self.responses = {}
+
+    def idempotent(func):
+        def wrapper(self, *args, params=None, options=None):
+            idempotency_key = (options or {}).get('idempotency_key')
+            if idempotency_key is None:
+                return func(self, *args, **(params or {}))
+            if idempotency_key not in self.responses:
+                self.responses[idempotency_key] = func(self, *args, **(params or {}))
+            return self.responses[idempotency_key]
+        return wrapper
+
+    def invoice_object(self, invoice_id):
+        invoice = self.invoices[invoice_id]
+        return stripe.Invoice.construct_from({
+            'id': invoice_id,
+            'customer': invoice['customer'],
+            'status': invoice['status'],
+            'total': invoice['total'],
+            'amount_due': invoice['total'],
+            'amount_paid': 0,
+            'currency': 'aud',
+            'created': int(datetime.now(timezone.utc).timestamp()),
+            'status_transitions': {'paid_at': None},
+        }, 'sk_test_fake')
+
+    @idempotent
+    def create_invoice(self, customer, **kwargs):
+        invoice_id = f"in_{customer}_{len(self.invoices)}"
+        self.invoices[invoice_id] = {'customer': customer, 'status': 'draft', 'total': 0}
+        return self.invoice_object(invoice_id)
+
+    def retrieve_invoice(self, invoice_id):
+        return self.invoice_object(invoice_id)
+
+    def retrieve_price(self, price_id):
+        return SimpleNamespace(unit_amount=6000, currency='aud')
+
+    @idempotent
+    def create_item(self, *, invoice, unit_amount_decimal, quantity, **kwargs):
+        self.items.append(dict(kwargs, invoice=invoice, quantity=quantity))
+        self.invoices[invoice]['total'] += unit_amount_decimal * quantity
+        return SimpleNamespace(id=f"ii_{len(self.items)}")
+
+    @idempotent
+    def finalize(self, invoice_id):
+        self.invoices[invoice_id]['status'] = 'open'
+        return self.invoice_object(invoice_id)
+
+    def patch(self, test):
+        for name, target, fake in [
+            ('invoice_create', 'stripe.InvoiceService.create', self.create_invoice),
+            ('invoice_retrieve', 'stripe.InvoiceService.retrieve', self.retrieve_invoice),
+            ('price_retrieve', 'stripe.PriceService.retrieve', self.retrieve_price),
+            ('item_create', 'stripe.InvoiceItemService.create', self.create_item),
+            ('invoice_finalize', 'stripe.InvoiceService.finalize_invoice', self.finalize),
+        ]:
+            patcher = patch(target, side_effect=fake)
+            test.addCleanup(patcher.stop)
+            setattr(self, name, patcher.start())
+
+
+class InvoicingFixtureMixin:
+    def setUp(self):
+        env = patch.dict(os.environ, {'STRIPE_SECRET_KEY': 'sk_test_fake'})
+        env.start()
+        self.addCleanup(env.stop)
+
+        self.stripe = FakeStripe()
+        self.stripe.patch(self)
+        
+        price_cache = patch.dict(services._price_cache, clear=True)
+        price_cache.start()
+        self.addCleanup(price_cache.stop)
+
+        self.product = StripeProd.objects.create(
+            stripeId="prod_test", defaultPriceId="price_test", name="Group Lesson"
+        )
+        self.group = Group.objects.create(
+            tutor="Tutor",
+            course=Group.CourseChoices.YEAR11_ADV,
+            day_of_week=Group.Weekday.MONDAY,
+            time_of_day=dt_time(14, 0),
+            lesson_length=2,
+            associated_product=self.product
+        )
+
+    def create_parent(self, name, students=1):
+        parent = Parent.objects.create(name=name, stripeId=f"cus_{name}", payment_frequency='fortnightly')
+        for i in range(students):
+            student = TutoringStudent.objects.create(name=f"{name} child {i}", parent=parent, active=True)
+            student.group.add(self.group)
+        return parent
+
+    def schedule_lessons(self, count):
+        # attendances for every student in the group are created by the post_save signal
+        now = datetime.now(timezone.utc)
+        for i in range(count):
+            Lesson.objects.create(group=self.group, date=now + timedelta(days=1 + i))
+
+
+class GenerateInvoicesTests(InvoicingFixtureMixin, TestCase):
+    def test_invoices_each_parent_and_reports_summary(self):
+        alice = self.create_parent("alice", students=2)
+        bob = self.create_parent("bob")
+        Parent.objects.create(name="carol", stripeId="cus_carol", payment_frequency='fortnightly')
+        self.schedule_lessons(2)
+
+        summary = generateInvoices(frequency='fortnightly', amount_of_weeks=2)
+
+        self.assertEqual(summary['parents'], 3)
+        self.assertEqual(summary['invoiced'], 2)
+        self.assertEqual(summary['skipped'], 1)
+        self.assertEqual(summary['failed'], [])
+        # alice: 2 children x 2 lessons x 2 hours, bob: 2 lessons x 2 hours
+        self.assertEqual(summary['total'], 6000 * 8 + 6000 * 4)
+
+        for parent, count in [(alice, 4), (bob, 2)]:
+            local_invoice = LocalInvoice.objects.get(customer_stripe_id=parent.stripeId)
+            self.assertEqual(local_invoice.status, 'open')
+            self.assertEqual(local_invoice.customer_stripe_id, parent.stripeId)
+            self.assertEqual(local_invoice.attendances.count(), count)
+
+    def test_rerun_does_not_bill_again(self):
+        alice = self.create_parent("alice")
+        self.schedule_lessons(2)
+
+        call_command('generate_fortnightly_invoices', stdout=StringIO())
+        out = StringIO()
+        call_command('generate_fortnightly_invoices', stdout=out)
+
+        self.assertIn("0 invoiced", out.getvalue())
+        self.assertEqual(self.stripe.invoice_create.call_count, 1)
+        self.assertEqual(LocalInvoice.objects.filter(customer_stripe_id=alice.stripeId).count(), 1)
+
+    def test_local_invoice_already_created_by_webhook(self):
+        alice = self.create_parent("alice")
+        self.schedule_lessons(2)
+
+        def create_invoice(params, options):
+            customer = params['customer']
+            invoice = self.stripe.create_invoice(params=params, options=options)
+            # the invoice.created webhook got there first
+            LocalInvoice.objects.create(
+                stripeInvoiceId=invoice.id,
+                status='draft',
+                amount_due=0,
+                created=datetime.now(timezone.utc),
+                customer_stripe_id=customer
+            )
+            return invoice
+        self.stripe.invoice_create.side_effect = create_invoice
+
+        generateInvoices(frequency='fortnightly', amount_of_weeks=2)
+
+        local_invoice = LocalInvoice.objects.get(customer_stripe_id=alice.stripeId)
+        self.assertEqual(local_invoice.status, 'open')
+        self.assertEqual(local_invoice.amount_due, 6000 * 4)
+        self.assertEqual(local_invoice.attendances.count(), 2)
+
+    @patch('stripeInt.services.time.sleep')
+    def test_rate_limited_calls_are_retried(self, sleep):
+        self.create_parent("alice")
+        self.schedule_lessons(1)
+        self.stripe.invoice_create.side_effect = [
+            stripe.error.RateLimitError("Too many requests"),
+            stripe.error.RateLimitError("Too many requests"),
+            self.stripe.create_invoice("cus_alice"),
+        ]
+
+        summary = generateInvoices(frequency='fortnightly', amount_of_weeks=2)
+
+        self.assertEqual(summary['invoiced'], 1)
+        self.assertEqual(self.stripe.invoice_create.call_count, 3)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertGreater(sleep.call_args_list[1].args[0], sleep.call_args_list[0].args[0] / 2)
+
+    def test_failed_parent_is_reported_and_others_continue(self):
+        alice = self.create_parent("alice")
+        self.create_parent("bob")
+        self.schedule_lessons(1)
+
+        def create_invoice(params, options):
+            if params['customer'] == alice.stripeId:
+                raise stripe.error.InvalidRequestError("No such customer", "customer")
+            return self.stripe.create_invoice(params=params, options=options)
+        self.stripe.invoice_create.side_effect = create_invoice
+
+        summary = generateInvoices(frequency='fortnightly', amount_of_weeks=2)
+
+        self.assertEqual(summary['invoiced'], 1)
+        self.assertEqual(len(summary['failed']), 1)
+        self.assertEqual(summary['failed'][0]['parent'], alice.id)
+        self.assertEqual(summary['failed'][0]['status'], FAILED)
+        self.assertFalse(Attendance.objects.filter(tutoringStudent__parent=alice, local_invoice__isnull=False).exists())
+
+
+class GetPriceTests(InvoicingFixtureMixin, TestCase):
+    def test_reads_local_price(self):
+        self.product.unit_amount = 4500
+        self.product.currency = 'aud'
+
+        self.assertEqual(getPrice(self.product), (4500, 'aud'))
+        self.stripe.price_retrieve.assert_not_called()
+
+    def test_falls_back_to_stripe_and_stores_price(self):
+        self.assertEqual(getPrice(self.product), (6000, 'aud'))
+        self.assertEqual(getPrice(self.product), (6000, 'aud'))
+        self.stripe.price_retrieve.assert_called_once_with("price_test")
+
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.unit_amount, self.product.currency), (6000, 'aud'))
+
+    def test_cached_lookups_expire(self):
+        getPrice(self.product)
+        with patch('stripeInt.services.time.monotonic', return_value=time.monotonic() + services.PRICE_CACHE_TTL + 1):
+            getPrice(self.product)
+        self.assertEqual(self.stripe.price_retrieve.call_count, 2)
+
+    def test_invoice_run_uses_local_prices(self):
+        StripeProd.objects.filter(id=self.product.id).update(unit_amount=4500, currency='aud')
+        self.create_parent("alice")
+        self.schedule_lessons(1)
+
+        summary = generateInvoices(frequency='fortnightly', amount_of_weeks=2)
+
+        self.assertEqual(summary['total'], 4500 * 2)
+        self.stripe.price_retrieve.assert_not_called()
+
+
+class PlanBillingTests(InvoicingFixtureMixin, TestCase):
+    def test_plans_every_parent_in_one_query(self):
+        parents = [self.create_parent(f"parent{i}", students=2) for i in range(3)]
+        other_product = StripeProd.objects.create(stripeId="prod_other", defaultPriceId="price_other", name="Private")
+        private = Group.objects.create(tutor="Tutor", lesson_length=1, associated_product=other_product)
+        parents[0].children.first().group.add(private)
+        self.schedule_lessons(2)
+        Lesson.objects.create(group=private, date=datetime.now(timezone.utc) + timedelta(days=3))
+        # paid attendances and inactive children aren't billed
+        Attendance.objects.filter(tutoringStudent=parents[1].children.first()).update(paid=True)
+        parents[2].children.filter(name__endswith="1").update(active=False)
+
+        now = datetime.now(timezone.utc)
+        with self.assertNumQueries(1):
+            billing = planBilling(parents, period_start=now, period_end=now + timedelta(weeks=2))
+
+        quantities = {
+            parent.id: {item['product'].stripeId: item['quantity'] for item in billing[parent.id]['items']}
+            for parent in parents
+        }
+        self.assertEqual(quantities, {
+            parents[0].id: {"prod_test": 8, "prod_other": 1},
+            parents[1].id: {"prod_test": 4},
+            parents[2].id: {"prod_test": 4},
+        })
+        self.assertEqual([len(billing[parent.id]['attendances']) for parent in parents], [5, 2, 2])
+        self.assertEqual(billing[parents[2].id]['items'][0]['student_names'], {"parent2 child 0"})
+
+class InvoicePlanCommandTests(InvoicingFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        StripeProd.objects.filter(id=self.product.id).update(unit_amount=6000, currency='aud')
+        self.alice = self.create_parent("alice", students=2)
+        self.bob = self.create_parent("bob")
+        self.schedule_lessons(2)
+
+        self.plan_path = os.path.join(tempfile.mkdtemp(), 'plan.json')
+        self.addCleanup(lambda: os.path.exists(self.plan_path) and os.remove(self.plan_path))
+
+    def test_plan_is_computed_without_stripe(self):
+        call_command('generate_fortnightly_invoices', '--plan', '--output', self.plan_path, stdout=StringIO())
+
+        with open(self.plan_path) as plan_file:
+            plan = json.load(plan_file)
+
+        self.assertEqual(plan['frequency'], 'fortnightly')
+        entries = {entry['parent']: entry for entry in plan['parents']}
+        self.assertEqual(len(entries[self.alice.id]['attendances']), 4)
+        self.assertEqual(entries[self.alice.id]['items'], [{
+            'product': "prod_test",
+            'description': "Group Lesson - alice child 0, alice child 1",
+            'quantity': 8,
+            'unit_amount': 6000,
+            'currency': 'aud',
+            'amount': 6000 * 8,
+        }])
+        self.assertEqual(entries[self.bob.id]['total'], 6000 * 4)
+        self.assertEqual(plan['total'], 6000 * 12)
+
+        self.stripe.invoice_create.assert_not_called()
+        self.stripe.price_retrieve.assert_not_called()
+        self.assertFalse(LocalInvoice.objects.exists())
+
+    def test_plan_as_csv(self):
+        out = StringIO()
+        call_command('generate_fortnightly_invoices', '--plan', '--format', 'csv', stdout=out)
+
+        rows = list(csv.DictReader(StringIO(out.getvalue())))
+        self.assertEqual([(row['name'], row['quantity'], row['amount']) for row in rows], [
+            ("alice", "8", str(6000 * 8)),
+            ("bob", "4", str(6000 * 4)),
+        ])
+
+    def test_apply_plan(self):
+        call_command('generate_fortnightly_invoices', '--plan', '--output', self.plan_path, stdout=StringIO())
+        out = StringIO()
+        call_command('generate_fortnightly_invoices', '--apply', self.plan_path, stdout=out)
+
+        self.assertIn("2 invoiced", out.getvalue())
+        self.assertEqual(self.stripe.invoice_create.call_count, 2)
+        self.assertEqual(LocalInvoice.objects.get(customer_stripe_id=self.alice.stripeId).attendances.count(), 4)
+        self.assertEqual(LocalInvoice.objects.get(customer_stripe_id=self.bob.stripeId).amount_due, 6000 * 4)
+
+    def test_apply_stale_plan_fails_parent(self):
+        call_command('generate_fortnightly_invoices', '--plan', '--output', self.plan_path, stdout=StringIO())
+        Attendance.objects.filter(tutoringStudent__parent=self.bob).update(paid=True)
+
+        err = StringIO()
+        call_command('generate_fortnightly_invoices', '--apply', self.plan_path, stdout=StringIO(), stderr=err)
+
+        self.assertIn("Plan is out of date", err.getvalue())
+        self.assertEqual(self.stripe.invoice_create.call_count, 1)
+        self.assertFalse(LocalInvoice.objects.filter(customer_stripe_id=self.bob.stripeId).exists())
+
+    def test_apply_plan_twice_fails_invoiced_parents(self):
+        call_command('generate_fortnightly_invoices', '--plan', '--output', self.plan_path, stdout=StringIO())
+        call_command('generate_fortnightly_invoices', '--apply', self.plan_path, stdout=StringIO())
+
+        out, err = StringIO(), StringIO()
+        call_command('generate_fortnightly_invoices', '--apply', self.plan_path, stdout=out, stderr=err)
+
+        self.assertIn("0 invoiced", out.getvalue())
+        self.assertIn("Plan is out of date", err.getvalue())
+        self.assertEqual(self.stripe.invoice_create.call_count, 2)
+        self.assertEqual(LocalInvoice.objects.filter(customer_stripe_id=self.alice.stripeId).count(), 1)
+
+    def test_apply_plan_for_other_frequency(self):
+        call_command('generate_fortnightly_invoices', '--plan', '--output', self.plan_path, stdout=StringIO())
+
+        with self.assertRaises(CommandError):
+            call_command('generate_weekly_invoices', '--apply', self.plan_path, stdout=StringIO())
+
+
+class InvoiceRunLedgerTests(InvoicingFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = self.create_parent("alice")
+        self.bob = self.create_parent("bob")
+        Parent.objects.create(name="carol", stripeId="cus_carol", payment_frequency='fortnightly')
+        self.schedule_lessons(2)
+
+    def test_run_is_recorded(self):
+        summary = generateInvoices(frequency='fortnightly', amount_of_weeks=2)
+
+        run = InvoiceRun.objects.get(id=summary['run'])
+        self.assertEqual(run.status, InvoiceRun.Status.COMPLETED)
+        self.assertIsNotNone(run.finished)
+        self.assertEqual(
+            {item.parent.name: item.status for item in run.items.select_related('parent')},
+            {"alice": "invoiced", "bob": "invoiced", "carol": "skipped"}
+        )
+        alice_item = run.items.get(parent=self.alice)
+        self.assertEqual(alice_item.total, 6000 * 4)
+        self.assertEqual(alice_item.stripeInvoiceId, LocalInvoice.objects.get(customer_stripe_id=self.alice.stripeId).stripeInvoiceId)
+
+        self.assertEqual(
+            self.stripe.invoice_create.call_args.kwargs['options']['idempotency_key'],
+            f"invoice-run-{run.id}-parent-{self.bob.id}-invoice"
+        )
+
+    def test_resume_interrupted_run(self):
+        # bob's second line item fails after his invoice and first item were created
+        def create_item(params, options):
+            if params['customer'] == self.bob.stripeId and options['idempotency_key'].endswith('item-1'):
+                raise stripe.error.APIConnectionError("Connection reset")
+            return self.stripe.create_item(params=params, options=options)
+        self.stripe.item_create.side_effect = create_item
+        other = StripeProd.objects.create(stripeId="prod_other", defaultPriceId="price_other", name="Private")
+        private = Group.objects.create(tutor="Tutor", lesson_length=1, associated_product=other)
+        self.bob.children.first().group.add(private)
+        Lesson.objects.create(group=private, date=datetime.now(timezone.utc) + timedelta(days=3))
+
+        summary = generateInvoices(frequency='fortnightly', amount_of_weeks=2)
+
+        run = InvoiceRun.objects.get(id=summary['run'])
+        self.assertEqual(run.status, InvoiceRun.Status.INCOMPLETE)
+        bob_item = run.items.get(parent=self.bob)
+        self.assertEqual(bob_item.status, InvoiceRunItem.Status.FAILED)
+        self.assertIsNotNone(bob_item.stripeInvoiceId)
+        self.assertFalse(LocalInvoice.objects.filter(customer_stripe_id=self.bob.stripeId).exists())
+
+        self.stripe.item_create.side_effect = self.stripe.create_item
+        out = StringIO()
+        call_command('generate_fortnightly_invoices', '--resume', stdout=out)
+
+        self.assertIn(f"run {run.id}: 2 invoiced, 1 skipped, 0 failed", out.getvalue())
+        run.refresh_from_db()
+        self.assertEqual(run.status, InvoiceRun.Status.COMPLETED)
+        # neither parent was invoiced twice and bob's first item wasn't duplicated
+        self.assertEqual(self.stripe.invoice_create.call_count, 2)
+        self.assertEqual(len([item for item in self.stripe.items if item['customer'] == self.bob.stripeId]), 2)
+        local_invoice = LocalInvoice.objects.get(customer_stripe_id=self.bob.stripeId)
+        self.assertEqual(local_invoice.stripeInvoiceId, bob_item.stripeInvoiceId)
+        self.assertEqual(local_invoice.amount_due, 6000 * 4 + 6000 * 1)
+        self.assertEqual(local_invoice.attendances.count(), 3)
+
+    def test_resume_without_unfinished_run(self):
+        generateInvoices(frequency='fortnightly', amount_of_weeks=2)
+
+        with self.assertRaises(CommandError):
+            call_command('generate_fortnightly_invoices', '--resume', stdout=StringIO())
+
+@skipIf(connection.vendor == 'sqlite', "SQLite's shared in-memory test database locks on concurrent writes")
+@override_settings(INVOICE_WORKERS=3)
+class ConcurrentGenerateInvoicesTests(InvoicingFixtureMixin, TransactionTestCase):
+    def test_parents_invoiced_concurrently(self):
+        parents = [self.create_parent(f"parent{i}") for i in range(6)]
+        self.schedule_lessons(2)
+
+        summary = generateInvoices(frequency='fortnightly', amount_of_weeks=2)
+
+        self.assertEqual(summary['invoiced'], len(parents))
+        self.assertEqual(summary['failed'], [])
+        self.assertEqual(
+            Attendance.objects.filter(local_invoice__isnull=False).count(),
+            len(parents) * 2
+        )
+        self.assertTrue(all(
+            LocalInvoice.objects.get(customer_stripe_id=parent.stripeId).attendances.count() == 2
+            for parent in parents
+        ))
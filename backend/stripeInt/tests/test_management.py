@@ -1,9 +1,12 @@
 from datetime import datetime, time
 import zoneinfo
 from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
-from tutoring.models import Group, Lesson
+from stripeInt.management.commands.set_term import scheduleTermLessons
+from tutoring.models import Attendance, DailyAttendanceRollup, Group, Lesson, Parent, TutoringStudent
 
 
 class SetTermCommandTest(TestCase):
@@ -63,4 +66,63 @@ class SetTermCommandTest(TestCase):
       for lesson in Lesson.objects.filter(group=self.monday_group):
           # Convert UTC time to local time
           local_time = lesson.date.astimezone(local_tz).time()
-          self.assertEqual(local_time, time(14, 0))
\ No newline at end of file
+          self.assertEqual(local_time, time(14, 0))
+
+    def test_rerun_skips_existing_lessons(self):
+        """Test that running the command twice doesn't duplicate lessons"""
+        call_command('set_term', '2024-03-04')
+        Lesson.objects.filter(group=self.monday_group).order_by('date').last().delete()
+        
+        call_command('set_term', '2024-03-04')
+        
+        self.assertEqual(Lesson.objects.filter(group=self.monday_group).count(), 10)
+        self.assertEqual(Lesson.objects.filter(group=self.wednesday_group).count(), 10)
+    
+    def test_creates_attendances_in_bulk(self):
+        """Test that every lesson gets its attendances with one insert per table"""
+        parent = Parent.objects.create(name="Mr Smith", stripeId="cus_test123")
+        for name in ("Alice", "Bob"):
+            student = TutoringStudent.objects.create(name=name, parent=parent)
+            student.group.add(self.monday_group)
+        
+        with CaptureQueriesContext(connection) as queries:
+            call_command('set_term', '2024-03-04')
+        
+        self.assertEqual(Attendance.objects.filter(lesson__group=self.monday_group).count(), 20)
+        self.assertEqual(Attendance.objects.filter(lesson__group=self.wednesday_group).count(), 0)
+        inserts = [q['sql'].split('"')[1] for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "tutoring_')]
+        self.assertEqual(inserts.count('tutoring_lesson'), 1)
+        self.assertEqual(inserts.count('tutoring_attendance'), 1)
+    
+    def test_query_count_independent_of_term_size(self):
+        """Test that scheduling a term takes a fixed number of queries, whatever the number of lessons"""
+        parent = Parent.objects.create(name="Mr Smith", stripeId="cus_test123")
+        for i in range(18):
+            group = Group.objects.create(
+                tutor=f"Tutor {i}",
+                day_of_week=i % 7,
+                lesson_length=1,
+                time_of_day=time(16, 0)
+            )
+            for j in range(5):
+                TutoringStudent.objects.create(name=f"Student {i}-{j}", parent=parent).group.add(group)
+        
+        with CaptureQueriesContext(connection) as queries:
+            lessons = scheduleTermLessons(datetime(2024, 3, 4).date())
+        
+        # SQLite splits the attendance insert by its parameter limit, other backends don't
+        sql = [q['sql'] for q in queries.captured_queries if not q['sql'].startswith('INSERT INTO "tutoring_attendance"')]
+        # savepoints, groups, existing lessons, lessons, students, rollup aggregate,
+        # upsert and delete (setUp's groups have no students), releases
+        self.assertEqual(len(sql), 11)
+        self.assertEqual(len(lessons), 200)
+        self.assertEqual(Attendance.objects.count(), 18 * 10 * 5)
+        self.assertEqual(DailyAttendanceRollup.objects.count(), 18 * 10)
+    
+    def test_skips_groups_without_schedule(self):
+        """Test that groups without a day or time get no lessons"""
+        unscheduled = Group.objects.create(tutor="Kim", lesson_length=1)
+        
+        call_command('set_term', '2024-03-04')
+        
+        self.assertFalse(Lesson.objects.filter(group=unscheduled).exists())
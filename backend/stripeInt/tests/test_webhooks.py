@@ -1,11 +1,18 @@
-from datetime import datetime, timezone
+from datetime import date, datetime, timedelta, timezone
+import os
 from unittest.mock import patch
+from django.contrib.auth.models import User
+from django.db import connection
 from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
 import stripe
 
-from tutoring.models import LocalInvoice, Parent
+from tutoring.models import DailyRevenueRollup, LocalInvoice, Parent
 
-from stripeInt.models import StripeProd
+from stripeInt.models import StripeProd, WebhookEvent
+from stripeInt.services import SYNCED_FIELDS, localInvoiceFields, syncLocalInvoice, syncLocalInvoices
+from stripeInt.tasks import WEBHOOK_MAX_ATTEMPTS, processWebhookEvents, retryWebhookEvents
+from stripeInt.views import UpdateInvoiceHandler, getWebhookHandler
 
 class WebHooksTest(TestCase):
   def setUp(self):
@@ -117,6 +124,90 @@ class WebHooksTest(TestCase):
     product = StripeProd.objects.get(stripeId=randomId)
     self.assertFalse(product.is_active)
   
+  @patch("stripe.Webhook.construct_event")
+  def testPriceCreated_StoresAmount(self, mock_construct_event):
+    StripeProd.objects.create(stripeId="prod_price_test", name="testProduct")
+    mock_construct_event.return_value = {
+      'type': 'price.created',
+      'data': {
+        'object': {
+          'id': 'price_new',
+          'product': 'prod_price_test',
+          'unit_amount': 6000,
+          'currency': 'aud'
+        }
+      }
+    }
+
+    self.client.post(self.url, data=b"{}", content_type="application/json", HTTP_STRIPE_SIGNATURE="fake_signature")
+
+    product = StripeProd.objects.get(stripeId="prod_price_test")
+    self.assertEqual(product.defaultPriceId, 'price_new')
+    self.assertEqual(product.unit_amount, 6000)
+    self.assertEqual(product.currency, 'aud')
+
+  @patch("stripe.Webhook.construct_event")
+  def testPriceUpdated_UpdatesAmount(self, mock_construct_event):
+    StripeProd.objects.create(stripeId="prod_price_test", name="testProduct", defaultPriceId='price_1', unit_amount=6000, currency='aud')
+    mock_construct_event.return_value = {
+      'type': 'price.updated',
+      'data': {
+        'object': {
+          'id': 'price_1',
+          'product': 'prod_price_test',
+          'unit_amount': 6500,
+          'currency': 'aud'
+        }
+      }
+    }
+
+    self.client.post(self.url, data=b"{}", content_type="application/json", HTTP_STRIPE_SIGNATURE="fake_signature")
+
+    product = StripeProd.objects.get(stripeId="prod_price_test")
+    self.assertEqual(product.unit_amount, 6500)
+
+  @patch("stripe.Webhook.construct_event")
+  def testPriceDeleted_ClearsAmount(self, mock_construct_event):
+    StripeProd.objects.create(stripeId="prod_price_test", name="testProduct", defaultPriceId='price_1', unit_amount=6000, currency='aud')
+    mock_construct_event.return_value = {
+      'type': 'price.deleted',
+      'data': {
+        'object': {
+          'id': 'price_1',
+          'product': 'prod_price_test',
+          'unit_amount': 6000,
+          'currency': 'aud'
+        }
+      }
+    }
+
+    self.client.post(self.url, data=b"{}", content_type="application/json", HTTP_STRIPE_SIGNATURE="fake_signature")
+
+    product = StripeProd.objects.get(stripeId="prod_price_test")
+    self.assertIsNone(product.defaultPriceId)
+    self.assertIsNone(product.unit_amount)
+    self.assertIsNone(product.currency)
+
+  @patch("stripe.Webhook.construct_event")
+  def testProductUpdated_NewDefaultPriceClearsAmount(self, mock_construct_event):
+    StripeProd.objects.create(stripeId="prod_price_test", name="testProduct", defaultPriceId='price_1', unit_amount=6000, currency='aud')
+    mock_construct_event.return_value = {
+      'type': 'product.updated',
+      'data': {
+        'object': {
+          'id': 'prod_price_test',
+          'default_price': 'price_2',
+          'name': 'testProduct'
+        }
+      }
+    }
+
+    self.client.post(self.url, data=b"{}", content_type="application/json", HTTP_STRIPE_SIGNATURE="fake_signature")
+
+    product = StripeProd.objects.get(stripeId="prod_price_test")
+    self.assertEqual(product.defaultPriceId, 'price_2')
+    self.assertIsNone(product.unit_amount)
+
   @patch("stripe.Webhook.construct_event")
   def testCustomerCreated_HappyPath(self, mock_construct_event):
     randomId = "cus_SdmWpjsahaAHih"
@@ -509,3 +600,457 @@ class WebHooksTest(TestCase):
       invoice = LocalInvoice.objects.get(stripeInvoiceId=randomId)
       self.assertIsNotNone(invoice)
       self.assertEqual(invoice.amount_due, 3000)
+
+
+class WebhookQueueTest(TestCase):
+  def setUp(self):
+    self.client = Client()
+    self.url = "/stripe/webhooks/"
+
+  def post_event(self, mock_construct_event, event_id, event_type='customer.created', data=None):
+    mock_construct_event.return_value = {
+      'id': event_id,
+      'type': event_type,
+      'created': 1609459200,
+      'data': {
+        'object': data or {'id': 'cus_queue', 'name': 'Queued Customer'}
+      }
+    }
+    return self.client.post(
+      self.url,
+      data=b"{}",
+      content_type="application/json",
+      HTTP_STRIPE_SIGNATURE="fake_signature"
+    )
+
+  @patch("stripeInt.views.async_task")
+  @patch("stripe.Webhook.construct_event")
+  def testEventStoredAndAcknowledged(self, mock_construct_event, mock_async_task):
+    res = self.post_event(mock_construct_event, 'evt_1')
+
+    self.assertEqual(res.status_code, 200)
+    event = WebhookEvent.objects.get(stripeEventId='evt_1')
+    self.assertEqual(event.type, 'customer.created')
+    self.assertEqual(event.status, WebhookEvent.Status.PENDING)
+    self.assertEqual(event.created, datetime(2021, 1, 1, tzinfo=timezone.utc))
+    mock_async_task.assert_called_once_with('stripeInt.tasks.processWebhookEvents')
+    # the handler runs on a worker, not in the request
+    self.assertFalse(Parent.objects.filter(stripeId='cus_queue').exists())
+
+  @patch("stripe.Webhook.construct_event")
+  def testEventProcessed(self, mock_construct_event):
+    self.post_event(mock_construct_event, 'evt_1')
+
+    event = WebhookEvent.objects.get(stripeEventId='evt_1')
+    self.assertEqual(event.status, WebhookEvent.Status.PROCESSED)
+    self.assertEqual(event.attempts, 1)
+    self.assertIsNotNone(event.processed)
+    self.assertEqual(Parent.objects.get(stripeId='cus_queue').name, 'Queued Customer')
+
+  @patch("stripe.Webhook.construct_event")
+  def testDuplicateDeliveryProcessedOnce(self, mock_construct_event):
+    self.post_event(mock_construct_event, 'evt_1')
+    res = self.post_event(mock_construct_event, 'evt_1')
+
+    self.assertEqual(res.status_code, 200)
+    self.assertEqual(WebhookEvent.objects.count(), 1)
+    self.assertEqual(Parent.objects.filter(stripeId='cus_queue').count(), 1)
+
+  @patch("stripe.Webhook.construct_event")
+  def testFailedEventRetried(self, mock_construct_event):
+    # the customer doesn't exist yet
+    res = self.post_event(mock_construct_event, 'evt_1', 'customer.updated')
+
+    self.assertEqual(res.status_code, 200)
+    event = WebhookEvent.objects.get(stripeEventId='evt_1')
+    self.assertEqual(event.status, WebhookEvent.Status.FAILED)
+    self.assertIsNotNone(event.error)
+
+    Parent.objects.create(stripeId='cus_queue', name='Old Name')
+    self.assertEqual(retryWebhookEvents(), 1)
+
+    event.refresh_from_db()
+    self.assertEqual(event.status, WebhookEvent.Status.PROCESSED)
+    self.assertEqual(event.attempts, 2)
+    self.assertEqual(Parent.objects.get(stripeId='cus_queue').name, 'Queued Customer')
+
+  @patch("stripe.Webhook.construct_event")
+  def testFailedEventRetriedAutomaticallyWhenDue(self, mock_construct_event):
+    self.post_event(mock_construct_event, 'evt_1', 'customer.updated')
+    event = WebhookEvent.objects.get(stripeEventId='evt_1')
+    self.assertEqual(event.status, WebhookEvent.Status.FAILED)
+    self.assertGreater(event.next_attempt, datetime.now(timezone.utc))
+
+    Parent.objects.create(stripeId='cus_queue', name='Old Name')
+    # not due yet
+    self.assertEqual(processWebhookEvents(), 0)
+
+    WebhookEvent.objects.filter(id=event.id).update(next_attempt=datetime.now(timezone.utc))
+    self.assertEqual(processWebhookEvents(), 1)
+
+    event.refresh_from_db()
+    self.assertEqual(event.status, WebhookEvent.Status.PROCESSED)
+    self.assertIsNone(event.next_attempt)
+    self.assertEqual(Parent.objects.get(stripeId='cus_queue').name, 'Queued Customer')
+
+  @patch("stripe.Webhook.construct_event")
+  def testRetriesBackOffAndGiveUp(self, mock_construct_event):
+    self.post_event(mock_construct_event, 'evt_1', 'customer.updated')
+    event = WebhookEvent.objects.get(stripeEventId='evt_1')
+
+    delays = []
+    while event.next_attempt is not None:
+      delays.append(event.next_attempt - datetime.now(timezone.utc))
+      WebhookEvent.objects.filter(id=event.id).update(next_attempt=datetime.now(timezone.utc))
+      self.assertEqual(processWebhookEvents(), 0)
+      event.refresh_from_db()
+
+    self.assertEqual(event.status, WebhookEvent.Status.FAILED)
+    self.assertEqual(event.attempts, WEBHOOK_MAX_ATTEMPTS)
+    self.assertEqual(len(delays), WEBHOOK_MAX_ATTEMPTS - 1)
+    self.assertTrue(all(later > earlier for earlier, later in zip(delays, delays[1:])))
+    # only the retry command picks it up now
+    Parent.objects.create(stripeId='cus_queue', name='Old Name')
+    self.assertEqual(processWebhookEvents(), 0)
+    self.assertEqual(retryWebhookEvents(), 1)
+
+
+class WebhookOrderingTest(TestCase):
+  def setUp(self):
+    self.client = Client()
+    self.url = "/stripe/webhooks/"
+
+  def post_event(self, mock_construct_event, event_id, event_type, created, data):
+    mock_construct_event.return_value = {
+      'id': event_id,
+      'type': event_type,
+      'created': created,
+      'data': {
+        'object': data
+      }
+    }
+    return self.client.post(
+      self.url,
+      data=b"{}",
+      content_type="application/json",
+      HTTP_STRIPE_SIGNATURE="fake_signature"
+    )
+
+  def invoice(self, status, amount_paid, paid_at=None):
+    return {
+      'id': 'in_ordering',
+      'status': status,
+      'amount_due': 5000,
+      'amount_paid': amount_paid,
+      'currency': 'usd',
+      'created': 1609459200,
+      'status_transitions': {
+        'paid_at': paid_at
+      },
+      'customer': 'cus_test123'
+    }
+
+  @patch("stripe.Webhook.construct_event")
+  def testStaleInvoiceEventDropped(self, mock_construct_event):
+    LocalInvoice.objects.create(
+      stripeInvoiceId='in_ordering',
+      status='open',
+      amount_due=5000,
+      currency='usd',
+      created=datetime(2021, 1, 1, tzinfo=timezone.utc),
+      customer_stripe_id='cus_test123'
+    )
+
+    self.post_event(mock_construct_event, 'evt_paid', 'invoice.paid', 1609545600, self.invoice('paid', 5000, 1609545600))
+    # the earlier update is delivered late
+    self.post_event(mock_construct_event, 'evt_open', 'invoice.updated', 1609459300, self.invoice('open', 0))
+
+    invoice = LocalInvoice.objects.get(stripeInvoiceId='in_ordering')
+    self.assertEqual(invoice.status, 'paid')
+    self.assertEqual(invoice.amount_paid, 5000)
+    self.assertEqual(invoice.stripeUpdated, datetime(2021, 1, 2, tzinfo=timezone.utc))
+    # both events are recorded as processed
+    self.assertEqual(WebhookEvent.objects.filter(status=WebhookEvent.Status.PROCESSED).count(), 2)
+
+  def replacement(self, status):
+    return stripe.Invoice.construct_from({**self.invoice(status, 0), 'id': 'in_replacement'}, 'sk_test_fake')
+
+  @patch.dict(os.environ, {'STRIPE_SECRET_KEY': 'sk_test_fake'})
+  @patch("stripe.InvoiceService.retrieve")
+  @patch("stripe.Webhook.construct_event")
+  def testVoidedReplacementFetched(self, mock_construct_event, mock_retrieve):
+    mock_retrieve.return_value = self.replacement('open')
+
+    # fetched by its own task once the event's transaction commits
+    with self.captureOnCommitCallbacks(execute=True):
+      self.post_event(mock_construct_event, 'evt_void', 'invoice.voided', 1609459300, {**self.invoice('void', 0), 'replaced_by': 'in_replacement'})
+
+    mock_retrieve.assert_called_once_with('in_replacement')
+    replacement = LocalInvoice.objects.get(stripeInvoiceId='in_replacement')
+    self.assertEqual(replacement.status, 'open')
+    # events Stripe created before the fetch no longer apply
+    self.assertIsNotNone(replacement.stripeUpdated)
+
+  @patch.dict(os.environ, {'STRIPE_SECRET_KEY': 'sk_test_fake'})
+  @patch("stripe.InvoiceService.retrieve")
+  @patch("stripe.Webhook.construct_event")
+  def testVoidedReplacementDoesNotOverwriteNewerEvent(self, mock_construct_event, mock_retrieve):
+    mock_retrieve.return_value = self.replacement('open')
+    paid_at = datetime.now(timezone.utc) + timedelta(minutes=1)
+    LocalInvoice.objects.create(
+      stripeInvoiceId='in_replacement',
+      status='paid',
+      amount_due=5000,
+      amount_paid=5000,
+      currency='usd',
+      created=datetime(2021, 1, 1, tzinfo=timezone.utc),
+      status_transitions_paid_at=paid_at,
+      stripeUpdated=paid_at
+    )
+
+    with self.captureOnCommitCallbacks(execute=True):
+      self.post_event(mock_construct_event, 'evt_void', 'invoice.voided', 1609459300, {**self.invoice('void', 0), 'replaced_by': 'in_replacement'})
+
+    replacement = LocalInvoice.objects.get(stripeInvoiceId='in_replacement')
+    self.assertEqual(replacement.status, 'paid')
+    self.assertEqual(replacement.stripeUpdated, paid_at)
+
+  @patch("stripe.Webhook.construct_event")
+  def testInvoiceUpdateMarksSynced(self, mock_construct_event):
+    invoice = LocalInvoice.objects.create(
+      stripeInvoiceId='in_ordering',
+      status='open',
+      amount_due=5000,
+      currency='usd',
+      created=datetime(2021, 1, 1, tzinfo=timezone.utc),
+      customer_stripe_id='cus_test123'
+    )
+    LocalInvoice.objects.filter(id=invoice.id).update(last_synced=datetime(2021, 1, 1, tzinfo=timezone.utc))
+
+    self.post_event(mock_construct_event, 'evt_paid', 'invoice.paid', 1609545600, self.invoice('paid', 5000, 1609545600))
+
+    invoice.refresh_from_db()
+    self.assertEqual(invoice.status, 'paid')
+    self.assertGreater(invoice.last_synced, datetime.now(timezone.utc) - timedelta(minutes=1))
+
+    # the single event path too
+    LocalInvoice.objects.filter(id=invoice.id).update(last_synced=datetime(2021, 1, 1, tzinfo=timezone.utc))
+    self.assertTrue(syncLocalInvoice(self.invoice('paid', 5000, 1609545600), datetime(2021, 1, 3, tzinfo=timezone.utc)))
+
+    invoice.refresh_from_db()
+    self.assertGreater(invoice.last_synced, datetime.now(timezone.utc) - timedelta(minutes=1))
+
+  @patch("stripe.Webhook.construct_event")
+  def testInvoiceUpdateRefreshesRevenueRollup(self, mock_construct_event):
+    LocalInvoice.objects.create(
+      stripeInvoiceId='in_ordering',
+      status='open',
+      amount_due=5000,
+      currency='usd',
+      created=datetime(2021, 1, 1, tzinfo=timezone.utc),
+      customer_stripe_id='cus_test123'
+    )
+
+    self.post_event(mock_construct_event, 'evt_paid', 'invoice.paid', 1609545600, self.invoice('paid', 5000, 1609545600))
+
+    # revenue is counted on the paid day, invoices on the created day
+    self.assertEqual(DailyRevenueRollup.objects.get(day=date(2021, 1, 2)).revenue, 5000)
+    self.assertEqual(DailyRevenueRollup.objects.get(day=date(2021, 1, 1)).paid_invoices, 1)
+
+  @patch("stripe.Webhook.construct_event")
+  def testLateInvoiceCreatedDoesNotOverwrite(self, mock_construct_event):
+    self.post_event(mock_construct_event, 'evt_paid', 'invoice.paid', 1609545600, self.invoice('paid', 5000, 1609545600))
+    self.post_event(mock_construct_event, 'evt_created', 'invoice.created', 1609459200, self.invoice('draft', 0))
+
+    self.assertEqual(LocalInvoice.objects.get(stripeInvoiceId='in_ordering').status, 'paid')
+
+  @patch("stripe.Webhook.construct_event")
+  def testStaleCustomerEventDropped(self, mock_construct_event):
+    Parent.objects.create(stripeId='cus_ordering', name='Original Name')
+
+    self.post_event(mock_construct_event, 'evt_2', 'customer.updated', 1609459300, {'id': 'cus_ordering', 'name': 'Newest Name'})
+    self.post_event(mock_construct_event, 'evt_1', 'customer.updated', 1609459200, {'id': 'cus_ordering', 'name': 'Older Name'})
+
+    parent = Parent.objects.get(stripeId='cus_ordering')
+    self.assertEqual(parent.name, 'Newest Name')
+
+  @patch("stripe.Webhook.construct_event")
+  def testStaleProductEventDropped(self, mock_construct_event):
+    StripeProd.objects.create(stripeId='prod_ordering', name='Tutoring', defaultPriceId='price_1', unit_amount=2500, currency='aud')
+
+    self.post_event(mock_construct_event, 'evt_2', 'product.updated', 1609459300,
+                    {'id': 'prod_ordering', 'name': 'Group Tutoring', 'default_price': 'price_1'})
+    self.post_event(mock_construct_event, 'evt_1', 'product.deleted', 1609459200,
+                    {'id': 'prod_ordering', 'name': 'Tutoring', 'default_price': 'price_1'})
+
+    product = StripeProd.objects.get(stripeId='prod_ordering')
+    self.assertEqual(product.name, 'Group Tutoring')
+    self.assertTrue(product.is_active)
+    # same default price, so the stored amount is kept
+    self.assertEqual(product.unit_amount, 2500)
+
+
+@patch("stripeInt.views.async_task")
+class WebhookBatchTest(TestCase):
+  def setUp(self):
+    self.client = Client()
+    self.url = "/stripe/webhooks/"
+
+  def post_event(self, event_id, event_type, created, data):
+    with patch("stripe.Webhook.construct_event") as mock_construct_event:
+      mock_construct_event.return_value = {
+        'id': event_id,
+        'type': event_type,
+        'created': created,
+        'data': {
+          'object': data
+        }
+      }
+      return self.client.post(
+        self.url,
+        data=b"{}",
+        content_type="application/json",
+        HTTP_STRIPE_SIGNATURE="fake_signature"
+      )
+
+  def invoice(self, invoice_id, status, amount_paid=0, paid_at=None):
+    return {
+      'id': invoice_id,
+      'status': status,
+      'amount_due': 5000,
+      'amount_paid': amount_paid,
+      'currency': 'usd',
+      'created': 1609459200,
+      'status_transitions': {
+        'paid_at': paid_at
+      },
+      'customer': 'cus_test123'
+    }
+
+  def testInvoiceEventsCoalesced(self, mock_async_task):
+    self.post_event('evt_1', 'invoice.created', 1609459200, self.invoice('in_1', 'draft'))
+    self.post_event('evt_2', 'invoice.finalized', 1609459260, self.invoice('in_1', 'open'))
+    self.post_event('evt_3', 'invoice.created', 1609459200, self.invoice('in_2', 'draft'))
+    # delivered out of order
+    self.post_event('evt_5', 'invoice.payment_succeeded', 1609545600, self.invoice('in_1', 'paid', 5000, 1609545600))
+    self.post_event('evt_4', 'invoice.paid', 1609545600, self.invoice('in_1', 'paid', 5000, 1609545600))
+    self.post_event('evt_6', 'customer.created', 1609459200, {'id': 'cus_batch', 'name': 'Batched Customer'})
+
+    with CaptureQueriesContext(connection) as queries:
+      self.assertEqual(processWebhookEvents(), 6)
+
+    self.assertEqual(LocalInvoice.objects.get(stripeInvoiceId='in_1').status, 'paid')
+    self.assertEqual(LocalInvoice.objects.get(stripeInvoiceId='in_2').status, 'draft')
+    self.assertTrue(Parent.objects.filter(stripeId='cus_batch').exists())
+    self.assertFalse(WebhookEvent.objects.exclude(status=WebhookEvent.Status.PROCESSED).exists())
+    # one upsert for both invoices
+    invoice_writes = [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "tutoring_localinvoice"')]
+    self.assertEqual(len(invoice_writes), 1)
+
+  def testStaleEventsInBatchDropped(self, mock_async_task):
+    LocalInvoice.objects.create(
+      stripeInvoiceId='in_1',
+      status='paid',
+      amount_due=5000,
+      amount_paid=5000,
+      currency='usd',
+      created=datetime(2021, 1, 1, tzinfo=timezone.utc),
+      status_transitions_paid_at=datetime(2021, 1, 2, tzinfo=timezone.utc),
+      stripeUpdated=datetime(2021, 1, 2, tzinfo=timezone.utc)
+    )
+
+    self.post_event('evt_1', 'invoice.finalized', 1609459260, self.invoice('in_1', 'open'))
+    self.post_event('evt_2', 'invoice.created', 1609459200, self.invoice('in_2', 'draft'))
+
+    self.assertEqual(processWebhookEvents(), 2)
+    self.assertEqual(LocalInvoice.objects.get(stripeInvoiceId='in_1').status, 'paid')
+    self.assertEqual(LocalInvoice.objects.get(stripeInvoiceId='in_2').status, 'draft')
+
+  def testBatchesDrained(self, mock_async_task):
+    for i in range(5):
+      self.post_event(f'evt_{i}', 'invoice.created', 1609459200, self.invoice(f'in_{i}', 'draft'))
+
+    self.assertEqual(processWebhookEvents(batch_size=2), 5)
+    self.assertEqual(LocalInvoice.objects.count(), 5)
+    # nothing left for the next worker
+    self.assertEqual(processWebhookEvents(batch_size=2), 0)
+
+  def testBatchWritesEverySyncedField(self, mock_async_task):
+    self.assertEqual(set(localInvoiceFields(self.invoice('in_1', 'draft'))), set(SYNCED_FIELDS))
+    self.assertEqual(syncLocalInvoices([]), 0)
+
+    self.post_event('evt_1', 'invoice.created', 1609459200, self.invoice('in_1', 'draft'))
+    processWebhookEvents()
+    self.post_event('evt_2', 'invoice.paid', 1609545600, {**self.invoice('in_1', 'paid', 5000, 1609545600), 'customer': 'cus_other'})
+    processWebhookEvents()
+
+    local_invoice = LocalInvoice.objects.get(stripeInvoiceId='in_1')
+    self.assertEqual(local_invoice.status, 'paid')
+    self.assertEqual(local_invoice.amount_paid, 5000)
+    self.assertEqual(local_invoice.status_transitions_paid_at, datetime(2021, 1, 2, tzinfo=timezone.utc))
+    self.assertEqual(local_invoice.customer_stripe_id, 'cus_other')
+
+
+class WebhookStatsTest(TestCase):
+  def setUp(self):
+    self.client = Client()
+    self.url = "/stripe/webhooks/stats/"
+
+  def event(self, event_type, duration, status=WebhookEvent.Status.PROCESSED, attempts=1):
+    return WebhookEvent.objects.create(type=event_type, data={}, status=status, attempts=attempts, duration=duration)
+
+  def testHandlersRegistered(self):
+    self.assertIsInstance(getWebhookHandler('invoice.finalized'), UpdateInvoiceHandler)
+    # handlers are shared rather than built per event
+    self.assertIs(getWebhookHandler('invoice.paid'), getWebhookHandler('invoice.paid'))
+    self.assertIsNone(getWebhookHandler('charge.refunded'))
+
+  @patch("stripe.Webhook.construct_event")
+  def testDurationRecorded(self, mock_construct_event):
+    mock_construct_event.return_value = {
+      'id': 'evt_1',
+      'type': 'customer.created',
+      'created': 1609459200,
+      'data': {
+        'object': {'id': 'cus_stats', 'name': 'Stats Customer'}
+      }
+    }
+    self.client.post(
+      "/stripe/webhooks/",
+      data=b"{}",
+      content_type="application/json",
+      HTTP_STRIPE_SIGNATURE="fake_signature"
+    )
+
+    self.assertIsNotNone(WebhookEvent.objects.get(stripeEventId='evt_1').duration)
+
+  def testStatsPerType(self):
+    for duration in range(1, 101):
+      self.event('invoice.paid', duration)
+    self.event('customer.updated', 2000, WebhookEvent.Status.FAILED, attempts=2)
+    # not attempted yet
+    self.event('customer.updated', None, WebhookEvent.Status.PENDING)
+
+    self.client.force_login(User.objects.create_user('admin', password='secret', is_staff=True))
+    res = self.client.get(self.url)
+
+    self.assertEqual(res.status_code, 200)
+    stats = {entry['type']: entry for entry in res.json()['types']}
+    self.assertEqual(stats['invoice.paid']['count'], 100)
+    self.assertEqual(stats['invoice.paid']['p50_ms'], 50)
+    self.assertEqual(stats['invoice.paid']['p95_ms'], 95)
+    self.assertEqual(stats['invoice.paid']['failures'], 0)
+    self.assertEqual(stats['invoice.paid']['histogram']['<=10'], 10)
+    self.assertEqual(stats['customer.updated']['count'], 1)
+    self.assertEqual(stats['customer.updated']['failures'], 1)
+    self.assertEqual(stats['customer.updated']['retried'], 1)
+    # registered types without events are listed too
+    self.assertEqual(stats['price.deleted']['count'], 0)
+    # slowest in total first
+    self.assertEqual(res.json()['types'][0]['type'], 'invoice.paid')
+
+  def testStatsStaffOnly(self):
+    self.client.force_login(User.objects.create_user('tutor', password='secret'))
+    res = self.client.get(self.url)
+
+    self.assertNotEqual(res.status_code, 200)
@@ -1,7 +1,8 @@
 from django.contrib import admin
 from django.urls import include, path
-from .views import webhooks_view
+from .views import webhook_stats_view, webhooks_view
 
 urlpatterns = [
-  path('webhooks/', webhooks_view, name='webhooks-view')
+  path('webhooks/', webhooks_view, name='webhooks-view'),
+  path('webhooks/stats/', webhook_stats_view, name='webhook-stats-view')
 ]
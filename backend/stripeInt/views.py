@@ -1,5 +1,6 @@
-from datetime import datetime, timezone
-from django.http import HttpResponse, HttpResponseBadRequest
+from datetime import datetime, timedelta, timezone
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import render
 from abc import ABC, abstractmethod
 from django.views.decorators.csrf import csrf_exempt
@@ -7,9 +8,13 @@ import os
 from dotenv import load_dotenv
 import stripe
 from tutoring.models import LocalInvoice, Parent
-from .models import StripeProd
+from .models import StripeProd, WebhookEvent
+from .webhook_stats import webhookStats
+from .services import applyStripeUpdate, forgetPrice, notNewerThan, syncLocalInvoice
 import logging
-from django.db import connection
+from django.db import connection, transaction
+from django.db.models import Case, F, When
+from django_q.tasks import async_task
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -37,238 +42,250 @@ def webhooks_view(request):
         logger.error(f"Signature verification failed: {e}")
         return HttpResponseBadRequest()
 
-    webhookHandler = None
-    if event['type'] == 'product.created':
-        webhookHandler = CreateProductHandler()
-    elif event['type'] == 'product.updated':
-        webhookHandler = UpdateProductHandler()
-    elif event['type'] == 'product.deleted':
-        webhookHandler = DeleteProductHandler()
-    elif event['type'] == 'customer.created':
-        webhookHandler = CreateCustomerHandler()
-    elif event['type'] == 'customer.updated':
-        webhookHandler = UpdateCustomerHandler()
-    elif event['type'] == 'customer.deleted':
-        webhookHandler = DeleteCustomerHandler()
-    elif event['type'] == 'price.created':
-        webhookHandler = CreatePriceHandler()
-    elif event['type'] == 'price.updated':
-        webhookHandler = UpdatePriceHandler()
-    elif event['type'] == 'price.deleted':
-        webhookHandler = DeletePriceHandler()
-    elif event['type'] == 'invoice.created':
-        webhookHandler = CreateInvoiceHandler()
-    elif event['type'] == 'invoice.updated':
-        webhookHandler = UpdateInvoiceHandler()
-    elif event['type'] == 'invoice.paid':
-        webhookHandler = InvoicePaidHandler()
-    elif event['type'] == 'invoice.payment_succeeded':
-        webhookHandler = InvoicePaymentSucceededHandler()
-    elif event['type'] == 'invoice.voided':
-        webhookHandler = InvoiceVoidedHandler()
-    elif event['type'] == 'invoice.deleted':
-        webhookHandler = DeleteInvoiceHandler()
-    else:
+    if getWebhookHandler(event['type']) is None:
         logger.warning(f"Unhandled webhook event type: {event['type']}")
         return HttpResponse(status=404)
     
-    logger.info(f"Processing webhook with handler: {webhookHandler.__class__.__name__}")
-    webhookHandler.handle(event['data']['object'])
-    logger.info(f"Successfully processed webhook: {event['type']}")
+    # Store the event and acknowledge it straight away, a django-q worker
+    # drains the pending events in batches (see stripeInt.tasks)
+    data = event['data']['object']
+    fields = {
+        'type': event['type'],
+        'data': data.to_dict() if hasattr(data, 'to_dict') else data,
+        'created': datetime.fromtimestamp(event['created'], tz=timezone.utc) if event.get('created') else None,
+    }
+    if event.get('id'):
+        webhook_event, created = WebhookEvent.objects.get_or_create(stripeEventId=event['id'], defaults=fields)
+    else:
+        webhook_event, created = WebhookEvent.objects.create(**fields), True
+    
+    if created:
+        async_task('stripeInt.tasks.processWebhookEvents')
+        logger.info(f"Queued webhook event {webhook_event.id}: {event['type']}")
+    else:
+        logger.info(f"Webhook event {event['id']} already received, ignoring")
 
     return HttpResponse(status=200)
 
+def getWebhookHandler(event_type):
+    """The handler for a webhook event type, or None if it isn't handled"""
+    return _webhook_handlers.get(event_type)
+
+@staff_member_required
+def webhook_stats_view(request):
+    """
+    Internal: processing time and failures per webhook event type over the
+    last ?hours= (default 24), slowest in total first.
+    """
+    try:
+        hours = float(request.GET.get('hours', 24))
+    except ValueError:
+        return HttpResponseBadRequest()
+
+    since = datetime.now(timezone.utc) - timedelta(hours=hours)
+    return JsonResponse({'since': since.isoformat(), 'types': webhookStats(since, WEBHOOK_HANDLERS)})
+
 class WebhookHandler(ABC):
+    """
+    Applies one type of webhook event. event_created is the event's created
+    time: updates go through services.applyStripeUpdate, so an event older
+    than the last one applied to a row is dropped.
+    """
     @abstractmethod
-    def handle(self, data):
+    def handle(self, data, event_created=None):
         pass
 
 class CreateProductHandler(WebhookHandler):
-    def handle(self, data):
+    def handle(self, data, event_created=None):
         logger.info(f"Creating product: {data['id']} - {data['name']}")
-        new_product = StripeProd(stripeId=data['id'], defaultPriceId=data['default_price'], name=data['name'])
+        new_product = StripeProd(stripeId=data['id'], defaultPriceId=data['default_price'], name=data['name'], stripeUpdated=event_created)
         new_product.save()
         logger.info(f"Product created successfully: {data['id']}")
 
 class UpdateProductHandler(WebhookHandler):
-    def handle(self, data):
+    def handle(self, data, event_created=None):
         logger.info(f"Updating product: {data['id']} - {data['name']}")
-        product = StripeProd.objects.get(stripeId=data['id'])
-        product.name = data['name']
-        product.defaultPriceId = data['default_price']
-        product.save()
-        logger.info(f"Product updated successfully: {data['id']}")
+        # The cached amount belongs to the old default price, if it changed
+        def keep_if_same_price(field):
+            return Case(When(defaultPriceId=data['default_price'], then=F(field)), default=None)
+        updated = applyStripeUpdate(
+            StripeProd.objects.filter(stripeId=data['id']), event_created,
+            name=data['name'],
+            defaultPriceId=data['default_price'],
+            unit_amount=keep_if_same_price('unit_amount'),
+            currency=keep_if_same_price('currency')
+        )
+        if updated:
+            logger.info(f"Product updated successfully: {data['id']}")
+        else:
+            ignoreStale(StripeProd.objects.filter(stripeId=data['id']), data['id'])
 
 class DeleteProductHandler(WebhookHandler):
-    def handle(self, data):
+    def handle(self, data, event_created=None):
         logger.info(f"Deleting product: {data['id']}")
-        product = StripeProd.objects.get(stripeId=data['id'])
-        product.is_active = False
-        product.save()
-        logger.info(f"Product deleted successfully: {data['id']}")
+        if applyStripeUpdate(StripeProd.objects.filter(stripeId=data['id']), event_created, is_active=False):
+            logger.info(f"Product deleted successfully: {data['id']}")
+        else:
+            ignoreStale(StripeProd.objects.filter(stripeId=data['id']), data['id'])
 
 class CreateCustomerHandler(WebhookHandler):
-    def handle(self, data):
+    def handle(self, data, event_created=None):
         logger.info(f"Creating customer: {data['id']} - {data['name']}")
-        newParent = Parent(stripeId=data['id'], name=str(data['name']))
+        newParent = Parent(stripeId=data['id'], name=str(data['name']), stripeUpdated=event_created)
         newParent.save()
         logger.info(f"Customer created successfully: {data['id']}")
 
 class UpdateCustomerHandler(WebhookHandler):
-    def handle(self, data):
+    def handle(self, data, event_created=None):
         logger.info(f"Updating customer: {data['id']} - {data['name']}")
-        parent = Parent.objects.get(stripeId=data['id'])
-        parent.name = data['name']
-        parent.save()
-        logger.info(f"Customer updated successfully: {data['id']}")
+        if applyStripeUpdate(Parent.objects.filter(stripeId=data['id']), event_created, name=data['name']):
+            logger.info(f"Customer updated successfully: {data['id']}")
+        else:
+            ignoreStale(Parent.objects.filter(stripeId=data['id']), data['id'])
 
 class DeleteCustomerHandler(WebhookHandler):
-    def handle(self, data):
+    def handle(self, data, event_created=None):
         logger.info(f"Deleting customer: {data['id']}")
-        parent = Parent.objects.get(stripeId=data['id'])
-        parent.is_active = False
-        parent.save()
-        logger.info(f"Customer deleted successfully: {data['id']}")
+        if applyStripeUpdate(Parent.objects.filter(stripeId=data['id']), event_created, is_active=False):
+            logger.info(f"Customer deleted successfully: {data['id']}")
+        else:
+            ignoreStale(Parent.objects.filter(stripeId=data['id']), data['id'])
 
 class CreatePriceHandler(WebhookHandler):
-    def handle(self, data):
+    def handle(self, data, event_created=None):
         logger.info(f"Creating price: {data['id']} for product: {data['product']}")
-        try:
-            product = StripeProd.objects.get(stripeId=data['product'])
-            product.defaultPriceId = data['id']
-            product.save()
+        updated = applyStripeUpdate(
+            StripeProd.objects.filter(stripeId=data['product']), event_created,
+            defaultPriceId=data['id'],
+            unit_amount=data['unit_amount'],
+            currency=data['currency']
+        )
+        if updated:
             logger.info(f"Price created and product updated successfully: {data['id']}")
-        except StripeProd.DoesNotExist:
+        elif StripeProd.objects.filter(stripeId=data['product']).exists():
+            logger.info(f"Product {data['product']} has a newer update than price {data['id']}, ignoring")
+        else:
             logger.error(f"Product {data['product']} not found for price {data['id']}")
-            print(f"Product {data['product']} not found for price {data['id']}")
 
 class UpdatePriceHandler(WebhookHandler):
-    def handle(self, data):
-        logger.info(f"Price update event received for: {data['id']} - No action taken")
-        pass
+    def handle(self, data, event_created=None):
+        logger.info(f"Updating price: {data['id']}")
+        forgetPrice(data['id'])
+        updated = applyStripeUpdate(
+            StripeProd.objects.filter(defaultPriceId=data['id']), event_created,
+            unit_amount=data['unit_amount'],
+            currency=data['currency']
+        )
+        if updated:
+            logger.info(f"Price updated on {updated} product(s): {data['id']}")
+        else:
+            logger.info(f"Price {data['id']} is not a default price for any product or is stale - No action taken")
 
 class DeletePriceHandler(WebhookHandler):
-    def handle(self, data):
+    def handle(self, data, event_created=None):
         logger.info(f"Deleting price: {data['id']}")
-        # If the deleted price was a default price, we might want to clear it
-        try:
-            product = StripeProd.objects.get(defaultPriceId=data['id'])
-            product.defaultPriceId = None
-            product.save()
+        forgetPrice(data['id'])
+        # If the deleted price was a default price, clear it
+        updated = applyStripeUpdate(
+            StripeProd.objects.filter(defaultPriceId=data['id']), event_created,
+            defaultPriceId=None,
+            unit_amount=None,
+            currency=None
+        )
+        if updated:
             logger.info(f"Price deleted and product default price cleared: {data['id']}")
-        except StripeProd.DoesNotExist:
+        else:
             logger.info(f"Price {data['id']} was not a default price for any product")
-            pass
 
 class CreateInvoiceHandler(WebhookHandler):
-    def handle(self, data):
+    def handle(self, data, event_created=None):
         logger.info(f"Creating invoice: {data['id']}")
         
         # Only create if it's not a draft or if it has an ID
         if data.get('id'):
-            LocalInvoice.objects.update_or_create(
-                stripeInvoiceId=data['id'],
-                defaults={
-                    'status': data['status'],
-                    'amount_due': data['amount_due'],
-                    'amount_paid': data['amount_paid'],
-                    'currency': data['currency'],
-                    'created': datetime.fromtimestamp(data['created'], tz=timezone.utc),
-                    'status_transitions_paid_at': (
-                        datetime.fromtimestamp(data['status_transitions']['paid_at'], tz=timezone.utc)
-                        if data['status_transitions'].get('paid_at') else None
-                    ),
-                    'customer_stripe_id': data.get('customer'),
-                }
-            )
-            logger.info(f"Invoice created successfully: {data['id']}")
+            if syncLocalInvoice(data, event_created):
+                logger.info(f"Invoice created successfully: {data['id']}")
+            else:
+                logger.info(f"Invoice {data['id']} has a newer update, ignoring")
 
 class UpdateInvoiceHandler(WebhookHandler):
-    def handle(self, data):
+    def handle(self, data, event_created=None):
         logger.info(f"Updating invoice: {data['id']}")
         
-        try:
-            invoice = LocalInvoice.objects.get(stripeInvoiceId=data['id'])
-            invoice.status = data['status']
-            invoice.amount_due = data['amount_due']
-            invoice.amount_paid = data['amount_paid']
-            invoice.status_transitions_paid_at = (
-                datetime.fromtimestamp(data['status_transitions']['paid_at'], tz=timezone.utc)
-                if data['status_transitions'].get('paid_at') else None
-            )
-            invoice.save()
+        # Creates the invoice if it doesn't exist yet
+        if syncLocalInvoice(data, event_created):
             logger.info(f"Invoice updated successfully: {data['id']}")
-        except LocalInvoice.DoesNotExist:
-            # If invoice doesn't exist, create it
-            logger.warning(f"Invoice {data['id']} not found, creating it")
-            CreateInvoiceHandler().handle(data)
+        else:
+            logger.info(f"Invoice {data['id']} has a newer update, ignoring")
 
 class InvoicePaidHandler(WebhookHandler):
-    def handle(self, data):
+    def handle(self, data, event_created=None):
         logger.info(f"Invoice paid: {data['id']}")
-        UpdateInvoiceHandler().handle(data)
+        UpdateInvoiceHandler().handle(data, event_created)
 
 class InvoicePaymentSucceededHandler(WebhookHandler):
-    def handle(self, data):
+    def handle(self, data, event_created=None):
         logger.info(f"Invoice payment succeeded: {data['id']}")
-        UpdateInvoiceHandler().handle(data)
+        UpdateInvoiceHandler().handle(data, event_created)
 
 class InvoiceVoidedHandler(WebhookHandler):
-    def handle(self, data):
+    def handle(self, data, event_created=None):
         logger.info(f"Invoice voided: {data['id']}")
         
-        try:
-            invoice = LocalInvoice.objects.get(stripeInvoiceId=data['id'])
+        # Creates the invoice as voided for record keeping if it doesn't exist
+        if not syncLocalInvoice({**data, 'status': 'void'}, event_created):
+            logger.info(f"Invoice {data['id']} has a newer update, ignoring")
+            return
+
+        # Check if this invoice was replaced by a new one
+        if data.get('replaced_by'):
+            logger.info(f"Invoice {data['id']} was replaced by {data['replaced_by']}")
             
-            print(data)
-            # Check if this invoice was replaced by a new one
-            if data.get('replaced_by'):
-                logger.info(f"Invoice {data['id']} was replaced by {data['replaced_by']}")
-                
-                # Option 1: Mark the old invoice as voided and fetch the new one
-                invoice.status = 'void'
-                invoice.save()
-                
-                # Fetch the replacement invoice from Stripe
-                try:
-                    stripe_invoice = stripe.Invoice.retrieve(data['replaced_by'])
-                    
-                    # Create or update the replacement invoice
-                    LocalInvoice.objects.update_or_create(
-                        stripeInvoiceId=stripe_invoice['id'],
-                        defaults={
-                            'status': stripe_invoice['status'],
-                            'amount_due': stripe_invoice['amount_due'],
-                            'amount_paid': stripe_invoice['amount_paid'],
-                            'currency': stripe_invoice['currency'],
-                            'created': datetime.fromtimestamp(stripe_invoice['created'], tz=timezone.utc),
-                            'status_transitions_paid_at': (
-                                datetime.fromtimestamp(stripe_invoice['status_transitions']['paid_at'], tz=timezone.utc)
-                                if stripe_invoice['status_transitions'].get('paid_at') else None
-                            ),
-                            'customer_stripe_id': stripe_invoice.get('customer'),
-                        }
-                    )
-                    logger.info(f"Replacement invoice {data['replaced_by']} created/updated successfully")
-                except stripe.error.StripeError as e:
-                    logger.error(f"Failed to fetch replacement invoice {data['replaced_by']}: {e}")
-            else:
-                # Just a regular void without replacement
-                invoice.status = 'void'
-                invoice.save()
-                logger.info(f"Invoice voided successfully: {data['id']}")
-                
-        except LocalInvoice.DoesNotExist:
-            logger.warning(f"Invoice {data['id']} not found for voiding")
-            # Still create it as voided for record keeping
-            CreateInvoiceHandler().handle(data)
+            # Fetch the replacement invoice from Stripe in its own task once
+            # this commits, rather than while the webhook rows are locked
+            replaced_by = data['replaced_by']
+            transaction.on_commit(lambda: async_task('stripeInt.tasks.syncStripeInvoice', replaced_by))
+        else:
+            logger.info(f"Invoice voided successfully: {data['id']}")
 
 class DeleteInvoiceHandler(WebhookHandler):
-    def handle(self, data):
+    def handle(self, data, event_created=None):
         logger.info(f"Deleting invoice: {data['id']}")
-        try:
-            invoice = LocalInvoice.objects.get(stripeInvoiceId=data['id'])
-            invoice.delete()  # Or set is_active = False if you want soft deletes
+        invoices = notNewerThan(LocalInvoice.objects.filter(stripeInvoiceId=data['id']), event_created)
+        deleted, _ = invoices.delete()  # Or set is_active = False if you want soft deletes
+        if deleted:
             logger.info(f"Invoice deleted successfully: {data['id']}")
-        except LocalInvoice.DoesNotExist:
-            logger.warning(f"Invoice {data['id']} not found for deletion")
\ No newline at end of file
+        else:
+            logger.warning(f"Invoice {data['id']} not found for deletion or has a newer update")
+
+def ignoreStale(queryset, stripe_id):
+    """
+    Called when a conditional update changed nothing: the event is stale,
+    unless the object doesn't exist yet, in which case it raises so the
+    event is marked failed and retried once the object is created.
+    """
+    if not queryset.exists():
+        raise queryset.model.DoesNotExist(f"{queryset.model.__name__} {stripe_id} not found")
+    logger.info(f"{queryset.model.__name__} {stripe_id} has a newer update, ignoring")
+
+# Event type -> handler. Handlers are stateless, so one instance of each is shared
+WEBHOOK_HANDLERS = {
+    'product.created': CreateProductHandler,
+    'product.updated': UpdateProductHandler,
+    'product.deleted': DeleteProductHandler,
+    'customer.created': CreateCustomerHandler,
+    'customer.updated': UpdateCustomerHandler,
+    'customer.deleted': DeleteCustomerHandler,
+    'price.created': CreatePriceHandler,
+    'price.updated': UpdatePriceHandler,
+    'price.deleted': DeletePriceHandler,
+    'invoice.created': CreateInvoiceHandler,
+    'invoice.updated': UpdateInvoiceHandler,
+    'invoice.finalized': UpdateInvoiceHandler,
+    'invoice.paid': InvoicePaidHandler,
+    'invoice.payment_succeeded': InvoicePaymentSucceededHandler,
+    'invoice.voided': InvoiceVoidedHandler,
+    'invoice.deleted': DeleteInvoiceHandler,
+}
+
+_webhook_handlers = {event_type: handler() for event_type, handler in WEBHOOK_HANDLERS.items()}
@@ -0,0 +1,63 @@
+"""
+Per event type webhook processing metrics, computed from the handler
+durations and outcomes the tasks record on each WebhookEvent, so they cover
+every django-q worker rather than a single process.
+"""
+import math
+from collections import defaultdict
+
+from .models import WebhookEvent
+
+# Upper bounds in ms of the duration histogram buckets, the last is open ended
+HISTOGRAM_BUCKETS = [10, 50, 100, 250, 500, 1000, 5000]
+
+
+def percentile(durations, fraction):
+    """Nearest-rank percentile of sorted durations"""
+    if not durations:
+        return None
+    return durations[max(math.ceil(fraction * len(durations)) - 1, 0)]
+
+
+def histogram(durations):
+    counts = {f'<={bound}': 0 for bound in HISTOGRAM_BUCKETS}
+    counts[f'>{HISTOGRAM_BUCKETS[-1]}'] = 0
+    for duration in durations:
+        bucket = next((f'<={bound}' for bound in HISTOGRAM_BUCKETS if duration <= bound), f'>{HISTOGRAM_BUCKETS[-1]}')
+        counts[bucket] += 1
+    return counts
+
+
+def webhookStats(since, event_types=()):
+    """
+    Count, failures, total and p50/p95 handler time (ms) per event type for
+    the events received since the given time that have been attempted.
+    Every type in event_types is listed, even without events. Sorted by
+    total time, so the types dominating processing come first.
+    """
+    durations = defaultdict(list)
+    failures = defaultdict(int)
+    retried = defaultdict(int)
+    for event_type, duration, status, attempts in WebhookEvent.objects.filter(
+        received__gte=since, duration__isnull=False
+    ).values_list('type', 'duration', 'status', 'attempts'):
+        durations[event_type].append(duration)
+        if status == WebhookEvent.Status.FAILED:
+            failures[event_type] += 1
+        if attempts > 1:
+            retried[event_type] += 1
+
+    stats = []
+    for event_type in set(event_types) | set(durations):
+        type_durations = sorted(durations[event_type])
+        stats.append({
+            'type': event_type,
+            'count': len(type_durations),
+            'failures': failures[event_type],
+            'retried': retried[event_type],
+            'total_ms': round(sum(type_durations), 3),
+            'p50_ms': percentile(type_durations, 0.5),
+            'p95_ms': percentile(type_durations, 0.95),
+            'histogram': histogram(type_durations),
+        })
+    return sorted(stats, key=lambda entry: (-entry['total_ms'], entry['type']))
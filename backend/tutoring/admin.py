@@ -5,7 +5,7 @@ from django import forms
 from datetime import datetime, timezone as dt_timezone
 from .models import *
 import stripe
-import os
+from stripeInt.client import getStripeClient
 
 class ResourceInline(admin.TabularInline):
     model = Resource
@@ -111,8 +111,7 @@ class LocalInvoiceAdmin(admin.ModelAdmin):
         """Sync from Stripe when creating/updating stripeInvoiceId"""
         if 'stripeInvoiceId' in form.changed_data or not change:
             try:
-                stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
-                stripe_invoice = stripe.Invoice.retrieve(obj.stripeInvoiceId)
+                stripe_invoice = getStripeClient().invoices.retrieve(obj.stripeInvoiceId)
                 
                 obj.status = stripe_invoice.status
                 obj.amount_due = stripe_invoice.amount_due
@@ -0,0 +1,78 @@
+"""
+Versioned cache for dashboard sections.
+
+Each dashboard section has a version (a nanosecond timestamp) stored in the
+default cache. Cached section payloads are keyed by section, version and
+date range, so bumping a section's version invalidates every cached range
+for it at once. The signal receivers in tutoring.models bump the versions of
+the sections that depend on the model that changed. As they also run on the
+django-q workers, the default cache must be shared between processes (the
+database cache in prod) for the web process to see the new versions.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.utils.http import quote_etag
+
+# Safety net for anything that changes without firing signals
+# (QuerySet.update(), bulk_update(), and the time-relative default range)
+CACHE_TIMEOUT = 60 * 60
+
+# Models each section is computed from
+SECTION_DEPENDENCIES = {
+    'metricsData': {'TutoringStudent', 'Attendance', 'Lesson', 'LocalInvoice'},
+    'attendanceData': {'Attendance', 'Lesson'},
+    'revenueData': {'LocalInvoice'},
+    'groupPerformance': {'Group', 'Attendance', 'Lesson', 'LocalInvoice'},
+    'engagementDistribution': {'TutoringStudent', 'Attendance', 'Lesson'},
+    'atRiskStudents': {'TutoringStudent', 'Attendance', 'Lesson', 'LocalInvoice'},
+    'topPerformers': {'TutoringStudent', 'Attendance', 'Lesson'},
+}
+
+
+def _version_key(section):
+    return f'dashboard:version:{section}'
+
+
+def invalidate_dashboard(*model_names):
+    """Bump the version of every section computed from the given models"""
+    now = time.time_ns()
+    cache.set_many({
+        _version_key(section): now
+        for section, dependencies in SECTION_DEPENDENCIES.items()
+        if dependencies & set(model_names)
+    }, timeout=None)
+
+
+def get_versions(sections):
+    """Current version of each section, initialising any that are missing"""
+    keys = {section: _version_key(section) for section in sections}
+    found = cache.get_many(keys.values())
+
+    versions = {}
+    missing = {}
+    for section, key in keys.items():
+        if key in found:
+            versions[section] = found[key]
+        else:
+            versions[section] = missing[key] = time.time_ns()
+
+    if missing:
+        cache.set_many(missing, timeout=None)
+    return versions
+
+
+def section_key(section, version, start_date, end_date):
+    return f'dashboard:{section}:{version}:{start_date.date()}:{end_date.date()}'
+
+
+def get_etag(versions, start_date, end_date):
+    parts = [f'{start_date.date()}:{end_date.date()}']
+    parts += [f'{section}:{versions[section]}' for section in sorted(versions)]
+    return quote_etag(hashlib.md5('|'.join(parts).encode()).hexdigest())
+
+
+def get_last_modified(versions):
+    """Last modification time (seconds since the epoch) across the sections"""
+    return max(versions.values()) // 1_000_000_000
@@ -0,0 +1,65 @@
+"""
+Group images and their thumbnails.
+
+Images are stored through the default STORAGES backend under a unique
+name, as the production storage overwrites files with the same name.
+Thumbnails are JPEGs saved next to the original under thumbnails/<size>/,
+so their names can be derived from the image name without extra columns.
+"""
+import os
+import uuid
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image
+
+# Bounding box of each thumbnail variant, aspect ratio is preserved
+THUMBNAIL_SIZES = {
+    'small': (160, 160),
+    'medium': (480, 480),
+}
+
+
+def group_image_path(instance, filename):
+    """upload_to of Group.image: groups/<uuid>.<ext>, whatever the uploaded file was called"""
+    _, extension = os.path.splitext(filename)
+    return f'groups/{uuid.uuid4().hex}{extension.lower()}'
+
+
+def thumbnail_name(image_name, size):
+    directory, filename = os.path.split(image_name)
+    root, _ = os.path.splitext(filename)
+    return f'{directory}/thumbnails/{size}/{root}.jpg'
+
+
+def generate_thumbnails(image_file):
+    """Render and store every thumbnail variant of a saved image field file"""
+    image_file.open('rb')
+    try:
+        image = Image.open(image_file)
+        image.load()
+    finally:
+        image_file.close()
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+
+    for size, bounds in THUMBNAIL_SIZES.items():
+        thumbnail = image.copy()
+        thumbnail.thumbnail(bounds)
+        buffer = BytesIO()
+        thumbnail.save(buffer, format='JPEG', quality=85)
+
+        name = thumbnail_name(image_file.name, size)
+        image_file.storage.delete(name)
+        image_file.storage.save(name, ContentFile(buffer.getvalue()))
+
+
+def thumbnail_urls(image_file):
+    """URL of each thumbnail variant, or None if there is no image"""
+    if not image_file:
+        return None
+    return {
+        size: image_file.storage.url(thumbnail_name(image_file.name, size))
+        for size in THUMBNAIL_SIZES
+    }
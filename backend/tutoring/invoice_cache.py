@@ -0,0 +1,64 @@
+"""
+Cache of full Stripe invoice payloads, for getFullInvoice.
+
+Like the dashboard cache, each invoice has a version (a nanosecond
+timestamp) in the default cache and payloads are keyed by invoice and
+version. The LocalInvoice signal receivers and the webhook bulk writes bump
+the version whenever the invoice changes, so a Stripe fetch that was in
+flight during a change can only ever be stored under the old version.
+Webhooks are applied on the django-q workers, so this relies on the default
+cache being shared with the web process (the database cache in prod).
+"""
+import time
+
+from django.core.cache import cache
+
+# Safety net for invoices that can still change (draft, open, uncollectible)
+CACHE_TIMEOUT = 10 * 60
+
+# Finalized invoices that Stripe no longer changes, cached until invalidated
+FINAL_STATUSES = {'paid', 'void'}
+
+
+def _version_key(stripe_invoice_id):
+    return f'invoice:version:{stripe_invoice_id}'
+
+
+def _payload_key(stripe_invoice_id, version):
+    return f'invoice:{stripe_invoice_id}:{version}'
+
+
+def invalidate_invoice(*stripe_invoice_ids):
+    """Bump the version of the given invoices, dropping their cached payloads"""
+    keys = {stripe_invoice_id: _version_key(stripe_invoice_id) for stripe_invoice_id in stripe_invoice_ids}
+    versions = cache.get_many(keys.values())
+    # final payloads never expire, so don't leave them behind
+    cache.delete_many([
+        _payload_key(stripe_invoice_id, versions[key])
+        for stripe_invoice_id, key in keys.items() if key in versions
+    ])
+
+    now = time.time_ns()
+    cache.set_many({key: now for key in keys.values()}, timeout=None)
+
+
+def get_invoice(stripe_invoice_id, fetch):
+    """
+    The cached payload of an invoice. On a miss, fetch() is called for the
+    full invoice dict and its result is cached, for good if it's final.
+    """
+    version_key = _version_key(stripe_invoice_id)
+    version = cache.get(version_key)
+    if version is None:
+        version = time.time_ns()
+        # another request may have initialised it meanwhile
+        if not cache.add(version_key, version, timeout=None):
+            version = cache.get(version_key, version)
+
+    key = _payload_key(stripe_invoice_id, version)
+    payload = cache.get(key)
+    if payload is None:
+        payload = fetch()
+        timeout = None if payload.get('status') in FINAL_STATUSES else CACHE_TIMEOUT
+        cache.set(key, payload, timeout=timeout)
+    return payload
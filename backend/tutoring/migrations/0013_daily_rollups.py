@@ -0,0 +1,45 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from tutoring.rollups import rebuild_rollups
+
+
+def backfill_rollups(apps, schema_editor):
+    rebuild_rollups(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tutoring', '0012_remove_localinvoice_created_at_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRevenueRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('revenue', models.IntegerField(default=0)),
+                ('invoices', models.IntegerField(default=0)),
+                ('paid_invoices', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyAttendanceRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('total', models.IntegerField(default=0)),
+                ('present', models.IntegerField(default=0)),
+                ('homework', models.IntegerField(default=0)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_attendance', to='tutoring.group')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('day', 'group'), name='unique_daily_attendance_rollup')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
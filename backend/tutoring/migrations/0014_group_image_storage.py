@@ -0,0 +1,55 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:35
+
+import base64
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db import migrations, models
+from PIL import Image
+
+from tutoring.images import generate_thumbnails
+
+
+def move_images_to_storage(apps, schema_editor):
+    Group = apps.get_model('tutoring', 'Group')
+
+    for group in Group.objects.exclude(image_base64__isnull=True).exclude(image_base64=''):
+        data = base64.b64decode(group.image_base64)
+        extension = (Image.open(BytesIO(data)).format or 'jpeg').lower()
+
+        group.image.save(f'group_{group.id}.{extension}', ContentFile(data), save=False)
+        generate_thumbnails(group.image)
+        Group.objects.filter(id=group.id).update(image=group.image.name)
+
+
+def move_images_to_database(apps, schema_editor):
+    Group = apps.get_model('tutoring', 'Group')
+
+    for group in Group.objects.exclude(image__isnull=True).exclude(image=''):
+        with group.image.open('rb') as image:
+            image_base64 = base64.b64encode(image.read()).decode('utf-8')
+        Group.objects.filter(id=group.id).update(image_base64=image_base64)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tutoring', '0013_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='image',
+            field=models.ImageField(blank=True, null=True, upload_to='groups/'),
+        ),
+        migrations.RunPython(move_images_to_storage, move_images_to_database),
+        migrations.RemoveField(
+            model_name='group',
+            name='image_base64',
+        ),
+        migrations.RemoveField(
+            model_name='group',
+            name='image_upload',
+        ),
+    ]
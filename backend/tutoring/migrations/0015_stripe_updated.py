@@ -0,0 +1,23 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tutoring', '0014_group_image_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='localinvoice',
+            name='stripeUpdated',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='parent',
+            name='stripeUpdated',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
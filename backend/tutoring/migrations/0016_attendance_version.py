@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-18 01:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tutoring', '0015_stripe_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attendance',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-18 02:09
+
+import tutoring.images
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tutoring', '0016_attendance_version'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='group',
+            name='image',
+            field=models.ImageField(blank=True, null=True, upload_to=tutoring.images.group_image_path),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.6 on 2026-10-18 02:48
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_table(apps, schema_editor):
+    # a no-op unless settings.CACHES has a database backed cache
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tutoring', '0017_group_image_path'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
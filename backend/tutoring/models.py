@@ -1,11 +1,16 @@
 from abc import ABC, abstractmethod
+from collections import defaultdict
 from decimal import Decimal
-import os
-from django.db import models
+from django.db import models, transaction
 from django.dispatch import receiver
+from stripeInt.client import getStripeClient
 from stripeInt.models import StripeProd
-from django.db.models.signals import post_save
-import base64
+from django.db.models.signals import post_delete, post_init, post_save
+
+from .dashboard_cache import invalidate_dashboard
+from .images import generate_thumbnails, group_image_path
+from .invoice_cache import invalidate_invoice
+from .rollups import refresh_attendance_rollups, refresh_revenue_rollups, touch, utc_day
 
 class LocalInvoice(models.Model):
     """
@@ -27,12 +32,12 @@ class LocalInvoice(models.Model):
     # Metadata
     customer_stripe_id = models.CharField(max_length=255, null=True, blank=True)
     last_synced = models.DateTimeField(auto_now=True)
+    # created time of the last webhook event applied, older events are dropped
+    stripeUpdated = models.DateTimeField(null=True, blank=True)
     
     def get_stripe_invoice(self):
         """Fetch the full invoice data from Stripe when needed"""
-        import stripe
-        stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
-        return stripe.Invoice.retrieve(self.stripeInvoiceId)
+        return getStripeClient().invoices.retrieve(self.stripeInvoiceId)
     
     def is_paid(self):
         """Check if invoice is paid using local data"""
@@ -90,20 +95,15 @@ class Group(models.Model):
     )
     time_of_day = models.TimeField(null=True)
 
-    # real storage
-    image_base64 = models.TextField(null=True, blank=True)
-
-    # transient upload field (not stored in DB)
-    image_upload = models.FileField(upload_to="tmp/", null=True, blank=True)
+    # stored through the default STORAGES backend, see tutoring.images
+    image = models.ImageField(upload_to=group_image_path, null=True, blank=True)
 
     def save(self, *args, **kwargs):
-        if self.image_upload:
-            # read and convert to base64
-            self.image_base64 = base64.b64encode(self.image_upload.read()).decode("utf-8")
-            # clear the temp file field so it's not persisted
-            self.image_upload.delete(save=False)
-            self.image_upload = None
+        # a freshly uploaded file is only committed to storage by super().save()
+        new_image = bool(self.image) and not self.image._committed
         super().save(*args, **kwargs)
+        if new_image:
+            generate_thumbnails(self.image)
 
     def __str__(self):
         try:
@@ -125,17 +125,49 @@ def create_lesson_attendances(sender, instance, created, **kwargs):
     Creates attendance records for all students in the group when a lesson is created.
     """
     if created:
-        
-        students = instance.group.tutoringStudents.all()
-        
-        for student in students:
-            Attendance.objects.create(
-                lesson=instance,
-                tutoringStudent=student,
-                present=False,
-                homework=False,
-                paid=False
-            )
+        create_attendances([instance])
+
+
+def create_attendances(lessons):
+    """
+    Create the attendance records of every student in each lesson's group,
+    with one query for the students and one insert for the whole batch.
+    """
+    group_ids = {lesson.group_id for lesson in lessons}
+    students = defaultdict(list)
+    for group_id, student_id in TutoringStudent.group.through.objects.filter(
+        group_id__in=group_ids
+    ).values_list('group_id', 'tutoringstudent_id'):
+        students[group_id].append(student_id)
+
+    attendances = Attendance.objects.bulk_create([
+        Attendance(
+            lesson=lesson,
+            tutoringStudent_id=student_id,
+            present=False,
+            homework=False,
+            paid=False
+        )
+        for lesson in lessons
+        for student_id in students[lesson.group_id]
+    ])
+    if attendances:
+        touch('Attendance', attendance_keys=(_lesson_rollup_key(lesson) for lesson in lessons))
+    return attendances
+
+
+def create_lessons(lessons, batch_size=None):
+    """
+    Batch version of saving new Lessons: insert the unsaved lessons and all
+    their attendances with one insert each per batch. For the term scheduler
+    and imports creating many lessons at once. Returns the lessons.
+    """
+    with transaction.atomic():
+        lessons = Lesson.objects.bulk_create(lessons, batch_size=batch_size)
+        # the attendance rollups only change once there are attendances
+        create_attendances(lessons)
+        touch('Lesson')
+    return lessons
 
 
 class Resource(models.Model):
@@ -158,6 +190,15 @@ class Attendance(models.Model):
     present = models.BooleanField(default=False)
     paid = models.BooleanField(default=False)
     local_invoice = models.ForeignKey(LocalInvoice, on_delete=models.SET_NULL, null=True, blank=True, related_name='attendances')
+    # bumped on every edit, so clients marking the roll can detect conflicting edits
+    version = models.PositiveIntegerField(default=0)
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version += 1
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        super().save(*args, **kwargs)
 
 class Parent(models.Model):
     PAYMENT_FREQUENCY_CHOICES = [
@@ -175,6 +216,8 @@ class Parent(models.Model):
         choices=PAYMENT_FREQUENCY_CHOICES,
         default='half-termly',
     )
+    # created time of the last webhook event applied, older events are dropped
+    stripeUpdated = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return self.name
@@ -189,4 +232,96 @@ class TutoringStudent(models.Model):
   
 
   def __str__(self):
-      return self.name
\ No newline at end of file
+      return self.name
+
+
+class DailyAttendanceRollup(models.Model):
+    """
+    Attendance counts per group per (UTC) lesson day, for the dashboard.
+    Maintained by the signal receivers below; see tutoring.rollups.
+    """
+    day = models.DateField()
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='daily_attendance')
+    total = models.IntegerField(default=0)
+    present = models.IntegerField(default=0)
+    homework = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'group'], name='unique_daily_attendance_rollup'),
+        ]
+
+class DailyRevenueRollup(models.Model):
+    """
+    Paid revenue (by paid day) and invoice counts (by created day) per UTC day,
+    for the dashboard. Maintained by the signal receivers below.
+    """
+    day = models.DateField(unique=True)
+    revenue = models.IntegerField(default=0)  # in cents
+    invoices = models.IntegerField(default=0)
+    paid_invoices = models.IntegerField(default=0)
+
+
+def _lesson_rollup_key(lesson):
+    return (utc_day(lesson.__dict__.get('date')), lesson.__dict__.get('group_id'))
+
+def _invoice_rollup_days(invoice):
+    return {
+        utc_day(invoice.__dict__.get('created')),
+        utc_day(invoice.__dict__.get('status_transitions_paid_at')),
+    }
+
+@receiver(post_init, sender=Lesson)
+@receiver(post_init, sender=Attendance)
+@receiver(post_init, sender=LocalInvoice)
+def remember_rollup_keys(sender, instance, **kwargs):
+    """
+    Remember which rollup rows an instance contributed to when loaded, so a
+    save that moves it (e.g. a rescheduled lesson) refreshes the old rows too.
+    """
+    if sender is Lesson:
+        instance._rollup_key = _lesson_rollup_key(instance)
+    elif sender is Attendance:
+        instance._rollup_lesson_id = instance.__dict__.get('lesson_id')
+    else:
+        instance._rollup_days = _invoice_rollup_days(instance)
+
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Lesson)
+def refresh_lesson_rollups(sender, instance, **kwargs):
+    refresh_attendance_rollups([instance._rollup_key, _lesson_rollup_key(instance)])
+    instance._rollup_key = _lesson_rollup_key(instance)
+
+@receiver(post_save, sender=Attendance)
+@receiver(post_delete, sender=Attendance)
+def refresh_attendance_rollup(sender, instance, **kwargs):
+    lesson_ids = {instance._rollup_lesson_id, instance.lesson_id}
+    lessons = Lesson.objects.filter(id__in=lesson_ids).values_list('date', 'group_id')
+    refresh_attendance_rollups((utc_day(date), group_id) for date, group_id in lessons)
+    instance._rollup_lesson_id = instance.lesson_id
+
+@receiver(post_save, sender=LocalInvoice)
+@receiver(post_delete, sender=LocalInvoice)
+def refresh_invoice_rollups(sender, instance, **kwargs):
+    refresh_revenue_rollups(instance._rollup_days | _invoice_rollup_days(instance))
+    instance._rollup_days = _invoice_rollup_days(instance)
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Lesson)
+@receiver(post_save, sender=Attendance)
+@receiver(post_delete, sender=Attendance)
+@receiver(post_save, sender=LocalInvoice)
+@receiver(post_delete, sender=LocalInvoice)
+@receiver(post_save, sender=TutoringStudent)
+@receiver(post_delete, sender=TutoringStudent)
+def invalidate_dashboard_cache(sender, **kwargs):
+    """Invalidate the cached dashboard sections computed from the changed model"""
+    invalidate_dashboard(sender.__name__)
+
+@receiver(post_save, sender=LocalInvoice)
+@receiver(post_delete, sender=LocalInvoice)
+def invalidate_invoice_cache(sender, instance, **kwargs):
+    """Drop the cached Stripe payload of the changed invoice"""
+    invalidate_invoice(instance.stripeInvoiceId)
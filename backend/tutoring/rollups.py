@@ -0,0 +1,212 @@
+"""
+Daily rollups backing the dashboard.
+
+DailyAttendanceRollup holds attendance counts per (day, group) and
+DailyRevenueRollup holds invoice counts and paid revenue per day, so date
+range queries sum a few small rows instead of scanning raw attendances and
+invoices. Days are UTC calendar days. Rows are refreshed from the source
+tables by the signal receivers in tutoring.models, and by touch() after
+writes that skip signals.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone
+
+from django.apps import apps as django_apps
+from django.db import connection, transaction
+from django.db.models import Count, DateTimeField, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone as django_timezone
+
+from .dashboard_cache import invalidate_dashboard
+from .invoice_cache import invalidate_invoice
+
+
+def utc_day(value):
+    """
+    UTC calendar day of a datetime, or None. Accepts the same unsaved values
+    a DateTimeField does (strings, dates, naive datetimes).
+    """
+    if value is None:
+        return None
+    value = DateTimeField().to_python(value)
+    if django_timezone.is_naive(value):
+        value = django_timezone.make_aware(value)
+    return value.astimezone(timezone.utc).date()
+
+
+def day_range(start_day, end_day):
+    """
+    Half-open datetime bounds [start, end) covering the UTC days from
+    start_day to end_day inclusive, the days the rollup rows between them
+    hold. Filter raw dates with these to match a query over the rollups.
+    """
+    start = datetime.combine(start_day, time.min, tzinfo=timezone.utc)
+    end = datetime.combine(end_day, time.min, tzinfo=timezone.utc) + timedelta(days=1)
+    return start, end
+
+
+def refresh_attendance_rollups(keys, apps=django_apps):
+    """
+    Recompute the DailyAttendanceRollup rows for the given (day, group_id)
+    keys, set-based: one aggregate over every key, one upsert of the
+    non-empty rows and one delete of the rows that are now empty.
+    """
+    Attendance = apps.get_model('tutoring', 'Attendance')
+    DailyAttendanceRollup = apps.get_model('tutoring', 'DailyAttendanceRollup')
+
+    keys = {(day, group_id) for day, group_id in keys if day is not None and group_id is not None}
+    if not keys:
+        return
+
+    days = {day for day, _ in keys}
+    range_start, range_end = day_range(min(days), max(days))
+    rows = Attendance.objects.filter(
+        lesson__group_id__in={group_id for _, group_id in keys},
+        lesson__date__gte=range_start,
+        lesson__date__lt=range_end
+    ).annotate(
+        day=TruncDate('lesson__date', tzinfo=timezone.utc)
+    ).values('day', 'lesson__group_id').annotate(
+        total=Count('id'),
+        present=Count('id', filter=Q(present=True)),
+        homework=Count('id', filter=Q(homework=True))
+    ).order_by()
+
+    # the range also covers other days of the same groups, only keep the keys asked for
+    rollups = [
+        DailyAttendanceRollup(
+            day=row['day'],
+            group_id=row['lesson__group_id'],
+            total=row['total'],
+            present=row['present'],
+            homework=row['homework']
+        )
+        for row in rows
+        if (row['day'], row['lesson__group_id']) in keys
+    ]
+    if rollups:
+        DailyAttendanceRollup.objects.bulk_create(
+            rollups,
+            update_conflicts=True,
+            unique_fields=['day', 'group'],
+            update_fields=['total', 'present', 'homework']
+        )
+
+    empty = defaultdict(set)
+    for day, group_id in keys - {(rollup.day, rollup.group_id) for rollup in rollups}:
+        empty[group_id].add(day)
+    if empty:
+        stale = Q()
+        for group_id, group_days in empty.items():
+            stale |= Q(group_id=group_id, day__in=group_days)
+        DailyAttendanceRollup.objects.filter(stale).delete()
+
+
+def refresh_revenue_rollups(days, apps=django_apps):
+    """Recompute the DailyRevenueRollup rows for the given days"""
+    LocalInvoice = apps.get_model('tutoring', 'LocalInvoice')
+    DailyRevenueRollup = apps.get_model('tutoring', 'DailyRevenueRollup')
+
+    for day in set(days):
+        if day is None:
+            continue
+
+        day_start, day_end = day_range(day, day)
+        revenue = LocalInvoice.objects.filter(
+            status='paid',
+            status_transitions_paid_at__gte=day_start,
+            status_transitions_paid_at__lt=day_end
+        ).aggregate(total=Sum('amount_paid'))['total'] or 0
+
+        invoices = LocalInvoice.objects.filter(
+            created__gte=day_start,
+            created__lt=day_end
+        ).aggregate(
+            total=Count('id'),
+            paid=Count('id', filter=Q(status='paid'))
+        )
+
+        if revenue == 0 and invoices['total'] == 0:
+            DailyRevenueRollup.objects.filter(day=day).delete()
+        else:
+            DailyRevenueRollup.objects.update_or_create(
+                day=day,
+                defaults={
+                    'revenue': revenue,
+                    'invoices': invoices['total'],
+                    'paid_invoices': invoices['paid'],
+                }
+            )
+
+
+def touch(*model_names, attendance_keys=(), revenue_days=(), stripe_invoice_ids=()):
+    """
+    What the signal receivers in tutoring.models do after a save, for writes
+    that skip them (bulk_create(), bulk_update(), QuerySet.update()): refresh
+    the attendance rollups of the given (day, group_id) keys and the revenue
+    rollups of the given days, invalidate the dashboard sections computed
+    from the named models, and drop the cached Stripe payloads of the given
+    invoices. Every bulk write to a model the dashboard reads must call it.
+    """
+    refresh_attendance_rollups(attendance_keys)
+    refresh_revenue_rollups(revenue_days)
+    invalidate_dashboard(*model_names)
+    if connection.in_atomic_block:
+        # again once committed, dropping sections another request cached from
+        # the data as it was before the commit under the new version
+        transaction.on_commit(lambda: invalidate_dashboard(*model_names))
+    # cached payloads come from Stripe rather than the DB, no need to wait for the commit
+    invalidate_invoice(*stripe_invoice_ids)
+
+
+def rebuild_rollups(apps=django_apps):
+    """Rebuild every rollup row from scratch"""
+    Attendance = apps.get_model('tutoring', 'Attendance')
+    LocalInvoice = apps.get_model('tutoring', 'LocalInvoice')
+    DailyAttendanceRollup = apps.get_model('tutoring', 'DailyAttendanceRollup')
+    DailyRevenueRollup = apps.get_model('tutoring', 'DailyRevenueRollup')
+
+    DailyAttendanceRollup.objects.all().delete()
+    DailyRevenueRollup.objects.all().delete()
+
+    attendance_rows = Attendance.objects.annotate(
+        day=TruncDate('lesson__date', tzinfo=timezone.utc)
+    ).values('day', 'lesson__group_id').annotate(
+        total=Count('id'),
+        present=Count('id', filter=Q(present=True)),
+        homework=Count('id', filter=Q(homework=True))
+    ).order_by()
+
+    DailyAttendanceRollup.objects.bulk_create([
+        DailyAttendanceRollup(
+            day=row['day'],
+            group_id=row['lesson__group_id'],
+            total=row['total'],
+            present=row['present'],
+            homework=row['homework']
+        )
+        for row in attendance_rows
+    ])
+
+    revenue_by_day = {}
+    paid_rows = LocalInvoice.objects.filter(
+        status='paid',
+        status_transitions_paid_at__isnull=False
+    ).annotate(
+        day=TruncDate('status_transitions_paid_at', tzinfo=timezone.utc)
+    ).values('day').annotate(revenue=Sum('amount_paid')).order_by()
+    for row in paid_rows:
+        revenue_by_day[row['day']] = DailyRevenueRollup(day=row['day'], revenue=row['revenue'] or 0)
+
+    created_rows = LocalInvoice.objects.annotate(
+        day=TruncDate('created', tzinfo=timezone.utc)
+    ).values('day').annotate(
+        total=Count('id'),
+        paid=Count('id', filter=Q(status='paid'))
+    ).order_by()
+    for row in created_rows:
+        rollup = revenue_by_day.setdefault(row['day'], DailyRevenueRollup(day=row['day']))
+        rollup.invoices = row['total']
+        rollup.paid_invoices = row['paid']
+
+    DailyRevenueRollup.objects.bulk_create(revenue_by_day.values())
@@ -41,7 +41,7 @@ describe("login process", () => {
 
   it("An unauthenticated user logs in successfully and clicks the calendar in the menu bar and then it lets him", () => {
     cy.visit("/login");
-    cy.intercept('GET', '**/api/groups/', { fixture: 'groupsPage/allGroupsResponse1.json' }).as('getAllGroups');
+    cy.intercept({ method: 'GET', pathname: '/api/groups/' }, { fixture: 'groupsPage/allGroupsResponse1.json' }).as('getAllGroups');
 
 
     // Fill out login form (adjust selectors to match your LoginPage)
@@ -26,12 +26,12 @@ export default function GroupsCard(props) {
     day_of_week,
     time_of_day,
     weekly_time,
-    image_base64
+    image_thumbnails
   } = props;
 
-  // Create a fallback image or use base64 if provided
-  const imageSource = image_base64 
-    ? `data:image/jpeg;base64,${image_base64}` 
+  // Use the medium thumbnail if the group has an image, otherwise a fallback
+  const imageSource = image_thumbnails
+    ? image_thumbnails.medium
     : "/static/images/cards/default-lesson.jpg";
 
   // Get tutor initials for avatar
@@ -1,5 +1,5 @@
-import React, { useState, useMemo } from 'react';
-import { useGetAllAttendances, useGetAllStudents, useGetAllLessons, useGetAllGroups } from "../services/api";
+import React, { useState, useMemo, useEffect } from 'react';
+import { useGetAllStudents, useGetAllLessons } from "../services/api";
 
 // Utility function to group attendances by lesson
 const groupByLesson = (attendances) => {
@@ -438,10 +438,32 @@ function LessonCard({ lessonId, attendances, studentsMap, lessonsMap }) {
 
 // Main Component
 export default function AttendancePage() {
-  const [attendanceData, attendanceLoading, attendanceError] = useGetAllAttendances();
-  const [studentsData, studentsLoading, studentsError] = useGetAllStudents();
-  const [lessonsData, lessonsLoading, lessonsError] = useGetAllLessons();
-  const [groupsData, groupsLoading, groupsError] = useGetAllGroups();
+  // Newest lessons first, a page at a time, each with the attendances shown for it
+  const [lessonsData, lessonsLoading, lessonsError, loadMoreLessons] = useGetAllLessons(
+    '?ordering=-id&fields=id,date,group,attendances&expand=attendances,local_invoice'
+  );
+  // Only the names are shown, small enough to load every page of
+  const [studentsData, studentsLoading, studentsError, loadMoreStudents] = useGetAllStudents(
+    '?fields=id,name&page_size=500'
+  );
+
+  useEffect(() => {
+    loadMoreStudents?.();
+  }, [loadMoreStudents]);
+
+  const attendanceData = useMemo(() => {
+    if (!lessonsData) return null;
+    return lessonsData.flatMap(lesson => lesson.attendances);
+  }, [lessonsData]);
+
+  // The groups of the loaded lessons, for the group filter
+  const groupsData = useMemo(() => {
+    if (!lessonsData) return null;
+    return [...new Set(lessonsData.map(lesson => lesson.group))]
+      .filter(id => id !== null)
+      .sort((a, b) => a - b)
+      .map(id => ({ id }));
+  }, [lessonsData]);
   
   const [filters, setFilters] = useState({
     invoiceStatus: 'all',
@@ -568,8 +590,8 @@ export default function AttendancePage() {
     return Object.keys(groupedAttendances).sort((a, b) => Number(b) - Number(a));
   }, [groupedAttendances]);
 
-  const loading = attendanceLoading || studentsLoading || lessonsLoading || groupsLoading;
-  const error = attendanceError || studentsError || lessonsError || groupsError;
+  const loading = studentsLoading || lessonsLoading;
+  const error = studentsError || lessonsError;
 
   if (loading) {
     return (
@@ -627,6 +649,18 @@ export default function AttendancePage() {
               </div>
             </div>
           )}
+          {loadMoreLessons && (
+            <div className="text-center my-3">
+              <button
+                type="button"
+                className="btn btn-outline-primary"
+                onClick={loadMoreLessons}
+                style={{ borderColor: '#004aad', color: '#004aad' }}
+              >
+                Load older lessons
+              </button>
+            </div>
+          )}
         </div>
       </div>
     </div>
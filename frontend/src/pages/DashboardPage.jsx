@@ -8,8 +8,13 @@ import GroupPerformanceChart from '../components/DashboardPage/GroupPerformanceC
 import RevenueChart from '../components/DashboardPage/RevenueChart';
 import StudentEngagementChart from '../components/DashboardPage/StudentEngagementChart';
 import TopPerformers from '../components/DashboardPage/TopPerformers';
+import Loading from '../components/Loading';
 import { useGetDashboardData } from '../services/api';
 
+// Charts and metrics load first; the heavier per-student lists follow in their own request
+const CRITICAL_SECTIONS = ['metrics', 'attendance', 'engagement', 'revenue', 'group-performance'];
+const STUDENT_LIST_SECTIONS = ['at-risk', 'top-performers'];
+
 export default function DashboardPage() {
   // Calculate default date range (last 90 days)
   const [dateRange, setDateRange] = useState(() => {
@@ -25,7 +30,13 @@ export default function DashboardPage() {
   // Fetch dashboard data with the current date range
   const [dashboardData, loading, error] = useGetDashboardData(
     dateRange.start,
-    dateRange.end
+    dateRange.end,
+    CRITICAL_SECTIONS
+  );
+  const [studentLists, studentListsLoading] = useGetDashboardData(
+    dateRange.start,
+    dateRange.end,
+    STUDENT_LIST_SECTIONS
   );
 
   // Handle date range change
@@ -78,9 +89,7 @@ export default function DashboardPage() {
     attendanceData,
     revenueData,
     groupPerformance,
-    engagementDistribution,
-    atRiskStudents,
-    topPerformers
+    engagementDistribution
   } = dashboardData;
 
   return (
@@ -115,10 +124,14 @@ export default function DashboardPage() {
 
       <div className="row g-3">
         <div className="col-lg-6">
-          <AtRiskStudents students={atRiskStudents} />
+          {studentListsLoading
+            ? <Loading />
+            : <AtRiskStudents students={studentLists?.atRiskStudents ?? []} />}
         </div>
         <div className="col-lg-6">
-          <TopPerformers students={topPerformers} />
+          {studentListsLoading
+            ? <Loading />
+            : <TopPerformers students={studentLists?.topPerformers ?? []} />}
         </div>
       </div>
     </div>
@@ -18,8 +18,8 @@ export default function GroupsExplorePage() {
       <div
         className="position-relative text-white"
         style={{
-          backgroundImage: groupInformation.image_base64
-            ? `url(data:image/jpeg;base64,${groupInformation.image_base64})`
+          backgroundImage: groupInformation.image
+            ? `url(${groupInformation.image})`
             : "linear-gradient(135deg, #3f51b5, #5c6bc0)",
           backgroundSize: "cover",
           backgroundPosition: "center",
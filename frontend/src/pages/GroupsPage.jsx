@@ -5,7 +5,11 @@ import Loading from '../components/Loading'
 
 export default function GroupsPage() {
 
-  const [groups, loading, error] = useGetAllGroups();
+  // Only what the cards show, a page at a time
+  const [groups, loading, error, loadMore] = useGetAllGroups(
+    '?fields=id,lesson_length,associated_product,tutor,course,day_of_week,time_of_day,image_thumbnails' +
+    '&expand=associated_product'
+  );
 
   console.log(error);
   console.log(loading);
@@ -33,6 +37,13 @@ export default function GroupsPage() {
           ))
         )}
       </div>
+      {loadMore && (
+        <div className="text-center my-3">
+          <button type="button" className="btn btn-outline-primary" onClick={loadMore}>
+            Load more groups
+          </button>
+        </div>
+      )}
         
     </>
   );
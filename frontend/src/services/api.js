@@ -1,5 +1,5 @@
 import axios from "axios";
-import { useEffect, useState } from "react";
+import { useCallback, useEffect, useMemo, useState } from "react";
 
 const API = axios.create({
   baseURL: import.meta.env.VITE_API_BASE_URL,
@@ -100,29 +100,51 @@ API.interceptors.response.use(
 export const login = (username, password) => API.post("/api/token/", { username, password });
 export const refreshToken = (refresh) => API.post("/api/token/refresh/", { refresh });
 
-// ----- Groups Services -----
+// ----- List endpoints -----
+
+// The list endpoints return a page at a time ({ next, previous, results }).
+// usePages loads the first page of url (which may carry ?fields=, ?expand=,
+// ?ordering=-id or ?page_size=) and loadMore() appends the next one, so a page
+// only fetches the rows it shows. loadMore is null on the last page and while
+// a page is loading.
+const nextCursor = (res) => res.data.next ? new URL(res.data.next).searchParams.get("cursor") : null;
 
-// GET *
-export function useGetAllGroups(){
+function usePages(url, name) {
   const [data, setData] = useState(null)
   const [loading, setLoading] = useState(true)
   const [error, setError] = useState(null)
+  const [cursor, setCursor] = useState(null)
 
-  useEffect(() => {
-    API.get('/api/groups/')
+  const fetchPage = useCallback((after) => {
+    setCursor(null);
+    return API.get(url, { params: after ? { cursor: after } : {} })
       .then(res => {
-        setData(res.data);
+        setData(prev => after ? [...prev, ...res.data.results] : res.data.results);
+        setCursor(nextCursor(res));
       })
       .catch(err => {
-        console.error("Error fetching groups:", err);
+        console.error(`Error fetching ${name}:`, err);
         setError(err);
       })
       .finally(() => {
         setLoading(false);
       });
+  }, [url, name])
+
+  useEffect(() => {
+    setLoading(true);
+    fetchPage(null);
+  }, [fetchPage])
+
+  const loadMore = useMemo(() => cursor ? () => fetchPage(cursor) : null, [cursor, fetchPage])
+  return [data, loading, error, loadMore]
+}
+
+// ----- Groups Services -----
 
-  }, [])
-  return [data, loading, error]
+// GET * (a page at a time, see usePages)
+export function useGetAllGroups(query = ""){
+  return usePages(`/api/groups/${query}`, "groups")
 }
 
 // GET :id
@@ -162,26 +184,9 @@ export async function editAttendance(id, attendanceData) {
   }
 }
 
-export function useGetAllAttendances(){
-  const [data, setData] = useState(null)
-  const [loading, setLoading] = useState(true)
-  const [error, setError] = useState(null)
-
-  useEffect(() => {
-    API.get('/api/attendances/')
-      .then(res => {
-        setData(res.data);
-      })
-      .catch(err => {
-        console.error("Error fetching attendances:", err);
-        setError(err);
-      })
-      .finally(() => {
-        setLoading(false);
-      });
-
-  }, [])
-  return [data, loading, error]
+// GET * (a page at a time, see usePages)
+export function useGetAllAttendances(query = ""){
+  return usePages(`/api/attendances/${query}`, "attendances")
 }
 
 
@@ -202,27 +207,9 @@ export async function deleteLesson(id){
   }
 }
 
-// GET * (All Lessons)
-export function useGetAllLessons(){
-  const [data, setData] = useState(null)
-  const [loading, setLoading] = useState(true)
-  const [error, setError] = useState(null)
-
-  useEffect(() => {
-    API.get('/api/lessons/all/')
-      .then(res => {
-        setData(res.data);
-      })
-      .catch(err => {
-        console.error("Error fetching lessons:", err);
-        setError(err);
-      })
-      .finally(() => {
-        setLoading(false);
-      });
-
-  }, [])
-  return [data, loading, error]
+// GET * (All Lessons, a page at a time, see usePages)
+export function useGetAllLessons(query = ""){
+  return usePages(`/api/lessons/all/${query}`, "lessons")
 }
 
 // GET :id (Single Lesson)
@@ -259,27 +246,9 @@ export async function newResources(resourceData){
 
 export default API;
 
-// GET * (All Students)
-export function useGetAllStudents(){
-  const [data, setData] = useState(null)
-  const [loading, setLoading] = useState(true)
-  const [error, setError] = useState(null)
-
-  useEffect(() => {
-    API.get('/api/students/')
-      .then(res => {
-        setData(res.data);
-      })
-      .catch(err => {
-        console.error("Error fetching students:", err);
-        setError(err);
-      })
-      .finally(() => {
-        setLoading(false);
-      });
-
-  }, [])
-  return [data, loading, error]
+// GET * (All Students, a page at a time, see usePages)
+export function useGetAllStudents(query = ""){
+  return usePages(`/api/students/${query}`, "students")
 }
 
 // GET :id (Single Student)
@@ -306,15 +275,18 @@ export function useGetStudentById(id){
 // ----- Dashboard Services -----
 
 // GET dashboard data with optional date range
-export function useGetDashboardData(startDate = null, endDate = null) {
+// sections: optional list of section slugs (e.g. ['metrics', 'revenue']); all sections when omitted
+export function useGetDashboardData(startDate = null, endDate = null, sections = null) {
   const [data, setData] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const sectionsParam = sections ? sections.join(',') : null;
 
   useEffect(() => {
     const params = {};
     if (startDate) params.start_date = startDate;
     if (endDate) params.end_date = endDate;
+    if (sectionsParam) params.sections = sectionsParam;
 
     API.get('/api/dashboard/', { params })
       .then(res => {
@@ -327,17 +299,18 @@ export function useGetDashboardData(startDate = null, endDate = null) {
       .finally(() => {
         setLoading(false);
       });
-  }, [startDate, endDate]);
+  }, [startDate, endDate, sectionsParam]);
 
   return [data, loading, error];
 }
 
 // Manual fetch function (for refreshing data)
-export async function getDashboardData(startDate = null, endDate = null) {
+export async function getDashboardData(startDate = null, endDate = null, sections = null) {
   try {
     const params = {};
     if (startDate) params.start_date = startDate;
     if (endDate) params.end_date = endDate;
+    if (sections) params.sections = sections.join(',');
 
     const res = await API.get('/api/dashboard/', { params });
     return res.data;